@@ -156,6 +156,9 @@ class AstroDataError(Exception):
     pass
 
 
+TagCacheInfo = namedtuple('TagCacheInfo', 'hits misses hit_rate')
+
+
 class DataProvider(metaclass=ABCMeta):
     """
     Abstract class describing the minimal interface that `DataProvider`
@@ -369,6 +372,21 @@ class DataProvider(metaclass=ABCMeta):
         """
         return ()
 
+    def _tag_cache_key(self):
+        """
+        Returns a hashable token describing the current state of the metadata
+        that tags are computed from. `AstroData` will reuse a previously
+        computed tag set for as long as this token does not change.
+
+        The default implementation returns `None`, meaning that the state
+        cannot be tracked and that tags must be recomputed on every access.
+
+        Returns
+        --------
+        A hashable object, or `None`
+        """
+        return None
+
     @abstractproperty
     def data(self):
         """
@@ -441,11 +459,35 @@ class AstroData:
     # Simply a value that nobody is going to try to set an NDData attribute to
     _IGNORE = -23
 
+    # Hit/miss counters for the tag cache, shared by all the instances
+    _tag_cache_stats = {'hits': 0, 'misses': 0}
+
+    # Registry of descriptor names and tag methods. Filled in for every
+    # derived class when it is defined (see __init_subclass__)
+    _descriptors = ()
+    _tag_methods = ()
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Builds the registry of descriptors and tag methods for a new derived
+        class, so that they don't need to be looked up again for every
+        instance. Methods added to the class after its definition won't be
+        part of the registry.
+        """
+        super().__init_subclass__(**kwargs)
+        cls._descriptors = tuple(
+            mname for (mname, method) in
+            inspect.getmembers(cls, lambda x: hasattr(x, 'descriptor_method')))
+        cls._tag_methods = tuple(
+            method for (mname, method) in
+            inspect.getmembers(cls, lambda x: hasattr(x, 'tag_method')))
+
     def __init__(self, provider):
         if not isinstance(provider, DataProvider):
             raise ValueError("AstroData is initialized with a DataProvider object. You may want to use ad.open('...') instead")
         self._dataprov = provider
         self._processing_tags = False
+        self._tag_cache = None
 
     def __deepcopy__(self, memo):
         """
@@ -480,14 +522,10 @@ class AstroData:
         self._processing_tags = True
         try:
             results = []
-            # Calling inspect.getmembers on `self` would trigger all the properties (tags,
-            # phu, hdr, etc.), and that's undesirable. To prevent that, we'll inspect the
-            # *class*. But that returns us unbound methods. We use `method.__get__(self)` to
-            # get a bound version.
-            #
-            # It's a bit of a roundabout way to get to what we want, but it's better than
-            # the option...
-            for mname, method in inspect.getmembers(self.__class__, lambda x: hasattr(x, 'tag_method')):
+            # The registry holds the *unbound* tag methods of the class (they were
+            # collected when the class was defined). We use `method.__get__(self)`
+            # to get a bound version.
+            for method in self._tag_methods:
                 ts = method.__get__(self)()
                 plus, minus, blocked_by, blocks, if_present = ts
                 if plus or minus or blocks:
@@ -524,8 +562,46 @@ class AstroData:
     def tags(self):
         """
         A set of strings that represent the tags defining this instance
+
+        The tag set is cached, and computed again only when the `DataProvider`
+        reports that the underlying metadata (eg. the headers) has changed.
+        """
+        key = self._dataprov._tag_cache_key()
+        if key is not None and self._tag_cache is not None:
+            cached_key, cached_tags = self._tag_cache
+            if cached_key == key:
+                self._tag_cache_stats['hits'] += 1
+                return set(cached_tags)
+
+        self._tag_cache_stats['misses'] += 1
+        tags = self.__process_tags()
+        # Don't store the results of a recursive call
+        if key is not None and not self._processing_tags:
+            self._tag_cache = (key, frozenset(tags))
+        return tags
+
+    @staticmethod
+    def tag_cache_info(reset=False):
+        """
+        Returns statistics about the use of the tag cache by all the
+        `AstroData` instances.
+
+        Args
+        -----
+        reset : bool
+            If True, reset the counters after reading them
+
+        Returns
+        --------
+        A `TagCacheInfo` named tuple with the number of hits, misses, and the
+        hit rate (fraction of accesses served from the cache)
         """
-        return self.__process_tags()
+        stats = AstroData._tag_cache_stats
+        hits, misses = stats['hits'], stats['misses']
+        total = hits + misses
+        if reset:
+            stats['hits'] = stats['misses'] = 0
+        return TagCacheInfo(hits, misses, hits / total if total else 0.)
 
     @property
     def descriptors(self):
@@ -537,9 +613,7 @@ class AstroData:
         --------
         A tuple of str
         """
-        members = inspect.getmembers(self.__class__,
-                                     lambda x: hasattr(x, 'descriptor_method'))
-        return tuple(mname for (mname, method) in members)
+        return self._descriptors
 
     def __iter__(self):
         for single in self._dataprov:
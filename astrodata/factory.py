@@ -5,6 +5,7 @@ from copy import deepcopy
 from astropy.io import fits
 
 from .core import AstroDataError
+from .fits import read_headers
 
 LOGGER = logging.getLogger('AstroData Factory')
 
@@ -21,16 +22,25 @@ class AstroDataFactory:
 
     def __init__(self):
         self._registry = set()
+        # Classes declaring `_match_keywords`, indexed by (keyword, value)
+        self._keyed = {}
+        # Classes that need to be tried against every dataset
+        self._unkeyed = set()
+
+    _header_openers = (
+        read_headers,
+    )
 
     @staticmethod
-    def _openFile(source):
+    def _openFile(source, headers_only=False):
         """
         Internal static method that takes a `source`, assuming that it is a
         string pointing to a file to be opened.
 
         If this is the case, it will try to open the file and return an
         instance of the appropriate native class to be able to manipulate it
-        (eg. ``HDUList``).
+        (eg. ``HDUList``). With `headers_only`, the openers used are those
+        that read just the metadata.
 
         If `source` is not a string, it will be returned verbatim, assuming
         that it represents an already opened file.
@@ -41,8 +51,10 @@ class AstroDataFactory:
             if stats.st_size == 0:
                 LOGGER.warning("File {} is zero size".format(source))
 
+            openers = (AstroDataFactory._header_openers if headers_only
+                       else AstroDataFactory._file_openers)
             # try vs all handlers
-            for func in AstroDataFactory._file_openers:
+            for func in openers:
                 try:
                     return func(source)
                 except Exception:
@@ -58,13 +70,57 @@ class AstroDataFactory:
         """
         Add a new class to the AstroDataFactory registry. It will be used when
         instantiating an AstroData class for a FITS file.
+
+        A class may define a `_match_keywords` dictionary, mapping primary
+        header keywords to the values (case insensitive) that the datasets it
+        matches must have, eg. ``{'INSTRUME': ('GMOS-N', 'GMOS-S')}``. The
+        factory will then skip calling its `_matches_data` for any other
+        dataset.
         """
         if not hasattr(cls, '_matches_data'):
             raise AttributeError("Class '{}' has no '_matches_data' method"
                                  .format(cls.__name__))
         self._registry.add(cls)
 
-    def getAstroData(self, source):
+        keywords = getattr(cls, '_match_keywords', None)
+        if keywords:
+            for keyword, values in keywords.items():
+                for value in values:
+                    key = (keyword, value.upper())
+                    self._keyed.setdefault(key, set()).add(cls)
+        else:
+            self._unkeyed.add(cls)
+
+    @staticmethod
+    def _class_order(cls):
+        # More specific classes (longer MRO) go first. The names are used
+        # only to make the order deterministic
+        return (-len(cls.__mro__), cls.__module__, cls.__qualname__)
+
+    def _candidates(self, opened):
+        """
+        Returns the registered classes that may match `opened`, sorted so
+        that derived classes come before their bases.
+
+        Classes that declare `_match_keywords` are only considered if the
+        primary header has one of the listed values for that keyword. The
+        rest are always considered.
+        """
+        try:
+            phu = opened[0].header
+        except Exception:
+            phu = {}
+
+        shortlist = set(self._unkeyed)
+        for keyword in {kw for (kw, value) in self._keyed}:
+            value = phu.get(keyword)
+            if value is not None:
+                key = (keyword, str(value).strip().upper())
+                shortlist.update(self._keyed.get(key, ()))
+
+        return sorted(shortlist, key=self._class_order)
+
+    def getAstroData(self, source, headers_only=False):
         """
         Takes either a string (with the path to a file) or an HDUList as input,
         and tries to return an AstroData instance.
@@ -72,32 +128,38 @@ class AstroDataFactory:
         It will raise exceptions if the file is not found, or if there is no
         match for the HDUList, among the registered AstroData classes.
 
+        If `headers_only` is True (and `source` is a path), only the headers
+        are read, skipping over the data units. This is much faster when
+        only tags and descriptors are needed. The resulting object is a
+        normal one otherwise: the pixel data is read from the file if (and
+        when) it is accessed.
+
         Returns an instantiated object, or raises AstroDataError if it was
         not possible to find a match
 
         """
-        opened = self._openFile(source)
-        candidates = []
-        for adclass in self._registry:
+        opened = self._openFile(source, headers_only=headers_only)
+        final_candidates = []
+        for adclass in self._candidates(opened):
+            # We want to keep only the more specific classes. As derived
+            # classes are tried first, there's no need to test the base
+            # classes of those that have already matched.
+            if any(adclass in cnd.__mro__ for cnd in final_candidates):
+                continue
             try:
                 if adclass._matches_data(opened):
-                    candidates.append(adclass)
+                    final_candidates.append(adclass)
             except Exception:  # Some problem opening this
                 pass
 
-        # For every candidate in the list, remove the ones that are base classes
-        # for other candidates. That way we keep only the more specific ones.
-        final_candidates = []
-        for cnd in candidates:
-            if any(cnd in x.mro() for x in candidates if x != cnd):
-                continue
-            final_candidates.append(cnd)
-
         if len(final_candidates) > 1:
             raise AstroDataError("More than one class is candidate for this dataset")
         elif not final_candidates:
             raise AstroDataError("No class matches this dataset")
 
+        if headers_only and isinstance(source, str):
+            # The headers have been read already. Don't read them again
+            return final_candidates[0].load(opened)
         return final_candidates[0].load(source)
 
     def createFromScratch(self, phu, extensions=None):
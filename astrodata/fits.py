@@ -1,23 +1,28 @@
-import gc
+import bz2
+import gzip
 import inspect
 import logging
 import os
 import re
+import threading
 import traceback
 import warnings
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from functools import partial, wraps
-from itertools import zip_longest, product as cart_product
+from functools import wraps
+from itertools import count, zip_longest, product as cart_product
 
 from .core import AstroData, DataProvider, astro_data_descriptor
-from .nddata import NDAstroData as NDDataObject, ADVarianceUncertainty
+from .nddata import NDAstroData as NDDataObject, ADVarianceUncertainty, is_lazy
 
 import astropy
 from astropy.io import fits
 from astropy.io.fits import HDUList, DELAYED
-from astropy.io.fits import PrimaryHDU, ImageHDU, BinTableHDU
+from astropy.io.fits import PrimaryHDU, ImageHDU, BinTableHDU, CompImageHDU
 from astropy.io.fits import Column, FITS_rec
+from astropy.io.fits.hdu.base import _BaseHDU
+from astropy.io.fits.hdu.image import _ImageBaseHDU
 from astropy.io.fits.hdu.table import _TableBaseHDU
 from astropy import units as u
 # NDDataRef is still not in the stable astropy, but this should be the one
@@ -71,6 +76,55 @@ class KeywordCallableWrapper:
         return wrapper
 
 
+# Source of modification stamps for the tracked headers. Every stamp is unique
+# within the process, which means that a header replaced by a new object will
+# never be confused with the old one.
+_header_stamps = count(1)
+
+
+def _stamped(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._stamp = next(_header_stamps)
+    return wrapper
+
+
+class _TrackedHeader(fits.Header):
+    """
+    A `fits.Header` that records a new stamp each time it is modified through
+    its public interface. Used to find out if the metadata has changed since
+    something (eg. the tag set) was derived from it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stamp = next(_header_stamps)
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', 'clear', 'set', 'pop',
+              'popitem', 'setdefault', 'update', 'append', 'extend', 'insert',
+              'remove', 'rename_keyword', 'add_history', 'add_comment',
+              'add_blank', 'strip'):
+    setattr(_TrackedHeader, _name, _stamped(getattr(fits.Header, _name)))
+del _name
+
+
+def header_stamp(header):
+    """
+    Returns the current modification stamp for `header`, or `None` if the
+    header cannot be tracked. Plain `fits.Header` instances are turned into
+    tracked ones in place, which keeps any other references to them valid.
+    """
+    if type(header) is fits.Header:
+        header.__class__ = _TrackedHeader
+        header._stamp = next(_header_stamps)
+    elif not isinstance(header, _TrackedHeader):
+        return None
+    return header._stamp
+
+
 class FitsHeaderCollection:
     """
     FitsHeaderCollection(headers)
@@ -494,6 +548,7 @@ class FitsProviderProxy(DataProvider):
         # and know what we're doing, isn't it?
         if hasattr(value, 'shape'):
             ext._data = value
+            ext._new_version()
         else:
             raise AttributeError("Trying to assign data to be something with no shape")
 
@@ -564,6 +619,9 @@ class FitsProviderProxy(DataProvider):
         # parent class...
         self._provider._crop_nd(nd, x1, y1, x2, y2)
 
+    def _tag_cache_key(self):
+        return self._provider._tag_cache_key(indices=self._mapping)
+
     def _crop_impl(self, x1, y1, x2, y2, nds=None):
         # needed because __getattr__ breaks finding private methods in the
         # parent class...
@@ -734,9 +792,43 @@ class FitsProvider(DataProvider):
             for n in indices:
                 self._set_nddata(n, operator(self._nddata[n], operand))
 
+    def _planes_overlap(self, operand, indices):
+        """
+        Checks whether any pixel plane of one of the extensions shares memory
+        with one of another extension, or of the operand, in which case
+        operating on the extensions in place could change the values used
+        for later ones.
+        """
+        planes = [[plane for plane in (nd.data, nd.variance, nd.mask)
+                   if plane is not None]
+                  for nd in (self._nddata[n] for n in indices)]
+        if isinstance(operand, AstroData):
+            nds = [operand.nddata] if operand.is_single else operand.nddata
+            others = [plane for nd in nds
+                      for plane in (nd.data, nd.variance, nd.mask)
+                      if plane is not None]
+        else:
+            others = [operand] if isinstance(operand, np.ndarray) else []
+        for n, ext_planes in enumerate(planes):
+            later = [plane for p in planes[n+1:] for plane in p] + others
+            if any(np.may_share_memory(plane, other)
+                   for plane in ext_planes for other in later):
+                return True
+        return False
+
     def _standard_nddata_op(self, fn, operand, indices=None):
-        return self._oper(partial(fn, handle_mask=np.bitwise_or, handle_meta='first_found'),
-                          operand, indices)
+        if indices is None:
+            indices = tuple(range(len(self._nddata)))
+        inplace = not self._planes_overlap(operand, indices)
+
+        def operator(nddata, operand):
+            # Reuse the existing arrays whenever the operand allows it
+            if inplace and nddata._arithmetic_inplace(fn.__name__, operand):
+                return nddata
+            return fn(nddata, operand, handle_mask=np.bitwise_or,
+                      handle_meta='first_found')
+
+        return self._oper(operator, operand, indices)
 
     def __iadd__(self, operand):
         self._standard_nddata_op(NDDataObject.add, operand)
@@ -805,10 +897,15 @@ class FitsProvider(DataProvider):
                 print(".{:13} {:11} {}".format(attr[:13], type_[:11], dim))
 
     def _pixel_info(self, indices):
+        # Use the private attributes of the NDData objects, and the shape and
+        # type of lazy loadables, to avoid reading the pixels just for this.
+        # Lazy planes are reported with the type they'll have once loaded
+        lazy_types = {'variance': ADVarianceUncertainty.__name__,
+                      'mask': np.ndarray.__name__}
         for idx, obj in ((n, self._nddata[k]) for (n, k) in enumerate(indices)):
             other_objects = []
-            uncer = obj.uncertainty
-            fixed = (('variance', None if uncer is None else uncer), ('mask', obj.mask))
+            uncer = obj._uncertainty
+            fixed = (('variance', None if uncer is None else uncer), ('mask', obj._mask))
             for name, other in fixed + tuple(sorted(obj.meta['other'].items())):
                 if other is not None:
                     if isinstance(other, Table):
@@ -820,7 +917,7 @@ class FitsProvider(DataProvider):
                     else:
                         dim = ''
                         if hasattr(other, 'dtype'):
-                            dt = other.dtype.name
+                            dt = np.dtype(other.dtype).name
                             dim = str(other.shape)
                         elif hasattr(other, 'data'):
                             dt = other.data.dtype.name
@@ -830,8 +927,11 @@ class FitsProvider(DataProvider):
                             dim = str(other.array.shape)
                         else:
                             dt = 'unknown'
+                        type_name = type(other).__name__
+                        if is_lazy(other):
+                            type_name = lazy_types.get(name, type_name)
                         other_objects.append(dict(
-                            attr=name, type=type(other).__name__,
+                            attr=name, type=type_name,
                             dim=dim, data_type = dt
                         ))
 
@@ -840,8 +940,8 @@ class FitsProvider(DataProvider):
                     main = dict(
                         content = 'science',
                         type = type(obj).__name__,
-                        dim = '({})'.format(', '.join(str(s) for s in obj.data.shape)),
-                        data_type = obj.data.dtype.name
+                        dim = '({})'.format(', '.join(str(s) for s in obj.shape)),
+                        data_type = np.dtype(obj._data.dtype).name
                     ),
                     other = other_objects
             )
@@ -1017,6 +1117,15 @@ class FitsProvider(DataProvider):
     def header(self):
         return self._get_raw_headers(with_phu=True)
 
+    def _tag_cache_key(self, indices=None):
+        stamps = []
+        for header in self._get_raw_headers(with_phu=True, indices=indices):
+            stamp = header_stamp(header)
+            if stamp is None:
+                return None
+            stamps.append(stamp)
+        return tuple(stamps)
+
     @property
     def nddata(self):
         return self._nddata
@@ -1314,7 +1423,7 @@ def fits_ext_comp_key(ext):
     """
     Returns a pair (integer, string) that will be used to sort extensions
     """
-    if isinstance(ext, PrimaryHDU):
+    if _is_primary(ext):
         # This will guarantee that the primary HDU goes first
         ret = (-1, "")
     else:
@@ -1399,6 +1508,194 @@ class FitsLazyLoadable:
         return dtype
 
 
+FITS_BLOCK = 2880
+
+
+class _DeferredFile:
+    """
+    Opens a FITS file (memory mapped) each time that its contents are
+    requested. The file should be closed once they have been read: arrays
+    that are memory mapped remain valid after that.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        return fits.open(self.path, memmap=True, do_not_scale_image_data=True,
+                         mode='readonly')
+
+
+class DeferredHDU:
+    """
+    Stand-in for an image HDU whose header has been read, but not its data.
+
+    It provides enough of the `ImageHDU` interface to be wrapped in a
+    `FitsLazyLoadable`. The file is opened only when the pixels (`data` or
+    `section`) are requested, at which point they are read from the HDU
+    at the same position in the file, and then closed again.
+    """
+    def __init__(self, deferred_file, index, header, primary=False):
+        self._file = deferred_file
+        self._index = index
+        self.header = header
+        self.is_primary = primary
+
+    def _read(self, read):
+        """Returns read(hdu) for the HDU in the file, closing it afterwards"""
+        with self._file.open() as hdulist:
+            return read(hdulist[self._index])
+
+    @property
+    def data(self):
+        if not self.header.get('NAXIS'):
+            return None
+        return self._read(lambda hdu: hdu.data)
+
+    @property
+    def section(self):
+        return _DeferredSection(self)
+
+    @property
+    def shape(self):
+        naxis = self.header.get('NAXIS', 0)
+        return tuple(self.header['NAXIS{}'.format(n)]
+                     for n in range(naxis, 0, -1))
+
+    @property
+    def _orig_bitpix(self):
+        return self.header['BITPIX']
+
+    @property
+    def _orig_bscale(self):
+        return self.header.get('BSCALE', 1)
+
+    @property
+    def _orig_bzero(self):
+        return self.header.get('BZERO', 0)
+
+    # fits.open maps unsigned integers by default
+    _uint = True
+    _dtype_for_bitpix = _ImageBaseHDU._dtype_for_bitpix
+
+
+class _DeferredSection:
+    """Reads sections of the pixels of a `DeferredHDU` when indexed"""
+    def __init__(self, deferred_hdu):
+        self._deferred_hdu = deferred_hdu
+
+    def __getitem__(self, item):
+        def read(hdu):
+            # Compressed images may not support sections
+            section = getattr(hdu, 'section', None)
+            return hdu.data[item] if section is None else section[item]
+        return self._deferred_hdu._read(read)
+
+
+class HeaderOnlyHDUList(list):
+    """
+    List of HDUs returned by `read_headers`. The image HDUs are
+    `DeferredHDU` instances, while tables are read in full.
+    """
+    def __init__(self, units, path):
+        super().__init__(units)
+        self.path = path
+
+
+def _data_size(header):
+    """Size in bytes of the data unit described by `header`, with padding"""
+    naxis = header.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    size = 1
+    for n in range(1, naxis + 1):
+        size *= header['NAXIS{}'.format(n)]
+    size = (abs(header['BITPIX']) // 8 * header.get('GCOUNT', 1) *
+            (header.get('PCOUNT', 0) + size))
+    return -(-size // FITS_BLOCK) * FITS_BLOCK
+
+
+def _open_raw(path):
+    with open(path, 'rb') as fileobj:
+        magic = fileobj.read(3)
+    if magic[:2] == b'\x1f\x8b':
+        return gzip.open(path, 'rb')
+    elif magic == b'BZh':
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_headers(path):
+    """
+    Reads all the headers from a FITS file, skipping over the image data.
+
+    Only the headers are parsed: the data units for images are skipped
+    with seeks, and the images themselves are represented by
+    `DeferredHDU` objects that will read the pixels if they are ever
+    requested. This includes tile-compressed images, whose headers are
+    converted to those of the uncompressed images. Other table extensions
+    (typically small) are read in full.
+
+    Parameters
+    ----------
+    path : str
+        Path to a (possibly gzip or bzip2 compressed) FITS file
+
+    Returns
+    -------
+    `HeaderOnlyHDUList`
+    """
+    deferred = _DeferredFile(path)
+    units = []
+    with _open_raw(path) as fileobj:
+        while True:
+            start = fileobj.tell()
+            try:
+                header = fits.Header.fromfile(fileobj)
+            except EOFError:
+                break
+            size = _data_size(header)
+            xtension = header.get('XTENSION', 'IMAGE').strip().upper()
+            if xtension == 'IMAGE':
+                units.append(DeferredHDU(deferred, len(units), header,
+                                         primary=not units))
+                fileobj.seek(size, os.SEEK_CUR)
+            elif xtension == 'BINTABLE' and header.get('ZIMAGE'):
+                header = CompImageHDU(data=DELAYED, header=header).header.copy()
+                units.append(DeferredHDU(deferred, len(units), header))
+                fileobj.seek(size, os.SEEK_CUR)
+            else:
+                end = fileobj.tell() + size
+                fileobj.seek(start)
+                units.append(_BaseHDU.fromstring(fileobj.read(end - start)))
+
+    if not units:
+        raise OSError("Empty or corrupt FITS file: {}".format(path))
+
+    return HeaderOnlyHDUList(units, path)
+
+
+def _read_deferred(unit):
+    """Turns a `DeferredHDU` into an `ImageHDU`, reading its data"""
+    if isinstance(unit, DeferredHDU):
+        return ImageHDU(data=unit.data, header=unit.header)
+    return unit
+
+
+def _has_data(unit):
+    if isinstance(unit, DeferredHDU):
+        return bool(unit.header.get('NAXIS'))
+    return unit.data is not None
+
+
+def _is_primary(unit):
+    return isinstance(unit, PrimaryHDU) or getattr(unit, 'is_primary', False)
+
+
+def _is_image(unit):
+    return (isinstance(unit, (ImageHDU, DeferredHDU)) and
+            not getattr(unit, 'is_primary', False))
+
+
 class FitsLoader:
 
     def __init__(self, cls=FitsProvider):
@@ -1410,7 +1707,7 @@ class FitsLoader:
         highest_ver = 0
         recognized = set()
 
-        if len(hdulist) > 1 or (len(hdulist) == 1 and hdulist[0].data is None):
+        if len(hdulist) > 1 or (len(hdulist) == 1 and not _has_data(hdulist[0])):
             # MEF file
             for n, unit in enumerate(hdulist):
                 if extname_parser:
@@ -1419,7 +1716,7 @@ class FitsLoader:
                 eh = unit.header.get('EXTNAME')
                 if ev not in (-1, None) and eh is not None:
                     highest_ver = max(highest_ver, unit.header['EXTVER'])
-                elif not isinstance(unit, PrimaryHDU):
+                elif not _is_primary(unit):
                     continue
 
                 new_list.append(unit)
@@ -1428,7 +1725,7 @@ class FitsLoader:
             for unit in hdulist:
                 if unit in recognized:
                     continue
-                elif isinstance(unit, ImageHDU):
+                elif _is_image(unit):
                     highest_ver += 1
                     if 'EXTNAME' not in unit.header:
                         unit.header['EXTNAME'] = (default_extension, 'Added by AstroData')
@@ -1440,10 +1737,13 @@ class FitsLoader:
         else:
             # Uh-oh, a single image FITS file
             new_list.append(PrimaryHDU(header=hdulist[0].header))
-            image = ImageHDU(header=hdulist[0].header, data=hdulist[0].data)
-            # Fudge due to apparent issues with assigning ImageHDU from data
-            image._orig_bscale = hdulist[0]._orig_bscale
-            image._orig_bzero = hdulist[0]._orig_bzero
+            if isinstance(hdulist[0], DeferredHDU):
+                image = DeferredHDU(hdulist[0]._file, 0, hdulist[0].header.copy())
+            else:
+                image = ImageHDU(header=hdulist[0].header, data=hdulist[0].data)
+                # Fudge due to apparent issues with assigning ImageHDU from data
+                image._orig_bscale = hdulist[0]._orig_bscale
+                image._orig_bzero = hdulist[0]._orig_bzero
 
             for keyw in ('SIMPLE', 'EXTEND'):
                 if keyw in image.header:
@@ -1452,13 +1752,20 @@ class FitsLoader:
             image.header['EXTVER'] = (1, 'Added by AstroData')
             new_list.append(image)
 
-        return HDUList(sorted(new_list, key=fits_ext_comp_key))
+        new_list = sorted(new_list, key=fits_ext_comp_key)
+        if isinstance(hdulist, HeaderOnlyHDUList):
+            return HeaderOnlyHDUList(new_list, hdulist.path)
+        return HDUList(new_list)
 
-    def load(self, source, extname_parser=None):
+    def load(self, source, extname_parser=None, headers_only=False):
         """
         Takes either a string (with the path to a file) or an HDUList as input, and
         tries to return a populated FitsProvider (or descendant) instance.
 
+        If `headers_only` is True (or `source` is a `HeaderOnlyHDUList`), only
+        the headers are read from the file. The pixel data is read if and when
+        it is accessed.
+
         It will raise exceptions if the file is not found, or if there is no match
         for the HDUList, among the registered AstroData classes.
         """
@@ -1466,9 +1773,15 @@ class FitsLoader:
         provider = self._cls()
 
         if isinstance(source, str):
-            hdulist = fits.open(source, memmap=True,
-                                do_not_scale_image_data=True, mode='readonly')
+            if headers_only:
+                hdulist = read_headers(source)
+            else:
+                hdulist = fits.open(source, memmap=True,
+                                    do_not_scale_image_data=True, mode='readonly')
             provider.path = source
+        elif isinstance(source, HeaderOnlyHDUList):
+            hdulist = source
+            provider.path = source.path
         else:
             hdulist = source
             try:
@@ -1477,11 +1790,17 @@ class FitsLoader:
                 provider.path = None
 
         def_ext = self._cls.default_extension
-        _file = hdulist._file
-        hdulist = self._prepare_hdulist(hdulist, default_extension=def_ext,
-                                        extname_parser=extname_parser)
-        if _file is not None:
-            hdulist._file = _file
+        if isinstance(hdulist, HeaderOnlyHDUList):
+            lazy = True
+            hdulist = self._prepare_hdulist(hdulist, default_extension=def_ext,
+                                            extname_parser=extname_parser)
+        else:
+            _file = hdulist._file
+            lazy = _file is not None and _file.memmap
+            hdulist = self._prepare_hdulist(hdulist, default_extension=def_ext,
+                                            extname_parser=extname_parser)
+            if _file is not None:
+                hdulist._file = _file
 
         # Initialize the object containers to a bare minimum
         if 'ORIGNAME' not in hdulist[0].header and provider.orig_filename is not None:
@@ -1516,7 +1835,7 @@ class FitsLoader:
                 else:
                     parts['other'].append(extra_unit)
 
-            if hdulist._file is not None and hdulist._file.memmap:
+            if lazy:
                 nd = NDDataObject(
                         data = FitsLazyLoadable(parts['data']),
                         uncertainty = None if parts['uncertainty'] is None else FitsLazyLoadable(parts['uncertainty']),
@@ -1531,22 +1850,130 @@ class FitsLoader:
                         provider.append(item, name=item.header['EXTNAME'], add_to=nd)
 
             for other in parts['other']:
-                provider.append(other, name=other.header['EXTNAME'], add_to=nd)
+                provider.append(_read_deferred(other),
+                                name=other.header['EXTNAME'], add_to=nd)
 
         for other in hdulist:
             if other in seen:
                 continue
             name = other.header.get('EXTNAME')
             try:
-                added = provider.append(other, name=name, reset_ver=False)
+                added = provider.append(_read_deferred(other), name=name,
+                                        reset_ver=False)
             except ValueError as e:
                 print(str(e)+". Discarding "+name)
 
         return provider
 
 
-def windowedOp(fn, sequence, kernel, shape=None, dtype=None,
-               with_uncertainty=False, with_mask=False):
+def _itemsize(item):
+    try:
+        return np.dtype(item.dtype).itemsize
+    except AttributeError:  # Non-lazy uncertainty
+        return item.array.dtype.itemsize
+
+
+def _read_window(nddata, section):
+    """
+    Reads a section of an NDAstroData object (which may be lazily loaded)
+    into an in-memory NDAstroData object.
+    """
+    window = nddata.window[section]
+    result = NDDataObject(window.data, mask=window.mask, unit=nddata.unit)
+    variance = window.variance
+    if variance is not None:
+        result.variance = variance
+    return result
+
+
+def tile_kernel(sequence, shape, memory=None, max_workers=1, temporaries=0):
+    """
+    Computes the size of the tiles in which a stack of NDAstroData objects
+    has to be split so that processing `max_workers` tiles at the same time
+    stays within a memory budget. Tiles cover whole rows (ie. they're
+    split along the first axis), and there are at least as many tiles as
+    workers.
+
+    Parameters
+    ----------
+    sequence : list of NDAstroData
+        The objects that will be processed together
+    shape : tuple
+        Shape of the objects
+    memory : int or None
+        Memory budget (bytes) for the inputs of the tiles being processed
+        at any given time. None means no limit.
+    max_workers : int
+        Number of tiles processed at the same time
+    temporaries : int
+        Bytes per input pixel of the temporary arrays that each worker
+        creates while processing its tile
+
+    Returns
+    -------
+    tuple
+        The kernel, to be passed to `windowedOp`
+    """
+    rows = shape[0]
+    if memory is not None:
+        pixels_per_row = int(np.prod(shape[1:], dtype=int))
+        # Each element's section is read from disk and then copied into the
+        # stacked (float32 data and variance, uint16 mask) arrays
+        bytes_per_pixel = temporaries * len(sequence)
+        for nddata in sequence:
+            for item, stacked in ((nddata._data, 4), (nddata._uncertainty, 4),
+                                  (nddata._mask, 2)):
+                if item is not None:
+                    bytes_per_pixel += _itemsize(item) + stacked
+        bytes_per_row = max(bytes_per_pixel * pixels_per_row, 1)
+        rows = max(memory // (max_workers * bytes_per_row), 1)
+    rows = min(rows, -(-shape[0] // max_workers))
+    return (rows,) + tuple(shape[1:])
+
+
+def windowedOp(fn, sequence, kernel=None, shape=None, dtype=None,
+               with_uncertainty=False, with_mask=False, memory=None,
+               max_workers=1, temporaries=0):
+    """
+    Applies a function to a sequence of NDAstroData objects, tile by tile,
+    so that only the sections of the inputs corresponding to the tiles being
+    processed need to be in memory. The results are written into a single
+    output object.
+
+    Parameters
+    ----------
+    fn : callable
+        Function that takes a sequence of NDData-like objects (the sections
+        of the inputs) and returns an NDData-like object
+    sequence : list of NDAstroData
+        The inputs. Lazily-loaded (memory mapped) inputs are read section
+        by section.
+    kernel : tuple or None
+        Shape of the tiles. If None, it is calculated by `tile_kernel`
+        from `memory` and `max_workers`.
+    shape : tuple or None
+        Shape of the output. If None, the (common) shape of the inputs.
+    dtype : dtype or None
+        Type of the output data
+    with_uncertainty : bool
+        Create a variance plane in the output?
+    with_mask : bool
+        Create a mask plane in the output?
+    memory : int or None
+        Memory budget (bytes) used to calculate `kernel`
+    max_workers : int or None
+        Number of threads processing tiles at the same time. None means
+        one per CPU. `fn` must be thread-safe if this is not 1. Threads
+        only help if `fn` spends most of its time in code that releases
+        the GIL, like numpy operations and `cyclip`.
+    temporaries : int
+        Bytes per input pixel of the temporary arrays that `fn` creates,
+        included in the memory budget
+
+    Returns
+    -------
+    NDAstroData
+    """
     def generate_boxes(shape, kernel):
         if len(shape) != len(kernel):
             raise AssertionError("Incompatible shape ({}) and kernel ({})"
@@ -1564,6 +1991,13 @@ def windowedOp(fn, sequence, kernel, shape=None, dtype=None,
     if dtype is None:
         dtype = sequence[0].window[:1, :1].data.dtype
 
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if kernel is None:
+        kernel = tile_kernel(sequence, shape, memory=memory,
+                             max_workers=max_workers, temporaries=temporaries)
+
     result = NDDataObject(
         np.empty(shape, dtype=dtype),
         uncertainty=(ADVarianceUncertainty(np.zeros(shape, dtype=dtype))
@@ -1575,17 +2009,32 @@ def windowedOp(fn, sequence, kernel, shape=None, dtype=None,
     result.meta['other'] = OrderedDict()
     result.meta['other_header'] = {}
 
+    # Reading from the files is serialized. The processing of the tiles
+    # (and writing of the output, in non-overlapping sections) is not.
+    read_lock = threading.Lock()
+
+    def process(coords):
+        # The coordinates come as ((x1, x2), (y1, y2), ...)
+        section = tuple([slice(start, end) for (start, end) in coords])
+        with read_lock:
+            tiles = [_read_window(element, section) for element in sequence]
+        result.set_section(section, fn(tiles))
+
     # The Astropy logger's "INFO" messages aren't warnings, so have to fudge
     log_level = astropy.logger.conf.log_level
     astropy.log.setLevel(astropy.logger.WARNING)
-    for coords in generate_boxes(shape, kernel):
-        # The coordinates come as ((x1, x2, ..., xn), (y1, y2, ..., yn), ...)
-        # Zipping them will get us a more desirable ((x1, y1, ...), (x2, y2, ...), ..., (xn, yn, ...))
-        # box = list(zip(*coords))
-        section = tuple([slice(start, end) for (start, end) in coords])
-        result.set_section(section, fn(element.window[section] for element in sequence))
-        gc.collect()
-    astropy.log.setLevel(log_level)  # and reset
+    try:
+        boxes = generate_boxes(shape, kernel)
+        if max_workers == 1:
+            for coords in boxes:
+                process(coords)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Consume the iterator, to propagate exceptions
+                for _ in executor.map(process, boxes):
+                    pass
+    finally:
+        astropy.log.setLevel(log_level)  # and reset
 
     return result
 
@@ -6,6 +6,8 @@ implementing windowing and on-the-fly data scaling.
 
 import warnings
 from copy import deepcopy
+from itertools import count
+from numbers import Number
 
 from astropy.nddata import (NDData, NDSlicingMixin, NDArithmeticMixin,
                             VarianceUncertainty)
@@ -15,6 +17,12 @@ import numpy as np
 
 __all__ = ['NDAstroData']
 
+# Versions of the pixel planes of NDAstroData objects (never reused)
+_versions = count(1)
+
+_INPLACE_UFUNCS = {'add': np.add, 'subtract': np.subtract,
+                   'multiply': np.multiply, 'divide': np.true_divide}
+
 
 class ADVarianceUncertainty(VarianceUncertainty):
     """
@@ -93,6 +101,25 @@ def is_lazy(item):
     return isinstance(item, ImageHDU) or (hasattr(item, 'lazy') and item.lazy)
 
 
+def _sample(array):
+    """
+    Returns a one-element stand-in for an array, to find the dtype of the
+    results of a calculation without doing it on the whole array. 0-d arrays
+    are kept as they are, since numpy casts them according to their values.
+    """
+    return array if array.ndim == 0 else np.zeros(1, dtype=array.dtype)
+
+
+def _result_dtype(ufunc, *arrays):
+    with np.errstate(all='ignore'):
+        return ufunc(*[_sample(array) for array in arrays]).dtype
+
+
+def _is_variance(uncertainty):
+    return uncertainty is None or (isinstance(uncertainty, VarianceUncertainty)
+                                   and uncertainty.unit is None)
+
+
 class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     """
     Implements ``NDData`` with all Mixins, plus some ``AstroData`` specifics.
@@ -159,6 +186,12 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
             self.data = data
         if is_lazy(uncertainty):
             self.uncertainty = uncertainty
+        self._new_version()
+
+    def __setstate__(self, state):
+        # Version numbers are only unique within a process
+        self.__dict__.update(state)
+        self._new_version()
 
     def __deepcopy__(self, memo):
         new = self.__class__(self._data if is_lazy(self._data) else deepcopy(self.data, memo),
@@ -185,6 +218,189 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
             uncertainty_correlation=uncertainty_correlation,
             compare_wcs=compare_wcs, **kwds)
 
+    def _arithmetic_inplace(self, operation, operand):
+        """
+        Performs one of the arithmetic operations in place, reusing the
+        existing data, variance, and mask arrays instead of allocating new
+        ones. The results are the same as those of the ``NDArithmeticMixin``
+        method with ``handle_mask=np.bitwise_or`` and
+        ``handle_meta='first_found'``: the variance is propagated (assuming
+        no correlation) with the same formulae, evaluated in the same order.
+        The only exception is division by an array, where B**4 is calculated
+        as the square of B**2, so the variance can differ in the last bit.
+
+        Only numbers, plain arrays, and ``NDData`` objects without units
+        and with no uncertainty or a variance are supported, and the results
+        must fit in the existing arrays (same shape and dtype). Otherwise
+        nothing is done and ``False`` is returned, so the caller can fall
+        back to the ``NDArithmeticMixin`` method.
+
+        Parameters
+        ----------
+        operation : str
+            "add", "subtract", "multiply", or "divide"
+        operand : number, `~numpy.ndarray`, or `~astropy.nddata.NDData`
+            the second operand
+
+        Returns
+        -------
+        bool
+            whether the operation was performed
+        """
+        ufunc = _INPLACE_UFUNCS[operation]
+        if isinstance(operand, NDData):
+            if operand.unit is not None or not _is_variance(operand.uncertainty):
+                return False
+            other_data = np.asarray(operand.data)
+            other_var = (None if operand.uncertainty is None
+                         else operand.uncertainty.array)
+            other_mask = operand.mask
+            # The astropy method zeroes any negative variance of the operand
+            if other_var is not None and np.any(other_var < 0):
+                return False
+        elif isinstance(operand, Number) or type(operand) is np.ndarray:
+            other_data = np.asarray(operand)
+            other_var = other_mask = None
+        else:
+            return False
+        if self.unit is not None or not _is_variance(self.uncertainty):
+            return False
+
+        data, variance, mask = self.data, self.variance, self.mask
+        scaling = operation in ('multiply', 'divide')
+        if variance is not None and variance.shape != data.shape:
+            return False
+        others = [array for array in (other_data, other_var, other_mask)
+                  if array is not None]
+        try:
+            if any(np.broadcast(data, array).shape != data.shape
+                   for array in others):
+                return False
+        except ValueError:
+            return False
+
+        # Work out which arrays get overwritten, and check the dtypes of the
+        # results are the same as those of the arrays they'll be written to
+        outputs = [data]
+        if _result_dtype(ufunc, data, other_data) != data.dtype:
+            return False
+        if variance is not None and (scaling or other_var is not None):
+            outputs.append(variance)
+            b = _sample(other_data)
+            with np.errstate(all='ignore'):
+                new_var = _sample(variance)
+                if scaling:
+                    new_var = b ** 2 * new_var
+                if other_var is not None:
+                    right = _sample(other_var)
+                    if scaling:
+                        right = _sample(data) ** 2 * right
+                    new_var = new_var + right
+                if operation == 'divide':
+                    new_var = new_var / b ** 4
+            if new_var.dtype != variance.dtype:
+                return False
+        if mask is not None and other_mask is not None:
+            outputs.append(mask)
+            if _result_dtype(np.bitwise_or, mask, other_mask) != mask.dtype:
+                return False
+        if not all(output.flags.writeable for output in outputs):
+            return False
+        if any(np.may_share_memory(output, array)
+               for output in outputs for array in others):
+            return False
+
+        # Variance first, as it needs the original data
+        new_var = variance
+        if scaling and (variance is not None or
+                        operation == 'divide' and other_var is not None):
+            other_squared = other_data ** 2
+        if scaling and other_var is not None:
+            new_var = np.square(data)
+            if _result_dtype(np.multiply, new_var, other_var) == new_var.dtype:
+                np.multiply(new_var, other_var, out=new_var)
+            else:
+                new_var = new_var * other_var
+            np.abs(new_var, out=new_var)
+        if scaling and variance is not None:
+            np.multiply(other_squared, variance, out=variance)
+            np.abs(variance, out=variance)
+            if new_var is not variance:
+                np.add(variance, new_var, out=variance)
+                new_var = variance
+        elif other_var is not None and not scaling:
+            if variance is None:
+                new_var = np.add(0, other_var)
+            else:
+                np.add(variance, other_var, out=variance)
+        if operation == 'divide' and new_var is not None:
+            # Squaring B**2 is much faster than np.power(B, 4) for arrays
+            divisor = (other_data ** 4 if other_data.ndim == 0 else
+                       np.square(other_squared, out=other_squared))
+            if _result_dtype(np.true_divide, new_var, divisor) == new_var.dtype:
+                np.true_divide(new_var, divisor, out=new_var)
+            else:
+                new_var = new_var / divisor
+
+        ufunc(data, other_data, out=data)
+        if other_var is not None or (scaling and variance is not None):
+            self.uncertainty = ADVarianceUncertainty(new_var, copy=False)
+
+        if other_mask is not None:
+            if mask is None:
+                self.mask = deepcopy(other_mask)
+            else:
+                np.bitwise_or(mask, other_mask, out=mask)
+        if isinstance(operand, NDData):
+            if not self.meta and operand.meta:
+                self.meta = deepcopy(operand.meta)
+            if self.wcs is None and operand.wcs is not None:
+                self._wcs = deepcopy(operand.wcs)
+        self._new_version()
+        return True
+
+    def _operate_inplace(self, operation, operand):
+        """
+        Performs an arithmetic operation in place if possible, and otherwise
+        with the ``NDArithmeticMixin`` method, replacing the contents of this
+        object with the result.
+        """
+        if not self._arithmetic_inplace(operation, operand):
+            result = getattr(self, operation)(operand, handle_meta='first_found')
+            self._data = result.data
+            self._unit = result.unit
+            self.uncertainty = result.uncertainty
+            self.mask = result.mask
+            self.meta = result.meta
+            self._wcs = result.wcs
+        return self
+
+    def __iadd__(self, operand):
+        return self._operate_inplace('add', operand)
+
+    def __isub__(self, operand):
+        return self._operate_inplace('subtract', operand)
+
+    def __imul__(self, operand):
+        return self._operate_inplace('multiply', operand)
+
+    def __itruediv__(self, operand):
+        return self._operate_inplace('divide', operand)
+
+    @property
+    def version(self):
+        """
+        A number that changes whenever the data, uncertainty or mask are
+        replaced, or modified by arithmetic or ``set_section()``. Versions
+        are never reused, even by other objects, so unlike the ids of the
+        arrays they can be used to key caches of results derived from them.
+        Changes made directly to the arrays are not tracked.
+        """
+        return self._version
+
+    def _new_version(self):
+        self._version = next(_versions)
+
     @property
     def window(self):
         """
@@ -214,7 +430,10 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
         if self._uncertainty is not None:
             if is_lazy(self._uncertainty):
                 if section is None:
+                    # Loading the variance doesn't make a new version
+                    version = self._version
                     self.uncertainty = ADVarianceUncertainty(self._uncertainty.data)
+                    self._version = version
                     return self.uncertainty
                 else:
                     return ADVarianceUncertainty(self._uncertainty[section])
@@ -255,6 +474,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
         if is_lazy(value):
             self.meta['header'] = value.header
         self._data = value
+        self._new_version()
 
     @property
     def uncertainty(self):
@@ -267,6 +487,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
                 value = value.__class__(value, copy=False)
             value.parent_nddata = self
         self._uncertainty = value
+        self._new_version()
 
     @property
     def mask(self):
@@ -275,6 +496,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     @mask.setter
     def mask(self, value):
         self._mask = value
+        self._new_version()
 
     @property
     def variance(self):
@@ -318,6 +540,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
             self.uncertainty.array[section] = input.uncertainty.array
         if self.mask is not None:
             self.mask[section] = input.mask
+        self._new_version()
 
     def __repr__(self):
         if is_lazy(self._data):
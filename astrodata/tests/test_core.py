@@ -1,4 +1,5 @@
 import operator
+import tracemalloc
 from copy import deepcopy
 
 import numpy as np
@@ -150,6 +151,62 @@ def test_arithmetic_inplace(op, res, res2, ad1, ad2):
         assert isinstance(ad[0].hdr, fits.Header)
 
 
+def test_arithmetic_reuses_arrays(ad1, ad2):
+    ad1[0].variance = np.ones(SHAPE)
+    ad1[0].mask = np.zeros(SHAPE, dtype=np.uint16)
+    ad2[0].variance = np.full(SHAPE, 0.5)
+    ad2[0].mask = np.full(SHAPE, 2, dtype=np.uint16)
+    planes = (ad1[0].data, ad1[0].variance, ad1[0].mask)
+
+    ad1.divide(ad2)
+    for plane, new_plane in zip(planes, (ad1[0].data, ad1[0].variance,
+                                         ad1[0].mask)):
+        assert new_plane is plane
+    assert_array_equal(ad1[0].data, 0.5)
+    assert_array_equal(ad1[0].variance, 0.28125)
+    assert_array_equal(ad1[0].mask, 2)
+    # The operand is unchanged
+    assert_array_equal(ad2[0].data, 2)
+
+
+def test_arithmetic_memory():
+    # Calibrating a multi-extension frame only needs a few temporary arrays
+    # the size of one extension, rather than new planes for every extension
+    def make_ad(value):
+        ad = astrodata.create(fits.PrimaryHDU())
+        for _ in range(4):
+            ad.append(fits.ImageHDU(data=np.full((200, 100), value,
+                                                 dtype=np.float32)),
+                      name='SCI')
+        for ext in ad:
+            ext.variance = np.ones(ext.shape, dtype=np.float32)
+            ext.mask = np.zeros(ext.shape, dtype=np.uint16)
+        return ad
+
+    ad, flat = make_ad(10), make_ad(2)
+    tracemalloc.start()
+    try:
+        ad.divide(flat)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * ad[0].data.nbytes
+    assert_array_equal(ad.data, 5)
+    assert_array_equal(ad.variance, 6.5)
+
+
+def test_arithmetic_with_shared_planes():
+    # Extensions sharing an array mustn't have the operation applied twice
+    ad = astrodata.create(fits.PrimaryHDU())
+    hdu = fits.ImageHDU(data=np.ones(SHAPE))
+    ad.append(hdu, name='SCI')
+    ad.append(hdu, name='SCI')
+    ad.multiply(3)
+    assert_array_equal(ad[0].data, 3)
+    assert_array_equal(ad[1].data, 3)
+    assert_array_equal(hdu.data, 1)
+
+
 @pytest.mark.parametrize('op, arg, res', [('add', 100, 101),
                                           ('subtract', 100, -99),
                                           ('multiply', 3, 3),
@@ -580,6 +580,82 @@ def test_read_file(tmpdir):
     assert ad.instrument() == 'darkimager'
 
 
+def test_read_headers_only(tmpdir, capsys, monkeypatch):
+    opened = []
+    open_file = astrodata.fits._DeferredFile.open
+
+    def record_open(self):
+        opened.append(self.path)
+        return open_file(self)
+
+    monkeypatch.setattr(astrodata.fits._DeferredFile, 'open', record_open)
+
+    testfile = str(tmpdir.join('test.fits'))
+    hdr = fits.Header({'INSTRUME': 'darkimager', 'OBJECT': 'M42'})
+    hdus = [fits.PrimaryHDU(header=hdr)]
+    for ver in (1, 2):
+        hdus.append(fits.ImageHDU(data=np.arange(20, dtype=np.int16)
+                                  .reshape(4, 5) * ver, name='SCI', ver=ver))
+        hdus.append(fits.ImageHDU(data=np.zeros((4, 5), dtype=np.uint16),
+                                  name='DQ', ver=ver))
+    hdus.append(fits.BinTableHDU(Table([[1, 2]], names=['col1']),
+                                 name='MYCAT'))
+    fits.HDUList(hdus).writeto(testfile)
+
+    ad = astrodata.open(testfile, headers_only=True)
+    ref = astrodata.open(testfile)
+    assert len(ad) == 2
+    assert ad.object() == 'M42'
+    assert ad.tags == ref.tags
+    assert ad.hdr['EXTVER'] == [1, 2]
+    assert ad.shape == [(4, 5), (4, 5)]
+    assert list(ad.MYCAT['col1']) == [1, 2]
+
+    # No pixels have been read so far
+    ad.info()
+    ref.info()
+    out, _ = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[:len(lines) // 2] == lines[len(lines) // 2:]
+    assert not opened
+
+    # ... but they are when requested
+    assert_array_equal(ad[1].data, ref[1].data)
+    assert ad[1].data.dtype == ref[1].data.dtype
+    assert_array_equal(ad[0].mask, ref[0].mask)
+    assert_array_equal(ad.nddata[1]._data[1:3, 2:4], ref[1].data[1:3, 2:4])
+    assert opened
+
+
+def test_read_headers_only_single_image(tmpdir):
+    testfile = str(tmpdir.join('test.fits'))
+    hdr = fits.Header({'INSTRUME': 'darkimager', 'OBJECT': 'M42'})
+    fits.PrimaryHDU(data=np.ones((3, 4), dtype=np.float32),
+                    header=hdr).writeto(testfile)
+    ad = astrodata.open(testfile, headers_only=True)
+    assert len(ad) == 1
+    assert ad.instrument() == 'darkimager'
+    assert ad[0].hdr['EXTNAME'] == 'SCI'
+    assert ad[0].shape == (3, 4)
+    assert_array_equal(ad[0].data, np.ones((3, 4)))
+
+
+def test_read_headers_only_compressed(tmpdir):
+    testfile = str(tmpdir.join('test.fits'))
+    hdr = fits.Header({'INSTRUME': 'darkimager', 'OBJECT': 'M42'})
+    data = np.arange(20, dtype=np.float32).reshape(4, 5)
+    fits.HDUList([fits.PrimaryHDU(header=hdr),
+                  fits.CompImageHDU(data=data, name='SCI', ver=1)]
+                 ).writeto(testfile)
+    ad = astrodata.open(testfile, headers_only=True)
+    assert len(ad) == 1
+    assert isinstance(ad.nddata[0]._data._obj, astrodata.fits.DeferredHDU)
+    assert ad[0].hdr['XTENSION'] == 'IMAGE'
+    assert ad[0].shape == (4, 5)
+    assert_array_equal(ad[0].data, data)
+    assert_array_equal(ad.nddata[0]._data[1:3, 2:4], data[1:3, 2:4])
+
+
 @pytest.mark.dragons_remote_data
 def test_header_collection(GMOSN_SPECT):
     ad = astrodata.create({})
@@ -1,3 +1,5 @@
+from copy import deepcopy
+
 import numpy as np
 import pytest
 from numpy.testing import assert_array_almost_equal, assert_array_equal
@@ -59,6 +61,43 @@ def test_windowedOp(testnd):
         result = windowedOp(stack, [testnd, testnd], kernel=[3], shape=(5, 5))
 
 
+def test_windowedOp_threads_and_memory(testnd):
+    sections = []
+
+    def stack(arrays):
+        arrays = list(arrays)
+        sections.append(arrays[0].shape)
+        data = np.array([arr.data for arr in arrays]).sum(axis=0)
+        unc = np.array([arr.variance for arr in arrays]).sum(axis=0)
+        mask = np.bitwise_or.reduce([arr.mask for arr in arrays])
+        return NDAstroData(data=data, uncertainty=ADVarianceUncertainty(unc),
+                           mask=mask)
+
+    # Each input pixel needs 27 bytes (int64 data and float64 variance,
+    # bool mask, plus their stacked copies): budget for two 2-row tiles
+    result = windowedOp(stack, [testnd, testnd], memory=2 * 27 * 5 * 2,
+                        max_workers=None, with_uncertainty=True,
+                        with_mask=True)
+    assert_array_equal(result.data, testnd.data * 2)
+    assert_array_equal(result.variance, testnd.variance * 2)
+    assert_array_equal(result.mask, testnd.mask)
+    assert all(shape[0] <= 2 for shape in sections)
+
+    sections.clear()
+    result = windowedOp(stack, [testnd, testnd], max_workers=2,
+                        with_uncertainty=True, with_mask=True)
+    assert_array_equal(result.data, testnd.data * 2)
+    assert sorted(sections) == [(2, 5), (3, 5)]
+
+    # The same budget, with as many bytes of temporaries again
+    sections.clear()
+    result = windowedOp(stack, [testnd, testnd], memory=2 * 27 * 5 * 2,
+                        max_workers=1, temporaries=27,
+                        with_uncertainty=True, with_mask=True)
+    assert_array_equal(result.data, testnd.data * 2)
+    assert all(shape[0] == 1 for shape in sections)
+
+
 def test_transpose(testnd):
     testnd.variance[0, -1] = 10
     ndt = testnd.T
@@ -102,3 +141,85 @@ def test_new_variance_uncertainty_instance_no_warning_if_the_array_is_zeros():
     with pytest.warns(None) as w:
         ADVarianceUncertainty(arr)
     assert len(w) == 0
+
+
+@pytest.mark.parametrize('operation', ['add', 'subtract', 'multiply', 'divide'])
+@pytest.mark.parametrize('operand', ['number', 'array', 'nddata'])
+def test_arithmetic_inplace(operation, operand):
+    rng = np.random.RandomState(0)
+
+    def make_nd():
+        shape = (6, 8)
+        nd = NDAstroData(rng.normal(10, 5, size=shape).astype(np.float32),
+                         mask=rng.randint(0, 4, size=shape).astype(np.uint16))
+        nd.variance = rng.uniform(0, 3, size=shape).astype(np.float32)
+        nd.data[0] = np.nan
+        nd.variance[1] = np.nan
+        return nd
+
+    nd = make_nd()
+    other = {'number': 2.5,
+             'array': rng.normal(1, 0.1, size=8).astype(np.float32),
+             'nddata': make_nd()}[operand]
+    expected = getattr(nd, operation)(other, handle_meta='first_found')
+
+    planes = (nd.data, nd.variance, nd.mask)
+    assert nd._arithmetic_inplace(operation, other)
+    # The results are written to the original arrays, and are the same
+    # as astropy's, bit for bit, except for the variance after division by
+    # an array (B**4 is calculated differently)
+    assert nd.data is planes[0]
+    assert nd.variance is planes[1]
+    assert nd.mask is planes[2]
+    for attr in ('data', 'variance', 'mask'):
+        result, expected_result = getattr(nd, attr), getattr(expected, attr)
+        assert result.dtype == expected_result.dtype
+        if attr == 'variance' and operation == 'divide' and operand != 'number':
+            np.testing.assert_allclose(result, expected_result, rtol=1e-6)
+        else:
+            assert result.tobytes() == expected_result.tobytes()
+
+
+def test_arithmetic_inplace_fallback(testnd):
+    # Results that can't be stored in the original arrays, and operands
+    # that share memory with them, are handled by astropy
+    nd = NDAstroData(np.arange(4).reshape(2, 2))
+    assert not nd._arithmetic_inplace('divide', 2)
+    assert not nd._arithmetic_inplace('add', 0.5)
+    data = nd.data
+    nd /= 2
+    assert nd.data is not data
+    assert_array_equal(nd.data, [[0, 0.5], [1, 1.5]])
+
+    assert not nd._arithmetic_inplace('multiply', nd)
+    nd *= nd
+    assert_array_equal(nd.data, [[0, 0.25], [1, 2.25]])
+
+    nd.data.flags.writeable = False
+    assert not nd._arithmetic_inplace('add', 1)
+
+    # Units aren't handled in place
+    data = testnd.data
+    testnd *= 2
+    assert testnd.data is not data
+    assert testnd.unit == 'ct'
+    assert_array_equal(testnd.data, data * 2)
+    assert_array_almost_equal(testnd.variance, 6)
+
+
+
+def test_version():
+    nd = NDAstroData(np.ones((3, 4)), mask=np.zeros((3, 4), dtype=np.uint16))
+    nd.variance = np.ones((3, 4))
+    versions = [nd.version]
+    for modify in (lambda nd: nd.__iadd__(1), lambda nd: nd.__imul__(nd),
+                   lambda nd: nd.set_section((0, 0), nd[1:2, 1:2]),
+                   lambda nd: setattr(nd, 'mask', None),
+                   lambda nd: setattr(nd, 'variance', None),
+                   lambda nd: setattr(nd, 'data', np.zeros((3, 4)))):
+        modify(nd)
+        versions.append(nd.version)
+    # Versions are never reused, even by other objects
+    versions.append(deepcopy(nd).version)
+    assert len(set(versions)) == len(versions)
+    assert sorted(versions) == versions
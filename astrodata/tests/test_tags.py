@@ -155,3 +155,69 @@ def test_info(testfile, capsys):
         '               Type        Dimensions',
         '.MYCAT         Table       (10, 2)'
     ]
+
+
+def test_tags_are_cached(testfile):
+    ad = astrodata.open(testfile)
+    astrodata.AstroData.tag_cache_info(reset=True)
+    assert ad.tags == {'DARK', 'MYINSTRUMENT'}
+    assert ad.tags == {'DARK', 'MYINSTRUMENT'}
+    info = astrodata.AstroData.tag_cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+    assert info.hit_rate == 0.5
+
+    # The returned set is a copy, and can be modified safely
+    ad.tags.add('FOO')
+    assert ad.tags == {'DARK', 'MYINSTRUMENT'}
+
+
+def test_tag_cache_invalidation(testfile):
+    ad = astrodata.open(testfile)
+    assert ad.tags == {'DARK', 'MYINSTRUMENT'}
+
+    ad.phu['OBSTYPE'] = 'OBJECT'
+    assert ad.tags == {'IMAGE', 'MYINSTRUMENT'}
+
+    del ad.phu['GRATING']
+    assert ad.tags == {'MYINSTRUMENT'}
+
+    ad.phu.set('OBSTYPE', 'DARK')
+    assert ad.tags == {'DARK', 'MYINSTRUMENT'}
+
+    # Changes through the header collection are noticed, too
+    key = ad._dataprov._tag_cache_key()
+    ad.hdr.set('FOO', 'BAR')
+    assert ad._dataprov._tag_cache_key() != key
+
+
+def test_descriptor_and_tag_registry():
+    assert AstroDataMyInstrument._descriptors == (
+        'amp_read_area', 'array_name', 'badguy', 'detector_section',
+        'dispersion_axis', 'gain', 'instrument', 'object', 'telescope')
+    assert ([m.__name__ for m in AstroDataMyInstrument._tag_methods] ==
+            ['_tag_dark', '_tag_image', '_tag_instrument', '_tag_raise'])
+
+
+def test_factory_keyed_dispatch():
+    calls = []
+
+    class AstroDataKeyed(AstroDataFits):
+        _match_keywords = {'INSTRUME': ('KEYED',)}
+
+        @staticmethod
+        def _matches_data(source):
+            calls.append(source)
+            return source[0].header.get('INSTRUME', '').upper() == 'KEYED'
+
+    factory.addClass(AstroDataKeyed)
+    try:
+        ad = astrodata.create({'INSTRUME': 'myinstrument'})
+        assert isinstance(ad, AstroDataMyInstrument)
+        assert not calls
+
+        ad = astrodata.create({'INSTRUME': 'keyed'})
+        assert type(ad) is AstroDataKeyed
+        assert len(calls) == 1
+    finally:
+        factory._registry.discard(AstroDataKeyed)
+        factory._keyed[('INSTRUME', 'KEYED')].discard(AstroDataKeyed)
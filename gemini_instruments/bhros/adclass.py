@@ -8,6 +8,8 @@ class AstroDataBhros(AstroDataGemini):
                           central_wavelength = 'WAVELENG',
                           overscan_section = 'BIASSEC')
 
+    _match_keywords = {'INSTRUME': ('BHROS',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'BHROS'
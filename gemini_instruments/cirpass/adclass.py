@@ -19,6 +19,8 @@ class AstroDataCirpass(AstroDataGemini):
         ra = 'TEL_RA',
         dec = 'TEC_DEC',
     )
+    _match_keywords = {'INSTRUME': ('CIRPASS',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '') == 'CIRPASS'
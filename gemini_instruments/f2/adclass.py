@@ -20,6 +20,8 @@ class AstroDataF2(AstroDataGemini):
                           lyot_stop='LYOT',
                           )
 
+    _match_keywords = {'INSTRUME': ('F2', 'FLAM')}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() in ('F2', 'FLAM')
@@ -10,6 +10,8 @@ class AstroDataFlamingos(AstroDataGemini):
                           exposure_time = 'EXP_TIME',
                           )
 
+    _match_keywords = {'INSTRUME': ('FLAMINGOS',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'FLAMINGOS'
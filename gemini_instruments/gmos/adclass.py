@@ -18,6 +18,8 @@ class AstroDataGmos(AstroDataGemini):
                           overscan_section='BIASSEC',
                           )
 
+    _match_keywords = {'INSTRUME': ('GMOS-N', 'GMOS-S')}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() in ('GMOS-N', 'GMOS-S')
@@ -17,6 +17,8 @@ class AstroDataGnirs(AstroDataGemini):
 
     __keyword_dict = dict(central_wavelength='GRATWAVE',)
 
+    _match_keywords = {'INSTRUME': ('GNIRS',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'GNIRS'
@@ -24,6 +24,8 @@ class AstroDataGpi(AstroDataGemini):
         return cls(FitsLoader(FitsProvider).load(source, extname_parser=gpi_parser))
 
 
+    _match_keywords = {'INSTRUME': ('GPI',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'GPI'
@@ -7,6 +7,8 @@ class AstroDataGraces(AstroDataGemini):
     __keyword_dict = dict(detector = 'DETECTOR',
                           )
 
+    _match_keywords = {'INSTRUME': ('GRACES',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'GRACES'
@@ -13,6 +13,8 @@ class AstroDataGsaoi(AstroDataGemini):
                           detector_name='DETECTOR',
                           )
 
+    _match_keywords = {'INSTRUME': ('GSAOI',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'GSAOI'
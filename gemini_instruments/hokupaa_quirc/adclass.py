@@ -21,6 +21,8 @@ class AstroDataHokupaaQUIRC(AstroDataGemini):
         observation_type = 'IMAGETYP',
     )
 
+    _match_keywords = {'INSTRUME': ('Hokupaa+QUIRC',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '') == 'Hokupaa+QUIRC'
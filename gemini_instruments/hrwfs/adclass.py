@@ -19,6 +19,8 @@ class AstroDataHrwfs(AstroDataGemini):
         target_ra = 'CRVAL1',
         target_dec = 'CRVAL2',
         )
+    _match_keywords = {'INSTRUME': ('hrwfs',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '') == 'hrwfs'
@@ -12,6 +12,8 @@ class AstroDataMichelle(AstroDataGemini):
                           focal_plane_mask = 'SLITNAME',
                           read_mode = 'MODE')
 
+    _match_keywords = {'INSTRUME': ('MICHELLE',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'MICHELLE'
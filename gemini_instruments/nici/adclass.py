@@ -3,6 +3,8 @@ from ..gemini import AstroDataGemini
 from .. import gmu
 
 class AstroDataNici(AstroDataGemini):
+    _match_keywords = {'INSTRUME': ('NICI',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'NICI'
@@ -17,6 +17,8 @@ class AstroDataNifs(AstroDataGemini):
                           disperser = 'GRATING',
                           focal_plane_mask = 'APERTURE',
                           observation_epoch = 'EPOCH')
+    _match_keywords = {'INSTRUME': ('NIFS',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'NIFS'
@@ -10,6 +10,8 @@ class AstroDataNiri(AstroDataGemini):
 
     # NIRI has no specific keyword overrides
 
+    _match_keywords = {'INSTRUME': ('NIRI',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'NIRI'
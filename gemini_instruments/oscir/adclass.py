@@ -7,6 +7,8 @@ from .. import gmu
 
 class AstroDataOscir(AstroDataGemini):
 
+    _match_keywords = {'INSTRUME': ('OSCIR',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'OSCIR'
@@ -22,6 +22,8 @@ class AstroDataPhoenix(AstroDataGemini):
 
     __keyword_dict = dict(focal_plane_mask = 'SLIT_POS')
 
+    _match_keywords = {'INSTRUME': ('PHOENIX',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'PHOENIX'
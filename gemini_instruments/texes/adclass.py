@@ -44,6 +44,8 @@ class AstroDataTexes(AstroDataGemini):
 
         return cls(FitsLoader(FitsProvider).load(source, extname_parser=texes_parser))
 
+    _match_keywords = {'INSTRUME': ('TEXES',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '') == 'TEXES'
@@ -10,6 +10,8 @@ class AstroDataTrecs(AstroDataGemini):
                           focal_plane_mask = 'SLIT',
                           pupil_mask = 'PUPILIMA')
 
+    _match_keywords = {'INSTRUME': ('TRECS',)}
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'TRECS'
@@ -24,3 +24,7 @@ class detectSourcesConfig(config.Config):
     phot_min_radius = config.RangeField("Minimum radius for photometry (pixels)", float, 3.5, min=1.0)
     back_size = config.RangeField("Background mesh size (pixels)", int, 32, min=1)
     back_filtersize = config.RangeField("Filtering scale for background", int, 8, min=1)
+    backend = config.ChoiceField("Source detection engine", str,
+                                 allowed = {"sextractor": "SExtractor (external task)",
+                                            "python": "In-process detection in python"},
+                                 default = "sextractor")
@@ -62,6 +62,9 @@ class determineWavelengthSolutionConfig(config.Config):
     dispersion = config.Field("Estimated dispersion (nm/pixel)", float, None, optional=True)
     linelist = config.Field("Filename of arc line list", str, None, optional=True)
     plot = config.Field("Make diagnostic plots?", bool, False)
+    workers = config.RangeField("Number of extensions to calibrate in parallel "
+                                "(None => from reduce configuration)",
+                                int, 1, min=1, optional=True)
 
 class distortionCorrectConfig(config.Config):
     suffix = config.Field("Filename suffix", str, "_distortionCorrected", optional=True)
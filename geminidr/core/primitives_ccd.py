@@ -7,11 +7,11 @@ from datetime import datetime
 
 import numpy as np
 
-from astropy.modeling import models, fitting
 from scipy.interpolate import UnivariateSpline, LSQUnivariateSpline
 
 from astrodata.provenance import add_provenance
 from gempy.gemini import gemini_tools as gt
+from gempy.library import astrotools as at
 
 from geminidr import PrimitivesBASE
 from recipe_system.utils.md5 import md5sum
@@ -163,6 +163,10 @@ class CCD(PrimitivesBASE):
 
             osec_list = ad.overscan_section()
             dsec_list = ad.data_section()
+
+            # Extensions whose overscan regions cover the same rows are
+            # processed together, as a 2D array of row means
+            groups = {}
             for ext, osec, dsec in zip(ad, osec_list, dsec_list):
                 x1, x2, y1, y2 = osec.x1, osec.x2, osec.y1, osec.y2
                 if x1 > dsec.x1:  # Bias on right
@@ -171,14 +175,23 @@ class CCD(PrimitivesBASE):
                 else:  # Bias on left
                     x1 += 1
                     x2 -= nbiascontam
+                groups.setdefault((y1, y2, ext.data.shape[0]), []).append(
+                    (ext, x1, x2))
 
+            for (y1, y2, nrows), exts in groups.items():
                 row = np.arange(y1, y2)
-                data = np.mean(ext.data[y1:y2, x1:x2], axis=1)
+                data = np.array([np.mean(ext.data[y1:y2, x1:x2], axis=1)
+                                 for ext, x1, x2 in exts])
                 # Weights are used to determine number of spline pieces
                 # should be the estimate of the mean
-                wt = np.sqrt(x2 - x1) / ext.read_noise()
-                if ext.is_in_adu():
-                    wt *= ext.gain()
+                wts = []
+                for ext, x1, x2 in exts:
+                    wt = np.sqrt(x2 - x1) / ext.read_noise()
+                    if ext.is_in_adu():
+                        wt *= ext.gain()
+                    wts.append(wt)
+                wts = np.array(wts)
+                read_noise = np.array([np.sqrt(x2 - x1) for _, x1, x2 in exts]) / wts
 
                 medboxsize = 2  # really 2n+1 = 5
                 for iter in range(niterate+1):
@@ -186,20 +199,21 @@ class CCD(PrimitivesBASE):
                     # fit bad rows. Need to mask these before starting, so use a
                     # running median. Probably a good starting point for all fits.
                     if iter == 0 or func == 'none':
-                        medarray = np.full((medboxsize * 2 + 1, y2 - y1), np.nan)
+                        medarray = np.full((len(exts), medboxsize * 2 + 1, y2 - y1),
+                                           np.nan)
                         for i in range(-medboxsize, medboxsize + 1):
                             mx1 = max(i, 0)
                             mx2 = min(y2 - y1, y2 - y1 + i)
-                            medarray[medboxsize + i, mx1:mx2] = data[:mx2 - mx1]
+                            medarray[:, medboxsize + i, mx1:mx2] = data[:, :mx2 - mx1]
                         runmed = np.ma.median(np.ma.masked_where(np.isnan(medarray),
-                                                                 medarray), axis=0)
+                                                                 medarray), axis=1)
                         residuals = data - runmed
-                        sigma = np.sqrt(x2 - x1) / wt  # read noise
+                        sigma = read_noise
 
-                    mask = np.logical_or(residuals > hi_rej * sigma
-                                        if hi_rej is not None else False,
-                                        residuals < -lo_rej * sigma
-                                        if lo_rej is not None else False)
+                    mask = np.logical_or(residuals > hi_rej * sigma[:, np.newaxis]
+                                         if hi_rej is not None else False,
+                                         residuals < -lo_rej * sigma[:, np.newaxis]
+                                         if lo_rej is not None else False)
 
                     # Don't clip any pixels if iter==0
                     if func == 'none' and iter < niterate:
@@ -207,33 +221,43 @@ class CCD(PrimitivesBASE):
                         data = np.where(mask, runmed, data)
                     elif func != 'none':
                         if func == 'spline':
-                            if order:
-                                # Equally-spaced knots (like IRAF)
-                                knots = np.linspace(row[0], row[-1], order+1)[1:-1]
-                                bias = LSQUnivariateSpline(row[~mask], data[~mask], knots)
-                            else:
-                                bias = UnivariateSpline(row[~mask], data[~mask],
-                                                        w=[wt]*np.sum(~mask))
+                            biases = []
+                            for d, m, wt in zip(data, mask, wts):
+                                if order:
+                                    # Equally-spaced knots (like IRAF)
+                                    knots = np.linspace(row[0], row[-1], order+1)[1:-1]
+                                    biases.append(LSQUnivariateSpline(row[~m], d[~m], knots))
+                                else:
+                                    biases.append(UnivariateSpline(row[~m], d[~m],
+                                                                   w=[wt]*np.sum(~m)))
+
+                            def bias(x):
+                                return np.array([b(x) for b in biases])
                         else:
-                            bias_init = models.Chebyshev1D(degree=order,
-                                                           c0=np.median(data[~mask]))
-                            fit_f = fitting.LinearLSQFitter()
-                            bias = fit_f(bias_init, row[~mask], data[~mask])
+                            # All the polynomials are fitted at once
+                            bias = at.fit_chebyshev(row, data, order, mask=mask)
 
                         residuals = data - bias(row)
-                        sigma = np.std(residuals[~mask])
+                        sigma = np.array([np.std(r[~m])
+                                          for r, m in zip(residuals, mask)])
 
-                # using "-=" won't change from int to float
                 if func != 'none':
-                    data = bias(np.arange(0, ext.data.shape[0]))
-                ext.data = ext.data - np.tile(data,
-                                        (ext.data.shape[1],1)).T.astype(np.float32)
-
-                ext.hdr.set('OVERSEC', '[{}:{},{}:{}]'.format(x1+1,x2,y1+1,y2),
-                            self.keyword_comments['OVERSEC'])
-                ext.hdr.set('OVERSCAN', np.mean(data),
-                            self.keyword_comments['OVERSCAN'])
-                ext.hdr.set('OVERRMS', sigma, self.keyword_comments['OVERRMS'])
+                    data = bias(np.arange(0, nrows))
+
+                for (ext, x1, x2), level, rms in zip(exts, data, sigma):
+                    # Subtract in place if possible ("-=" won't change from
+                    # int to float), broadcasting the level of each row
+                    level_column = level.astype(np.float32)[:, np.newaxis]
+                    if np.issubdtype(ext.data.dtype, np.floating):
+                        ext.data -= level_column
+                    else:
+                        ext.data = ext.data - level_column
+
+                    ext.hdr.set('OVERSEC', '[{}:{},{}:{}]'.format(x1+1,x2,y1+1,y2),
+                                self.keyword_comments['OVERSEC'])
+                    ext.hdr.set('OVERSCAN', np.mean(level),
+                                self.keyword_comments['OVERSCAN'])
+                    ext.hdr.set('OVERRMS', rms, self.keyword_comments['OVERRMS'])
 
             # Timestamp, and update filename
             gt.mark_history(ad, primname=self.myself(), keyword=timestamp_key)
@@ -7,13 +7,17 @@ import astropy
 import numpy as np
 import warnings
 
+from concurrent.futures import ThreadPoolExecutor
+
 from astropy.stats import sigma_clip
 from astropy.table import Column
 from astropy.utils import minversion
+from astropy.wcs import WCS
 
 from gempy.gemini import gemini_tools as gt
 from gempy.gemini.gemini_catalog_client import get_fits_table
 from gempy.gemini.eti.sextractoreti import SExtractorETI
+from gempy.library import detection
 from geminidr.gemini.lookups import color_corrections
 
 from geminidr import PrimitivesBASE
@@ -152,6 +156,9 @@ class Photometry(PrimitivesBASE):
             background mesh size (pixels)
         back_filter_size: int
             background filtering scale
+        backend: str
+            "sextractor" to run SExtractor, or "python" to use the
+            (faster, but simpler) gempy.library.detection module
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -161,20 +168,20 @@ class Photometry(PrimitivesBASE):
         set_saturation = params["set_saturation"]
         # Setting mask_bits=0 is the same as not replacing bad pixels
         mask_bits = params["replace_flags"] if params["mask"] else 0
+        backend = params["backend"]
 
         # Will raise an Exception if SExtractor is too old or missing
-        SExtractorETI(primitives_class=self).check_version()
+        if backend == "sextractor":
+            SExtractorETI(primitives_class=self).check_version()
 
         # Delete primitive-specific keywords from params so we only have
         # the ones for SExtractor
-        for key in ("suffix", "set_saturation", "replace_flags", "mask"):
+        for key in ("suffix", "set_saturation", "replace_flags", "mask",
+                    "backend"):
             del params[key]
 
-        adoutputs = []
+        all_sexpars = []
         for ad in adinputs:
-            # Get a seeing estimate from the header, if available
-            seeing_estimate = ad.phu.get('MEANFWHM')
-
             # Get the appropriate SExtractor input files
             dqtype = 'no_dq' if any(ext.mask is None for ext in ad) else 'dq'
             sexpars = {'config': self.sx_dict[dqtype, 'sex'],
@@ -195,40 +202,30 @@ class Photometry(PrimitivesBASE):
                                     "2.5,{}".format(value)})
                 else:
                     sexpars.update({key.upper(): value})
+            all_sexpars.append(sexpars)
 
-            for ext in ad:
-                # saturation_level() descriptor always returns level in ADU,
-                # so need to multiply by gain if image is not in ADU
-                if set_saturation:
-                    sat_level = ext.saturation_level()
-                    if not ext.is_in_adu():
-                        sat_level *= ext.gain()
-                    sexpars.update({'SATUR_LEVEL': sat_level})
-
-                # If we don't have a seeing estimate, try to get one
-                if seeing_estimate is None:
-                    log.debug("Running SExtractor to obtain seeing estimate")
-                    sex_task = SExtractorETI(primitives_class=self, inputs=[ext],
-                            params=sexpars, mask_dq_bits=mask_bits, getmask=True)
-                    sex_task.run()
-                    # An OBJCAT is *always* attached, even if no sources found
-                    seeing_estimate = _estimate_seeing(ext.OBJCAT)
-
-                # Re-run with seeing estimate (no point re-running if we
-                # didn't get an estimate), and get a new estimate
-                if seeing_estimate is not None:
-                    log.debug("Running SExtractor with seeing estimate "
-                              "{:.3f}".format(seeing_estimate))
-                    sexpars.update({'SEEING_FWHM': '{:.3f}'.
-                                   format(seeing_estimate)})
-                    sex_task = SExtractorETI(primitives_class=self, inputs=[ext],
-                            params=sexpars, mask_dq_bits=mask_bits, getmask=True)
-                    sex_task.run()
-                    # We don't want to replace an actual value with "None"
-                    temp_seeing_estimate = _estimate_seeing(ext.OBJCAT)
-                    if temp_seeing_estimate is not None:
-                        seeing_estimate = temp_seeing_estimate
+        # The inputs are independent, so run SExtractor on them concurrently
+        # (the SExtractor processes themselves run in the ETI worker pool)
+        if backend == "python":
+            filter_kernel = detection.read_filter(self.sx_dict['dq', 'conv'])
+
+            def run_detection(args):
+                return _detect_sources_python(args[0], params,
+                    filter_kernel=filter_kernel, set_saturation=set_saturation,
+                    mask_bits=mask_bits)
+        else:
+            def run_detection(args):
+                return _run_sextractor(self, *args,
+                    set_saturation=set_saturation, mask_bits=mask_bits)
+
+        max_workers = max(min(len(adinputs), self.eti_subprocess.nworkers), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            seeing_estimates = list(executor.map(run_detection,
+                                                 zip(adinputs, all_sexpars)))
 
+        adoutputs = []
+        for ad, seeing_estimate in zip(adinputs, seeing_estimates):
+            for ext in ad:
                 # Although the OBJCAT has been added to the extension, it
                 # needs to be massaged into the necessary format
                 # We're deleting the OBJCAT first simply to suppress the
@@ -405,6 +402,145 @@ def clean_objcat(ext):
     return ext
 
 
+def _run_sextractor(primitives_class, ad, sexpars, set_saturation=False,
+                    mask_bits=0):
+    """
+    Runs SExtractor on each extension of an AstroData object, attaching the
+    raw OBJCAT and OBJMASK to each extension. The seeing is estimated from
+    the catalogs and used for the subsequent runs.
+
+    Parameters
+    ----------
+    primitives_class: PrimitivesBASE
+        primitives class whose ETI worker pool is used
+    ad: AstroData
+        image on which to run SExtractor
+    sexpars: dict
+        SExtractor parameters
+    set_saturation: bool
+        set the saturation level of the data for SExtractor?
+    mask_bits: int
+        DQ bits to be replaced by the median of the good data
+
+    Returns
+    -------
+    float/None: the seeing estimate after processing all the extensions
+    """
+    log = primitives_class.log
+
+    # Get a seeing estimate from the header, if available
+    seeing_estimate = ad.phu.get('MEANFWHM')
+
+    for ext in ad:
+        # saturation_level() descriptor always returns level in ADU,
+        # so need to multiply by gain if image is not in ADU
+        if set_saturation:
+            sat_level = ext.saturation_level()
+            if not ext.is_in_adu():
+                sat_level *= ext.gain()
+            sexpars.update({'SATUR_LEVEL': sat_level})
+
+        # If we don't have a seeing estimate, try to get one
+        if seeing_estimate is None:
+            log.debug("Running SExtractor to obtain seeing estimate")
+            sex_task = SExtractorETI(primitives_class=primitives_class,
+                inputs=[ext], params=sexpars, mask_dq_bits=mask_bits,
+                getmask=True)
+            sex_task.run()
+            # An OBJCAT is *always* attached, even if no sources found
+            seeing_estimate = _estimate_seeing(ext.OBJCAT)
+
+        # Re-run with seeing estimate (no point re-running if we
+        # didn't get an estimate), and get a new estimate
+        if seeing_estimate is not None:
+            log.debug("Running SExtractor with seeing estimate "
+                      "{:.3f}".format(seeing_estimate))
+            sexpars.update({'SEEING_FWHM': '{:.3f}'.
+                           format(seeing_estimate)})
+            sex_task = SExtractorETI(primitives_class=primitives_class,
+                inputs=[ext], params=sexpars, mask_dq_bits=mask_bits,
+                getmask=True)
+            sex_task.run()
+            # We don't want to replace an actual value with "None"
+            temp_seeing_estimate = _estimate_seeing(ext.OBJCAT)
+            if temp_seeing_estimate is not None:
+                seeing_estimate = temp_seeing_estimate
+
+    return seeing_estimate
+
+
+def _detect_sources_python(ad, params, filter_kernel=None,
+                           set_saturation=False, mask_bits=0):
+    """
+    Finds sources in each extension of an AstroData object with the
+    in-process detection engine, attaching an OBJCAT (with the same
+    columns as a raw SExtractor catalog) and OBJMASK to each extension.
+    As with SExtractor, the seeing is estimated from the catalogs and used
+    to classify the sources in the subsequent extensions, but only the
+    classification needs recalculating.
+
+    Parameters
+    ----------
+    ad: AstroData
+        image on which to find sources
+    params: dict
+        detectSources parameters (for SExtractor)
+    filter_kernel: ndarray/None
+        kernel with which to filter the image before detection
+    set_saturation: bool
+        flag saturated sources?
+    mask_bits: int
+        DQ bits to be replaced by the median of the good data
+
+    Returns
+    -------
+    float/None: the seeing estimate after processing all the extensions
+    """
+    # Get a seeing estimate from the header, if available
+    seeing_estimate = ad.phu.get('MEANFWHM')
+
+    for ext in ad:
+        data = ext.data
+        if mask_bits and ext.mask is not None:
+            bad = (ext.mask & mask_bits) > 0
+            data = data.copy()
+            data[bad] = np.median(data[~bad])
+
+        satur_level = None
+        if set_saturation:
+            satur_level = ext.saturation_level()
+            if not ext.is_in_adu():
+                satur_level *= ext.gain()
+
+        pixscale = ext.pixel_scale()
+        objcat, objmask = detection.detect_sources(
+            data, mask=ext.mask, wcs=WCS(ext.hdr),
+            detect_minarea=params["detect_minarea"],
+            detect_thresh=params["detect_thresh"],
+            analysis_thresh=params["analysis_thresh"],
+            filter_kernel=filter_kernel, back_size=params["back_size"],
+            back_filtersize=params["back_filtersize"],
+            phot_autoparams=(2.5, params["phot_min_radius"]),
+            satur_level=satur_level)
+
+        # Obtain a seeing estimate if we don't have one, and then reclassify
+        # the sources with it, and get a new estimate
+        if seeing_estimate is None:
+            seeing_estimate = _estimate_seeing(objcat)
+        if seeing_estimate is not None and pixscale:
+            objcat['CLASS_STAR'] = detection.classify_sources(
+                objcat, seeing_estimate / pixscale)
+            # We don't want to replace an actual value with "None"
+            temp_seeing_estimate = _estimate_seeing(objcat)
+            if temp_seeing_estimate is not None:
+                seeing_estimate = temp_seeing_estimate
+
+        ext.OBJCAT = objcat
+        ext.OBJMASK = objmask
+
+    return seeing_estimate
+
+
 def _estimate_seeing(objcat):
     """
     This function tries to estimate the seeing from a SExtractor object
@@ -469,6 +605,10 @@ def _profile_sources(ad, seeing_estimate=None):
 
     The 50% encircled energy (EE50) is just determined from a cumulative sum
     of pixel values, sorted by distance from source center.
+
+    The stamps around the sources are extracted as a 3D array and measured
+    together (in batches, to limit the memory used). Sources without room
+    for a stamp are not measured.
     """
     for ext in ad:
         try:
@@ -476,97 +616,95 @@ def _profile_sources(ad, seeing_estimate=None):
         except AttributeError:
             continue
 
-        catx = objcat["X_IMAGE"]
-        caty = objcat["Y_IMAGE"]
-        catbg = objcat["BACKGROUND"]
-        cattotalflux = objcat["FLUX_AUTO"]
-        catmaxflux = objcat["FLUX_MAX"]
+        catx = np.asarray(objcat["X_IMAGE"])
+        caty = np.asarray(objcat["Y_IMAGE"])
+        catbg = np.asarray(objcat["BACKGROUND"])
+        cattotalflux = np.asarray(objcat["FLUX_AUTO"])
+        catmaxflux = np.asarray(objcat["FLUX_MAX"])
         data = ext.data
 
         if seeing_estimate is None:
             stamp_size = max(10,int(0.5/ext.pixel_scale()))
         else:
             stamp_size = max(10,int(1.2*seeing_estimate/ext.pixel_scale()))
+        sz = stamp_size
 
         # Make a default grid to use for distance measurements
         dist = np.mgrid[-stamp_size:stamp_size,-stamp_size:stamp_size]+0.5
 
-        fwhm_list = []
-        e50d_list = []
-        newmax_list = []
-
-        for i in range(0, len(objcat)):
-
-            xc = catx[i] - 0.5
-            yc = caty[i] - 0.5
-            bg = catbg[i]
-            tf = cattotalflux[i]
-            mf = catmaxflux[i]
-
-            # Check that there's enough room for a stamp
-            sz = stamp_size
-            if (int(yc)-sz < 0 or int(xc)-sz < 0 or
-                    int(yc)+sz >= data.shape[0] or int(xc)+sz >= data.shape[1]):
+        fwhm = np.full(len(objcat), -999.)
+        e50d = np.full(len(objcat), -999.)
+        newmax = catmaxflux.copy()
+
+        # Match the precision of the scalar arithmetic on catalog values
+        xc = catx.astype(np.float64) - 0.5
+        yc = caty.astype(np.float64) - 0.5
+        # int() truncates towards zero; the sources for which that differs
+        # from floor() have no room for a stamp anyway
+        ixc = np.trunc(xc).astype(int)
+        iyc = np.trunc(yc).astype(int)
+
+        # Check that there's enough room for a stamp
+        good = np.flatnonzero((iyc-sz >= 0) & (ixc-sz >= 0) &
+                              (iyc+sz < data.shape[0]) & (ixc+sz < data.shape[1]))
+        if good.size == 0:
+            continue
 
-                fwhm_list.append(-999)
-                e50d_list.append(-999)
-                newmax_list.append(mf)
+        # The (background-subtracted) stamps have the type that subtracting
+        # a catalog value from the data would give
+        rpv_dtype = np.result_type(data.dtype, catbg[good[0]])
+        # A view of all the (2*sz, 2*sz) windows of the data
+        windows = np.lib.stride_tricks.as_strided(
+            data, shape=(data.shape[0]-2*sz+1, data.shape[1]-2*sz+1, 2*sz, 2*sz),
+            strides=data.strides * 2, writeable=False)
+        batch_size = max(1, 2**22 // (4*sz*sz))
 
-                continue
+        for start in range(0, good.size, batch_size):
+            rows = good[start:start+batch_size]
+            bg = catbg[rows]
+            stamps = windows[iyc[rows]-sz, ixc[rows]-sz]
 
             # Estimate new FLUX_MAX from pixels around peak
-            mf = np.max(data[int(yc)-2:int(yc)+3,int(xc)-2:int(xc)+3]) - bg
+            mf = stamps[:, sz-2:sz+3, sz-2:sz+3].max(axis=(1, 2)) - bg
 
             # Bright sources in IR images can "volcano", so revert to
             # catalog value if these pixels are negative
-            if mf < 0:
-                mf = catmaxflux[i]
-
-            # Get image stamp around center point
-            stamp = data[int(yc)-sz:int(yc)+sz, int(xc)-sz:int(xc)+sz]
-
-            # Reset grid to correct center coordinates
-            shift_dist = dist.copy()
-            shift_dist[0] += int(yc)-yc
-            shift_dist[1] += int(xc)-xc
-
-            # Square root of the sum of the squares of the distances
-            rdistsq = np.sum(shift_dist**2, axis=0)
+            mf = np.where(mf < 0, catmaxflux[rows], mf)
 
-            # Radius and flux arrays for the radial profile
-            rpr = rdistsq.flatten()
-            rpv = stamp.flatten() - bg
+            # Radius and flux arrays for the radial profiles, with the grid
+            # reset to the correct center coordinates
+            shift_y = (iyc[rows]-yc[rows])[:, np.newaxis, np.newaxis]
+            shift_x = (ixc[rows]-xc[rows])[:, np.newaxis, np.newaxis]
+            rpr = ((dist[0] + shift_y)**2 + (dist[1] + shift_x)**2).reshape(rows.size, -1)
+            rpv = (stamps - bg.astype(rpv_dtype)[:, np.newaxis, np.newaxis]).reshape(rows.size, -1)
 
             # Sort by the radius
-            sort_order = np.argsort(rpr)
-            radsq = rpr[sort_order]
-            flux = rpv[sort_order]
+            sort_order = np.argsort(rpr, axis=1)
+            radsq = np.take_along_axis(rpr, sort_order, axis=1)
+            flux = np.take_along_axis(rpv, sort_order, axis=1)
 
             # Count pixels above half flux and circularize this area
             # Do one iteration in case there's a neighbouring object
-            halfflux = 0.5 * mf
-            hwhmsq = np.sum(flux > halfflux)/np.pi
-            hwhm = np.sqrt(np.sum(flux[radsq < 1.5*hwhmsq] > halfflux)/np.pi)
-
-            if hwhm < stamp_size:
-                fwhm_list.append(2*hwhm)
-            else:
-                fwhm_list.append(-999)
+            halfflux = (0.5 * mf).astype(rpv_dtype)[:, np.newaxis]
+            above = flux > halfflux
+            hwhmsq = np.sum(above, axis=1)/np.pi
+            hwhm = np.sqrt(np.sum(above & (radsq < 1.5*hwhmsq[:, np.newaxis]),
+                                  axis=1)/np.pi)
+            fwhm[rows] = np.where(hwhm < stamp_size, 2*hwhm, -999)
 
             # Find the first radius that encircles half the total flux
-            sumflux = np.cumsum(flux)
-            halfflux = 0.5 * tf
-            first_50pflux = np.where(sumflux >= halfflux)[0]
-
-            if first_50pflux.size > 0:
-                e50d_list.append(2*np.sqrt(radsq[first_50pflux[0]]))
-            else:
-                e50d_list.append(-999)
-
-            newmax_list.append(mf)
-
-        objcat["PROFILE_FWHM"][:] = np.array(fwhm_list)
-        objcat["PROFILE_EE50"][:] = np.array(e50d_list)
-        objcat["FLUX_MAX"][:] = np.array(newmax_list)
+            sumflux = np.cumsum(flux, axis=1)
+            halfflux = (0.5 * cattotalflux[rows]).astype(rpv_dtype)[:, np.newaxis]
+            reached = sumflux >= halfflux
+            first_50pflux = np.argmax(reached, axis=1)
+            e50d[rows] = np.where(reached[np.arange(rows.size), first_50pflux],
+                                  2*np.sqrt(radsq[np.arange(rows.size), first_50pflux]),
+                                  -999)
+
+            newmax[rows] = mf
+
+        objcat["PROFILE_FWHM"][:] = fwhm
+        objcat["PROFILE_EE50"][:] = e50d
+        objcat["FLUX_MAX"][:] = newmax
 
     return ad
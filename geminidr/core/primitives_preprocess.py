@@ -4,10 +4,11 @@
 #                                                       primitives_preprocess.py
 # ------------------------------------------------------------------------------
 import math
+import time
 import datetime
 import numpy as np
 from copy import deepcopy
-from scipy.ndimage import binary_dilation, filters
+from scipy.ndimage import binary_dilation
 from astropy.table import Table
 from astropy.convolution import convolve
 
@@ -16,6 +17,7 @@ import gemini_instruments
 from astrodata.provenance import add_provenance
 
 from gempy.gemini import gemini_tools as gt
+from gempy.library import astrotools as at
 from geminidr.gemini.lookups import DQ_definitions as DQ
 
 from geminidr import PrimitivesBASE
@@ -183,29 +185,28 @@ class Preprocess(PrimitivesBASE):
                 except ValueError:  # already validated so must be "mean" or "median"
                     if footprint is not None:
                         mask = (ext.mask & replace_flags) > 0
+                        if replace_value == "median":
+                            # If we're median filtering, we can update the mask...
+                            # if more than half the input pixels were bad, the
+                            # output is still bad. Only the medians around the
+                            # bad pixels are calculated.
+                            ext.data = at.median_fill(ext.data, mask, footprint,
+                                                      max_iters=max_iters)
+                            continue
                         filtered_data = ext.data
                         iter = 0
                         while (iter < max_iters and np.any(mask)):
                             iter += 1
-                            if replace_value == "median":
-                                median_data = filters.median_filter(filtered_data, footprint=footprint)
-                                filtered_data = np.where(mask, median_data, filtered_data)
-                                # If we're median filtering, we can update the mask...
-                                # if more than half the input pixels were bad, the
-                                # output is still bad.
-                                if iter < max_iters:
-                                    mask = filters.median_filter(mask, footprint=footprint)
-                            else:
-                                # "Mean" filtering is just convolution. The astropy
-                                # version handles the mask.
-                                median_data = convolve(filtered_data, footprint,
-                                                       mask=mask, boundary="extend")
-                                filtered_data = np.where(mask, median_data, filtered_data)
-                                # Output pixels are only bad if *all* the pixels in
-                                # the kernel were bad.
-                                if iter < max_iters:
-                                    mask = np.where(convolve(mask, footprint,
-                                                    boundary="extend")>0.9999, True, False)
+                            # "Mean" filtering is just convolution. The astropy
+                            # version handles the mask.
+                            median_data = convolve(filtered_data, footprint,
+                                                   mask=mask, boundary="extend")
+                            filtered_data = np.where(mask, median_data, filtered_data)
+                            # Output pixels are only bad if *all* the pixels in
+                            # the kernel were bad.
+                            if iter < max_iters:
+                                mask = np.where(convolve(mask, footprint,
+                                                boundary="extend")>0.9999, True, False)
                         ext.data = filtered_data
                         continue
                     else:
@@ -278,12 +279,48 @@ class Preprocess(PrimitivesBASE):
                         "science AstroData object and one sky AstroData "
                         "object are required for associateSky")
         else:
-            # Create a dict with the observation times to aid in association
-            # Allows us to select suitable skies and propagate their datetimes
-            sky_times = dict(zip(ad_skies,
-                                 [ad.ut_datetime() for ad in ad_skies]))
-
-            for ad in adinputs:
+            # Gather the times, offsets, and configurations of all the frames
+            # once, so that all the science frames can be associated with
+            # all the skies using arrays (each sky considered only once)
+            if not params["use_all"]:
+                start_time = time.perf_counter()
+                unique_skies = list(dict.fromkeys(ad_skies))
+                ref_time = unique_skies[0].ut_datetime()
+                usec = datetime.timedelta(microseconds=1)
+
+                def times_and_offsets(ads):
+                    return (np.array([(ad.ut_datetime() - ref_time) // usec
+                                      for ad in ads], dtype=np.int64),
+                            np.array([ad.telescope_x_offset() for ad in ads]),
+                            np.array([ad.telescope_y_offset() for ad in ads]))
+
+                sky_times, sky_x, sky_y = times_and_offsets(unique_skies)
+                sci_times, sci_x, sci_y = times_and_offsets(adinputs)
+                # Select only skies with matching configurations and with
+                # sufficiently large separation, and sort by time difference
+                suitable = (gt.matching_inst_config_matrix(
+                    adinputs, unique_skies, check_exposure=True) &
+                            ((sky_x - sci_x[:, np.newaxis]) ** 2 +
+                             (sky_y - sci_y[:, np.newaxis]) ** 2 > min_distsq))
+                time_diffs = abs(sky_times - sci_times[:, np.newaxis])
+                by_time = np.argsort(np.where(suitable, time_diffs,
+                                              np.iinfo(np.int64).max),
+                                     axis=1, kind='stable')
+
+                # Determine how many skies will be matched by the default
+                # conditions, and hence how many to associate
+                num_matching_skies = (suitable &
+                                      (time_diffs <= seconds // usec)).sum(axis=1)
+                num_skies = np.minimum(suitable.sum(axis=1),
+                                       np.maximum(min_skies or 0,
+                                                  num_matching_skies))
+                if max_skies:
+                    num_skies = np.minimum(num_skies, max_skies)
+                log.debug("Associated {} skies with {} frames in {:.3f} "
+                          "seconds".format(len(unique_skies), len(adinputs),
+                                           time.perf_counter() - start_time))
+
+            for i, ad in enumerate(adinputs):
                 # If use_all is True, use all of the sky AstroData objects for
                 # each science AstroData object
                 if params["use_all"]:
@@ -291,36 +328,11 @@ class Preprocess(PrimitivesBASE):
                                  "objects with {}" .format(ad.filename))
                     sky_list = ad_skies
                 else:
-                    sci_time = ad.ut_datetime()
-                    xoffset = ad.telescope_x_offset()
-                    yoffset = ad.telescope_y_offset()
-
-                    # First, select only skies with matching configurations
-                    # and within the specified time and with sufficiently
-                    # large separation. Keep dict format
-                    sky_dict = {k: v for k, v in sky_times.items() if
-                                gt.matching_inst_config(ad1=ad, ad2=k,
-                                                        check_exposure=True)
-                                and ((k.telescope_x_offset() - xoffset)**2 +
-                                     (k.telescope_y_offset() - yoffset)**2
-                                     > min_distsq)}
-
-                    # Sort sky list by time difference and determine how many
-                    # skies will be matched by the default conditions
-                    sky_list = sorted(sky_dict, key=lambda x:
-                                      abs(sky_dict[x]-sci_time))[:max_skies]
-                    num_matching_skies = len([k for k in sky_dict
-                                              if abs(sky_dict[k]-sci_time)
-                                                 <= seconds])
-
-                    # Now create a sky list of the appropriate length
-                    num_skies = min(max_skies or len(sky_list),
-                                    max(min_skies or 0, num_matching_skies))
-                    sky_list = sky_list[:num_skies]
-
                     # Sort sky list chronologically for presentation purposes
-                    sky_list = sorted(sky_list,
-                                      key=lambda sky: sky.ut_datetime())
+                    indices = by_time[i, :num_skies[i]]
+                    indices = indices[np.argsort(sky_times[indices],
+                                                 kind='stable')]
+                    sky_list = [unique_skies[j] for j in indices]
 
                 if sky_list:
                     sky_table = Table(names=('SKYNAME',),
@@ -1142,6 +1154,12 @@ class Preprocess(PrimitivesBASE):
         sky_dict = dict(zip(skies, ad_skies))
         stack_params["dilation"] = 0  # We've already dilated
 
+        # Consecutive science frames usually share most of their skies, so
+        # the sky frames are stacked incrementally, where possible
+        stack_skies = self._sky_stacker(
+            ad_skies, capacity=max([len(tbl) for tbl in skytables if tbl] or [0]),
+            **stack_params)
+
         # Make a list of stacked sky frames, but use references if the same
         # frames are used for more than one adinput. Use a value "0" to
         # indicate we have not tried to make a sky for this adinput ("None"
@@ -1154,8 +1172,7 @@ class Preprocess(PrimitivesBASE):
                 continue
             if stacked_skies[i] == 0:
                 log.stdinfo("Creating sky frame for {}".format(ad.filename))
-                stacked_sky = self.stackSkyFrames([sky_dict[sky] for sky in
-                                                  skytable], **stack_params)
+                stacked_sky = stack_skies([sky_dict[sky] for sky in skytable])
                 #print ad.filename, memusage(proc)
                 if len(stacked_sky) == 1:
                     stacked_sky = stacked_sky[0]
@@ -7,6 +7,7 @@
 # ------------------------------------------------------------------------------
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 from importlib import import_module
@@ -30,11 +31,13 @@ from astrodata import NDAstroData
 from geminidr import PrimitivesBASE
 from geminidr.gemini.lookups import DQ_definitions as DQ, extinction_data as extinct
 from gempy.gemini import gemini_tools as gt
-from gempy.library import astromodels, matching, tracing
+from gempy.library import astromodels, filecache, matching, tracing
 from gempy.library import transform
 from gempy.library.astrotools import array_from_list
 from gempy.library.nddops import NDStacker
 from gempy.library.spectral import Spek1D
+from gempy.utils import logutils
+from recipe_system.config import get_workers
 from recipe_system.utils.decorators import parameter_override
 from . import parameters_spect
 
@@ -768,6 +771,12 @@ class Spect(PrimitivesBASE):
         plot : bool
             Enable plots for debugging.
 
+        workers : None or int
+            Number of extensions to calibrate in parallel, in separate
+            processes (default: 1). If None, the number of workers in the
+            reduce configuration is used. Each extension's solution is the
+            same however many workers are used.
+
         Returns
         -------
         list of :class:`~astrodata.AstroData`
@@ -811,251 +820,102 @@ class Spect(PrimitivesBASE):
         linelists = {}
         if arc_file is not None:
             try:
-                arc_lines = np.loadtxt(arc_file, usecols=[0])
+                arc_lines, arc_weights = filecache.read_linelist(arc_file).subset()
             except (OSError, TypeError):
                 log.warning("Cannot read file {} - using default linelist".format(arc_file))
                 arc_file = None
             else:
                 log.stdinfo("Read arc line list {}".format(arc_file))
-                try:
-                    arc_weights = np.sqrt(np.loadtxt(arc_file, usecols=[1]))
-                except IndexError:
-                    arc_weights = None
-                else:
+                if arc_weights is not None:
+                    arc_weights = np.sqrt(arc_weights)
                     log.stdinfo("Read arc line relative weights")
 
-        for ad in adinputs:
-            log.info("Determining wavelength solution for {}".format(ad.filename))
-            for ext in ad:
-                if len(ad) > 1:
-                    log.info("Determining solution for EXTVER {}".format(ext.hdr['EXTVER']))
-
-                # Determine direction of extraction for 2D spectrum
-                if ext.data.ndim > 1:
-                    direction = "row" if ext.dispersion_axis() == 1 else "column"
-                    data, mask, variance, extract_slice = _average_along_slit(ext, center=center, nsum=nsum)
-                    log.stdinfo("Extracting 1D spectrum from {}s {} to {}".
-                                format(direction, extract_slice.start + 1, extract_slice.stop))
-                else:
-                    data = ext.data
-                    mask = ext.mask
-                    variance = ext.variance
-
-                # Mask bad columns but not saturated/non-linear data points
-                if mask is not None:
-                    mask = mask & (65535 ^ (DQ.saturated | DQ.non_linear))
-                    data[mask > 0] = 0.
-
-                cenwave = params["central_wavelength"] or ext.central_wavelength(asNanometers=True)
-                dw = params["dispersion"] or ext.dispersion(asNanometers=True)
-                w1 = cenwave - 0.5 * len(data) * abs(dw)
-                w2 = cenwave + 0.5 * len(data) * abs(dw)
-                log.stdinfo("Using central wavelength {:.1f} nm and dispersion "
-                            "{:.3f} nm/pixel".format(cenwave, dw))
-
-                if fwidth is None:
-                    fwidth = tracing.estimate_peak_width(data)
-                    log.stdinfo("Estimated feature width: {:.2f} pixels".format(fwidth))
-
-                # Don't read linelist if it's the one we already have
-                # (For user-supplied, we read it at the start, so don't do this at all)
-                if arc_file is None:
-                    arc_lines, arc_weights = self._get_arc_linelist(ext, w1=w1, w2=w2, dw=dw)
-
-                # arc_weights = None
-
-                if min(arc_lines) > cenwave + 0.5 * len(data) * abs(dw):
-                    log.warning("Line list appears to be in Angstroms; converting to nm")
-                    arc_lines *= 0.1
-
-                # Find peaks; convert width FWHM to sigma
-                widths = 0.42466 * fwidth * np.arange(0.8, 1.21, 0.05)  # TODO!
-                peaks, peak_snrs = tracing.find_peaks(data, widths, mask=mask,
-                                                      variance=variance, min_snr=min_snr)
-                log.stdinfo('{}: {} peaks and {} arc lines'.
-                            format(ad.filename, len(peaks), len(arc_lines)))
-
-                # Compute all the different types of weightings so we can
-                # change between them as needs require
-                weights = {'none': np.ones((len(peaks),)),
-                           'natural': peak_snrs}
-
-                # The "relative" weights compares each line strength to
-                # those of the lines close to it
-                tree = spatial.cKDTree(np.array([peaks]).T)
-                # Find lines within 10% of the array size
-                indices = tree.query(np.array([peaks]).T, k=10,
-                                     distance_upper_bound=abs(0.1 * len(data) * dw))[1]
-                snrs = np.array(list(peak_snrs) + [np.nan])[indices]
-                # Normalize weights by the maximum of these lines
-                weights['relative'] = peak_snrs / np.nanmedian(snrs, axis=1)
-
-                plot_data = data
-
-                # Some diagnostic plotting
-                yplot = 0
-                plt.ioff()
-                if plot:
-                    fig, ax = plt.subplots()
+        workers = params.get("workers", 1)
+        if workers is None:
+            workers = get_workers()
+        if plot and workers > 1:
+            log.warning("Cannot make plots in parallel: using one process")
+            workers = 1
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
 
-                # The very first model is called "m_final" because at each
-                # iteration the next initial model comes from the fitted
-                # (final) model of the previous iteration
-                m_final = models.Chebyshev1D(degree=1, c0=cenwave,
-                                             c1=0.5 * dw * len(data), domain=[0, len(data) - 1])
-                if plot:
-                    plot_arc_fit(data, peaks, arc_lines, arc_weights, m_final, "Initial model")
-                log.stdinfo('Initial model: {}'.format(repr(m_final)))
+        fits = []
+        try:
+            for ad in adinputs:
+                log.info("Determining wavelength solution for {}".format(ad.filename))
+                for index, ext in enumerate(ad):
+                    if len(ad) > 1:
+                        log.info("Determining solution for EXTVER {}".format(ext.hdr['EXTVER']))
+
+                    # Determine direction of extraction for 2D spectrum
+                    if ext.data.ndim > 1:
+                        direction = "row" if ext.dispersion_axis() == 1 else "column"
+                        data, mask, variance, extract_slice = _average_along_slit(ext, center=center, nsum=nsum)
+                        log.stdinfo("Extracting 1D spectrum from {}s {} to {}".
+                                    format(direction, extract_slice.start + 1, extract_slice.stop))
+                        extraction = (direction, 0.5 * (extract_slice.start + extract_slice.stop))
+                    else:
+                        data = ext.data
+                        mask = ext.mask
+                        variance = ext.variance
+                        extraction = None
+
+                    # Mask bad columns but not saturated/non-linear data points
+                    if mask is not None:
+                        mask = mask & (65535 ^ (DQ.saturated | DQ.non_linear))
+                        data[mask > 0] = 0.
+
+                    cenwave = params["central_wavelength"] or ext.central_wavelength(asNanometers=True)
+                    dw = params["dispersion"] or ext.dispersion(asNanometers=True)
+                    w1 = cenwave - 0.5 * len(data) * abs(dw)
+                    w2 = cenwave + 0.5 * len(data) * abs(dw)
+                    log.stdinfo("Using central wavelength {:.1f} nm and dispersion "
+                                "{:.3f} nm/pixel".format(cenwave, dw))
 
-                kdsigma = fwidth * abs(dw)
-                peaks_to_fit = peak_snrs > min_snr
-                peaks_to_fit[np.argsort(peak_snrs)[len(peaks) - nbright:]] = False
+                    if fwidth is None:
+                        fwidth = tracing.estimate_peak_width(data)
+                        log.stdinfo("Estimated feature width: {:.2f} pixels".format(fwidth))
 
-                # Temporary code to help with testing
-                try:
-                    sequence = self.fit_sequence
-                except AttributeError:
+                    # Don't read linelist if it's the one we already have
+                    # (For user-supplied, we read it at the start, so don't do this at all)
+                    if arc_file is None:
+                        arc_lines, arc_weights = self._get_arc_linelist(ext, w1=w1, w2=w2, dw=dw)
 
-                    # FixMe: toggle commented lines bellow to make tests pass
+                    # arc_weights = None
 
-                    sequence = (((1, 'none', 'basinhopping', ['c1']), (2, 'none', 'basinhopping')) +
-                                tuple((order, 'none', 'Nelder-Mead') for order in range(2, order+1)))
+                    if min(arc_lines) > cenwave + 0.5 * len(data) * abs(dw):
+                        log.warning("Line list appears to be in Angstroms; converting to nm")
+                        arc_lines *= 0.1
 
-                    # sequence = (((1, 'none', 'basinhopping', ['c1']), (2, 'none', 'basinhopping', ['c1'])) +
-                    #             tuple((order, 'relative', 'Nelder-Mead') for order in range(2, order + 1)))
+                    fit_kwargs = {'data': data, 'mask': mask, 'variance': variance,
+                                  'arc_lines': arc_lines, 'arc_weights': arc_weights,
+                                  'cenwave': cenwave, 'dw': dw, 'fwidth': fwidth,
+                                  'min_snr': min_snr, 'order': order, 'nbright': nbright,
+                                  'sequence': getattr(self, 'fit_sequence', None),
+                                  'extraction': extraction, 'seed': index, 'filename': ad.filename, 'plot': plot}
 
-                # Now make repeated fits, increasing the polynomial order
-                for item in sequence:
-                    if len(item) == 3:
-                        ord, weight_type, method = item
-                        fixems = None
+                    if executor is None:
+                        ext.WAVECAL = _fit_arc_lines(log=log, **fit_kwargs)
                     else:
-                        ord, weight_type, method, fixems = item
-                    in_weights = weights[weight_type]
-
-                    # TODO: Can probably remove when this is optimized
-                    if ord > order:
-                        continue
-
-                    # Create new initial model based on latest model
-                    m_init = models.Chebyshev1D(degree=ord, domain=m_final.domain)
-                    for i in range(ord + 1):
-                        param = 'c{}'.format(i)
-                        setattr(m_init, param, getattr(m_final, param, 0))
-
-                    # Set some bounds; this may need to be abstracted for
-                    # different instruments? TODO
-                    dw = abs(2 * m_init.c1 / np.diff(m_init.domain)[0])
-
-                    # FixMe: "0.02 * cenwave" makes tests for determineWavelengthSolution
-                    #  fail. Use "0.05 * cenwave" to make them pass.
-                    c0_unc = 0.02 * cenwave
-
-                    m_init.c0.bounds = (m_init.c0 - c0_unc, m_init.c0 + c0_unc)
-                    c1_unc = 0.005 * abs(m_init.c1)
-                    m_init.c1.bounds = tuple(sorted([m_init.c1 - c1_unc, m_init.c1 + c1_unc]))
-                    for i in range(2, ord + 1):
-                        getattr(m_init, 'c{}'.format(i)).bounds = (-5, 5)
-
-                    if fixems is not None:
-                        for fx in fixems:
-                            getattr(m_init, fx).fixed = True
-
-                    fit_it = matching.KDTreeFitter(sigma=kdsigma, maxsig=10, k=3, method=method)
-                    m_final = fit_it(m_init, peaks[peaks_to_fit], arc_lines,
-                                     in_weights=in_weights[peaks_to_fit],
-                                     ref_weights=None if weight_type == 'none' else arc_weights)
-                    #                 method='basinhopping' if weight_type is 'none' else 'Nelder-Mead')
-                    #                 options={'xtol': 1.0e-7, 'ftol': 1.0e-8})
-
-                    log.stdinfo('{} {}'.format(repr(m_final), fit_it.statistic))
-                    if plot:
-                        plot_arc_fit(plot_data, peaks, arc_lines, arc_weights, m_final,
-                                     "KDFit model order {} KDsigma = {}".format(ord, kdsigma))
-
-                    match_radius = 2 * fwidth * abs(m_final.c1) / len(data)  # fwidth pixels
-                    for p in m_final.param_names:
-                        getattr(m_final, p).bounds = (None, None)
-
-                    m = matching.Chebyshev1DMatchBox.create_from_kdfit(peaks, arc_lines,
-                                                                       model=m_final, match_radius=match_radius,
-                                                                       sigma_clip=3)
-                    # kdsigma = m.rms_output
-                    # print("New kdsigma {}".format(kdsigma))
-                    kdsigma = fwidth * abs(dw)
-                    yplot += 1
-
-                # Remove bounds from the model
-                for p in m_final.param_names:
-                    getattr(m_final, p).bounds = (None, None)
-
-                # FixMe: using "4 * fwidth" breaks tests in test_gmos_spect_ls_wavelength_calibration.
-                #   Use "2 * fwidth" to make them pass.
-                match_radius = 4 * fwidth * abs(m_final.c1) / len(data)  # 2*fwidth pixels
-
-                # match_radius = kdsigma
-                m = matching.Chebyshev1DMatchBox.create_from_kdfit(peaks, arc_lines,
-                                                                   model=m_final, match_radius=match_radius,
-                                                                   sigma_clip=3)
-                if plot:
-                    for incoord, outcoord in zip(m.forward(m.input_coords), m.output_coords):
-                        ax.text(incoord, yplot, '{:.4f}'.format(outcoord), rotation=90,
-                                ha='center', va='top')
-
-                log.stdinfo('{} {} {}'.format(repr(m.forward), len(m.input_coords), m.rms_output))
-                if plot:
-                    plot_arc_fit(plot_data, peaks, arc_lines, arc_weights, m.forward,
-                                 "MatchBox model order {ord}")
-
-                # Choice of kdsigma can have a big effect. This oscillates
-                # around the initial choice, with increasing amplitude.
-                # kdsigma = 10.*abs(dw) * (((1.0+0.1*((kditer+1)//2)))**((-1)**kditer)
-                #                    if kditer<21 else 1)
-
-                m_final = m.forward
-                rms = m.rms_output
-                nmatched = len(m.input_coords)
-                log.stdinfo(m_final)
-                log.stdinfo("Matched {} lines with rms = {:.3f} nm.".format(nmatched, rms))
-
-                if plot:
-                    plot_arc_fit(plot_data, peaks, arc_lines, arc_weights, m_final, "Final fit")
-                    m.display_fit()
-                    plt.show()
-
-                m.display_fit()
-
-                if plot:
-                    plt.savefig(ad.filename.replace('.fits', '.jpg'))
-
-                m.sort()
-                # Add 1 to pixel coordinates so they're 1-indexed
-                incoords = np.float32(m.input_coords) + 1
-                outcoords = np.float32(m.output_coords)
-                model_dict = astromodels.chebyshev_to_dict(m_final)
-                model_dict['rms'] = rms
-                # Add information about where the extraction took place
-                if ext.data.ndim > 1:
-                    model_dict[direction] = 0.5 * (extract_slice.start + extract_slice.stop)
-
-                # Ensure all columns have the same length
-                pad_rows = nmatched - len(model_dict)
-                if pad_rows < 0:  # Really shouldn't be the case
-                    incoords = list(incoords) + [0] * (-pad_rows)
-                    outcoords = list(outcoords) + [0] * (-pad_rows)
-                    pad_rows = 0
-
-                fit_table = Table([list(model_dict.keys()) + [''] * pad_rows,
-                                   list(model_dict.values()) + [0] * pad_rows,
-                                   incoords, outcoords],
-                                  names=("name", "coefficients", "peaks", "wavelengths"))
-                fit_table.meta['comments'] = ['coefficients are based on 0-indexing',
-                                              'peaks column is 1-indexed']
+                        fits.append((ext, executor.submit(_fit_arc_lines_in_worker,
+                                                          fit_kwargs)))
+
+                # Timestamp and update the filename
+                gt.mark_history(ad, primname=self.myself(), keyword=timestamp_key)
+                ad.update_filename(suffix=sfx, strip=True)
+
+            # Attach the solutions in the original order, and emit the log
+            # messages from each fit together
+            for ext, future in fits:
+                fit_table, log_records = future.result()
+                for level, msg in log_records:
+                    getattr(log, level)(msg)
                 ext.WAVECAL = fit_table
-
-            # Timestamp and update the filename
-            gt.mark_history(ad, primname=self.myself(), keyword=timestamp_key)
-            ad.update_filename(suffix=sfx, strip=True)
+        finally:
+            if executor is not None:
+                # Don't start fits that are still queued if there's an error
+                for _, future in fits:
+                    future.cancel()
+                executor.shutdown(wait=True)
 
         return adinputs
 
@@ -2349,12 +2209,7 @@ class Spect(PrimitivesBASE):
         """
         lookup_dir = os.path.dirname(import_module('.__init__', self.inst_lookups).__file__)
         filename = os.path.join(lookup_dir, 'linelist.dat')
-        arc_lines = np.loadtxt(filename, usecols=[0])
-        try:
-            weights = np.loadtxt(filename, usecols=[1])
-        except IndexError:
-            weights = None
-        return arc_lines, weights
+        return filecache.read_linelist(filename).subset(w1, w2)
 
     def _get_spectrophotometry(self, filename):
         """
@@ -2385,6 +2240,13 @@ class Spect(PrimitivesBASE):
         FileNotFoundError: if file does not exist
         InconsistentTableError: if the file can't be read as ASCII
         """
+        # The parsed table is cached, so each file is only read once
+        return filecache.read_table(filename, self._read_spectrophotometry)
+
+    def _read_spectrophotometry(self, filename):
+        """
+        Does the work of `_get_spectrophotometry()`, without caching
+        """
         log = self.log
         try:
             tbl = Table.read(filename)
@@ -2596,6 +2458,271 @@ def QESpline(coeffs, xpix, data, weights, boundaries, order):
     return result
 
 
+def _fit_arc_lines(data, mask, variance, arc_lines, arc_weights, cenwave, dw,
+                   fwidth, min_snr=10., order=2, nbright=0, sequence=None,
+                   extraction=None, seed=0, filename='', plot=False, log=None):
+    """
+    Identifies peaks in a 1D arc spectrum and determines the wavelength
+    solution by matching them to the arc line list, for the primitive
+    `determineWavelengthSolution()`. This is a function (rather than a
+    method) so that it can be run in a separate process.
+
+    Parameters
+    ----------
+    data, mask, variance : `~numpy.ndarray`
+        1D arc spectrum (bad pixels in the data should be set to zero)
+    arc_lines : array_like
+        wavelengths of the arc lines (nm)
+    arc_weights : array_like or None
+        weights of the arc lines
+    cenwave : float
+        central wavelength (nm)
+    dw : float
+        dispersion (nm/pixel)
+    fwidth : float
+        expected width of arc lines (pixels)
+    min_snr : float
+        minimum S/N ratio of peaks
+    order : int
+        order of Chebyshev fitting function
+    nbright : int
+        number of brightest lines to cull before fitting
+    sequence : tuple or None
+        sequence of (order, weight_type, method[, fixed parameters]) fits
+        to perform (None => default)
+    extraction : tuple or None
+        (direction, position) of the 1D extraction from a 2D spectrum
+    seed : int
+        seed for the random numbers used by basinhopping, so the result is
+        reproducible and independent of any other extensions' fits
+    filename : str
+        name of the file, for logging and plotting
+    plot : bool
+        make diagnostic plots?
+    log : logger
+        where to log messages (None => the gempy logger)
+
+    Returns
+    -------
+    `~astropy.table.Table` : the WAVECAL table
+    """
+    if log is None:
+        log = logutils.get_logger(__name__)
+
+    # Find peaks; convert width FWHM to sigma
+    widths = 0.42466 * fwidth * np.arange(0.8, 1.21, 0.05)  # TODO!
+    peaks, peak_snrs = tracing.find_peaks(data, widths, mask=mask,
+                                          variance=variance, min_snr=min_snr)
+    log.stdinfo('{}: {} peaks and {} arc lines'.
+                format(filename, len(peaks), len(arc_lines)))
+
+    # Compute all the different types of weightings so we can
+    # change between them as needs require
+    weights = {'none': np.ones((len(peaks),)),
+               'natural': peak_snrs}
+
+    # The "relative" weights compares each line strength to
+    # those of the lines close to it
+    tree = spatial.cKDTree(np.array([peaks]).T)
+    # Find lines within 10% of the array size
+    indices = tree.query(np.array([peaks]).T, k=10,
+                         distance_upper_bound=abs(0.1 * len(data) * dw))[1]
+    snrs = np.array(list(peak_snrs) + [np.nan])[indices]
+    # Normalize weights by the maximum of these lines
+    weights['relative'] = peak_snrs / np.nanmedian(snrs, axis=1)
+
+    plot_data = data
+
+    # Some diagnostic plotting
+    yplot = 0
+    plt.ioff()
+    if plot:
+        fig, ax = plt.subplots()
+
+    # The very first model is called "m_final" because at each
+    # iteration the next initial model comes from the fitted
+    # (final) model of the previous iteration
+    m_final = models.Chebyshev1D(degree=1, c0=cenwave,
+                                 c1=0.5 * dw * len(data), domain=[0, len(data) - 1])
+    if plot:
+        plot_arc_fit(data, peaks, arc_lines, arc_weights, m_final, "Initial model")
+    log.stdinfo('Initial model: {}'.format(repr(m_final)))
+
+    kdsigma = fwidth * abs(dw)
+    random_state = np.random.RandomState(seed)
+    peaks_to_fit = peak_snrs > min_snr
+    peaks_to_fit[np.argsort(peak_snrs)[len(peaks) - nbright:]] = False
+
+    # Temporary code to help with testing
+    if sequence is None:
+
+        # FixMe: toggle commented lines bellow to make tests pass
+
+        sequence = (((1, 'none', 'basinhopping', ['c1']), (2, 'none', 'basinhopping')) +
+                    tuple((order, 'none', 'Nelder-Mead') for order in range(2, order+1)))
+
+        # sequence = (((1, 'none', 'basinhopping', ['c1']), (2, 'none', 'basinhopping', ['c1'])) +
+        #             tuple((order, 'relative', 'Nelder-Mead') for order in range(2, order + 1)))
+
+    # Now make repeated fits, increasing the polynomial order
+    for item in sequence:
+        if len(item) == 3:
+            ord, weight_type, method = item
+            fixems = None
+        else:
+            ord, weight_type, method, fixems = item
+        in_weights = weights[weight_type]
+
+        # TODO: Can probably remove when this is optimized
+        if ord > order:
+            continue
+
+        # Create new initial model based on latest model
+        m_init = models.Chebyshev1D(degree=ord, domain=m_final.domain)
+        for i in range(ord + 1):
+            param = 'c{}'.format(i)
+            setattr(m_init, param, getattr(m_final, param, 0))
+
+        # Set some bounds; this may need to be abstracted for
+        # different instruments? TODO
+        dw = abs(2 * m_init.c1 / np.diff(m_init.domain)[0])
+
+        # FixMe: "0.02 * cenwave" makes tests for determineWavelengthSolution
+        #  fail. Use "0.05 * cenwave" to make them pass.
+        c0_unc = 0.02 * cenwave
+
+        m_init.c0.bounds = (m_init.c0 - c0_unc, m_init.c0 + c0_unc)
+        c1_unc = 0.005 * abs(m_init.c1)
+        m_init.c1.bounds = tuple(sorted([m_init.c1 - c1_unc, m_init.c1 + c1_unc]))
+        for i in range(2, ord + 1):
+            getattr(m_init, 'c{}'.format(i)).bounds = (-5, 5)
+
+        if fixems is not None:
+            for fx in fixems:
+                getattr(m_init, fx).fixed = True
+
+        fit_it = matching.KDTreeFitter(sigma=kdsigma, maxsig=10, k=3, method=method)
+        fit_kwargs = {'seed': random_state} if method == 'basinhopping' else {}
+        m_final = fit_it(m_init, peaks[peaks_to_fit], arc_lines,
+                         in_weights=in_weights[peaks_to_fit],
+                         ref_weights=None if weight_type == 'none' else arc_weights,
+                         **fit_kwargs)
+        #                 method='basinhopping' if weight_type is 'none' else 'Nelder-Mead')
+        #                 options={'xtol': 1.0e-7, 'ftol': 1.0e-8})
+
+        log.stdinfo('{} {}'.format(repr(m_final), fit_it.statistic))
+        if plot:
+            plot_arc_fit(plot_data, peaks, arc_lines, arc_weights, m_final,
+                         "KDFit model order {} KDsigma = {}".format(ord, kdsigma))
+
+        match_radius = 2 * fwidth * abs(m_final.c1) / len(data)  # fwidth pixels
+        for p in m_final.param_names:
+            getattr(m_final, p).bounds = (None, None)
+
+        m = matching.Chebyshev1DMatchBox.create_from_kdfit(peaks, arc_lines,
+                                                           model=m_final, match_radius=match_radius,
+                                                           sigma_clip=3)
+        # kdsigma = m.rms_output
+        # print("New kdsigma {}".format(kdsigma))
+        kdsigma = fwidth * abs(dw)
+        yplot += 1
+
+    # Remove bounds from the model
+    for p in m_final.param_names:
+        getattr(m_final, p).bounds = (None, None)
+
+    # FixMe: using "4 * fwidth" breaks tests in test_gmos_spect_ls_wavelength_calibration.
+    #   Use "2 * fwidth" to make them pass.
+    match_radius = 4 * fwidth * abs(m_final.c1) / len(data)  # 2*fwidth pixels
+
+    # match_radius = kdsigma
+    m = matching.Chebyshev1DMatchBox.create_from_kdfit(peaks, arc_lines,
+                                                       model=m_final, match_radius=match_radius,
+                                                       sigma_clip=3)
+    if plot:
+        for incoord, outcoord in zip(m.forward(m.input_coords), m.output_coords):
+            ax.text(incoord, yplot, '{:.4f}'.format(outcoord), rotation=90,
+                    ha='center', va='top')
+
+    log.stdinfo('{} {} {}'.format(repr(m.forward), len(m.input_coords), m.rms_output))
+    if plot:
+        plot_arc_fit(plot_data, peaks, arc_lines, arc_weights, m.forward,
+                     "MatchBox model order {ord}")
+
+    # Choice of kdsigma can have a big effect. This oscillates
+    # around the initial choice, with increasing amplitude.
+    # kdsigma = 10.*abs(dw) * (((1.0+0.1*((kditer+1)//2)))**((-1)**kditer)
+    #                    if kditer<21 else 1)
+
+    m_final = m.forward
+    rms = m.rms_output
+    nmatched = len(m.input_coords)
+    log.stdinfo(m_final)
+    log.stdinfo("Matched {} lines with rms = {:.3f} nm.".format(nmatched, rms))
+
+    if plot:
+        plot_arc_fit(plot_data, peaks, arc_lines, arc_weights, m_final, "Final fit")
+        m.display_fit()
+        plt.show()
+
+    m.display_fit()
+
+    if plot:
+        plt.savefig(filename.replace('.fits', '.jpg'))
+
+    m.sort()
+    # Add 1 to pixel coordinates so they're 1-indexed
+    incoords = np.float32(m.input_coords) + 1
+    outcoords = np.float32(m.output_coords)
+    model_dict = astromodels.chebyshev_to_dict(m_final)
+    model_dict['rms'] = rms
+    # Add information about where the extraction took place
+    if extraction is not None:
+        direction, position = extraction
+        model_dict[direction] = position
+
+    # Ensure all columns have the same length
+    pad_rows = nmatched - len(model_dict)
+    if pad_rows < 0:  # Really shouldn't be the case
+        incoords = list(incoords) + [0] * (-pad_rows)
+        outcoords = list(outcoords) + [0] * (-pad_rows)
+        pad_rows = 0
+
+    fit_table = Table([list(model_dict.keys()) + [''] * pad_rows,
+                       list(model_dict.values()) + [0] * pad_rows,
+                       incoords, outcoords],
+                      names=("name", "coefficients", "peaks", "wavelengths"))
+    fit_table.meta['comments'] = ['coefficients are based on 0-indexing',
+                                  'peaks column is 1-indexed']
+    return fit_table
+
+
+def _fit_arc_lines_in_worker(kwargs):
+    """
+    Runs `_fit_arc_lines()` in a worker process, recording the log messages
+    so that they can be emitted (in order) by the parent process.
+
+    Returns
+    -------
+    tuple : (WAVECAL table, list of (level, message) tuples)
+    """
+    log = _LogRecorder()
+    return _fit_arc_lines(log=log, **kwargs), log.records
+
+
+class _LogRecorder:
+    """
+    A stand-in for a logger that records messages so they can be replayed
+    """
+    def __init__(self):
+        self.records = []
+
+    def __getattr__(self, level):
+        def record(msg, *args, **kwargs):
+            self.records.append((level, str(msg)))
+        return record
+
+
 def plot_arc_fit(data, peaks, arc_lines, arc_weights, model, title):
     fig, ax = plt.subplots()
     plt.rcParams.update({'font.size': 12})
@@ -4,6 +4,7 @@
 #                                                            primitives_stack.py
 # ------------------------------------------------------------------------------
 import astrodata
+from astrodata import NDAstroData
 from astrodata.fits import windowedOp
 
 import numpy as np
@@ -12,7 +13,7 @@ from functools import partial
 from copy import deepcopy
 
 from gempy.gemini import gemini_tools as gt
-from gempy.library.nddops import NDStacker
+from gempy.library.nddops import NDStacker, SlidingStacker
 
 from geminidr import PrimitivesBASE
 from . import parameters_stack
@@ -145,18 +146,7 @@ class Stack(PrimitivesBASE):
 
         # Determine the average gain from the input AstroData objects and
         # add in quadrature the read noise
-        gains = [ad.gain() for ad in adinputs]
-        read_noises = [ad.read_noise() for ad in adinputs]
-
-        assert all(gain is not None for gain in gains), "Gain problem"
-        assert all(rn is not None for rn in read_noises), "RN problem"
-
-        # Compute gain and read noise of final stacked images
-        nexts = len(gains[0])
-        gain_list = [np.mean([gain[i] for gain in gains])
-                     for i in range(nexts)]
-        read_noise_list = [np.sqrt(np.sum([rn[i]*rn[i] for rn in read_noises]))
-                           for i in range(nexts)]
+        gain_list, read_noise_list = self._stack_gain_read_noise(adinputs)
 
         num_img = len(adinputs)
         num_ext = len(adinputs[0])
@@ -164,8 +154,8 @@ class Stack(PrimitivesBASE):
         scale_factors = np.ones_like(zero_offsets)
 
         # Try to determine how much memory we're going to need to stack and
-        # whether it's necessary to flush pixel data to disk first
-        # Also determine kernel size from offered memory and bytes per pixel
+        # whether it's necessary to flush pixel data to disk first, so that
+        # it can be read tile by tile when stacking
         bytes_per_ext = []
         for ext in adinputs[0]:
             bytes = 0
@@ -240,6 +230,9 @@ class Stack(PrimitivesBASE):
         stack_function = NDStacker(combine=params["operation"],
                                    reject=reject_method,
                                    log=self.log, **params)
+        # The debugging output only makes sense if the tiles are processed
+        # in order
+        max_workers = None if params["debug_pixel"] is None else 1
 
         # NDStacker uses DQ if it exists; if we don't want that, delete the DQs!
         if not apply_dq:
@@ -261,60 +254,23 @@ class Stack(PrimitivesBASE):
                 for ad, value in zip(adinputs, numbers):
                     log.stdinfo("{:40s}{:10.3f}".format(ad.filename, value))
 
-            shape = adinputs[0][index].nddata.shape
-            if memory is None:
-                kernel = shape
-            else:
-                # Chop the image horizontally into equal-sized chunks to process
-                # This uses the minimum number of steps and uses minimum memory
-                # per step.
-                oversubscription = (bytes_per_ext[index] * num_img) // memory + 1
-                kernel = ((shape[0] + oversubscription - 1) // oversubscription,) + shape[1:]
+            # The image is chopped horizontally into tiles, which are read
+            # from the (memory-mapped) inputs and stacked in parallel, with
+            # the tile size chosen to stay within the memory budget
             with_uncertainty = True  # Since all stacking methods return variance
             with_mask = apply_dq and not any(ad[index].nddata.window[:].mask is None
                                              for ad in adinputs)
             result = windowedOp(partial(stack_function, scale=sfactors, zero=zfactors),
                                 [ad[index].nddata for ad in adinputs],
-                                kernel=kernel, dtype=np.float32,
+                                dtype=np.float32, memory=memory,
+                                max_workers=max_workers,
+                                temporaries=NDStacker.temporary_bytes,
                                 with_uncertainty=with_uncertainty, with_mask=with_mask)
             ad_out.append(result)
             log.stdinfo("")
 
-        # Propagate REFCAT as the union of all input REFCATs
-        refcats = [ad.REFCAT for ad in adinputs if hasattr(ad, 'REFCAT')]
-        if refcats:
-            out_refcat = table.unique(table.vstack(refcats, metadata_conflicts='silent'),
-                                      keys='Cat_Id')
-            out_refcat['Id'] = list(range(1, len(out_refcat)+1))
-            ad_out.REFCAT = out_refcat
-
-        # Set AIRMASS to be the mean of the input values
-        try:
-            airmass_kw = ad_out._keyword_for('airmass')
-            mean_airmass = np.mean([ad.airmass() for ad in adinputs])
-        except Exception:  # generic implementation failure (probably non-Gemini)
-            pass
-        else:
-            ad_out.phu.set(airmass_kw, mean_airmass, "Mean airmass for the exposure")
-
-        # Set GAIN to the average of input gains. Set the RDNOISE to the
-        # sum in quadrature of the input read noises.
-        for ext, gain, rn in zip(ad_out, gain_list, read_noise_list):
-            ext.hdr.set('GAIN', gain, self.keyword_comments['GAIN'])
-            ext.hdr.set('RDNOISE', rn, self.keyword_comments['RDNOISE'])
-        # Stick the first extension's values in the PHU
-        ad_out.phu.set('GAIN', gain_list[0], self.keyword_comments['GAIN'])
-        ad_out.phu.set('RDNOISE', read_noise_list[0], self.keyword_comments['RDNOISE'])
-
-        # Add suffix to datalabel to distinguish from the reference frame
-        ad_out.phu.set('DATALAB', "{}{}".format(ad_out.data_label(), sfx),
-                       self.keyword_comments['DATALAB'])
-
-        # Add other keywords to the PHU about the stacking inputs
-        ad_out.orig_filename = ad_out.phu.get('ORIGNAME')
-        ad_out.phu.set('NCOMBINE', len(adinputs), self.keyword_comments['NCOMBINE'])
-        for i, ad in enumerate(adinputs, start=1):
-            ad_out.phu.set('IMCMB{:03d}'.format(i), ad.phu.get('ORIGNAME', ad.filename))
+        self._update_stack_headers(ad_out, adinputs, gain_list,
+                                   read_noise_list, sfx)
 
         # Timestamp and update filename and prepare to return single output
         gt.mark_history(ad_out, primname=self.myself(), keyword=timestamp_key)
@@ -404,3 +360,207 @@ class Stack(PrimitivesBASE):
         #                ext += ref - this
         adinputs = self.stackFrames(adinputs, **stack_params)
         return adinputs
+
+    def _sky_stacker(self, skies, capacity, **params):
+        """
+        Returns a function that stacks a list of sky frames, drawn from
+        `skies`, in the same way as stackSkyFrames(). This is used to make a
+        sky for each frame in a sequence, where consecutive skies are made
+        from mostly the same frames. If the combination can be done
+        incrementally, a SlidingStacker is kept for each extension and only
+        the frames that differ from those in the previous stack are added
+        or removed. Otherwise (for sigma-clipping, say), and for any list
+        of frames that can't be handled this way, stackSkyFrames() is
+        called to stack the frames from scratch.
+
+        Parameters
+        ----------
+        skies: list of AD
+            all the sky frames that might be stacked
+        capacity: int
+            the maximum number of frames in a stack
+        params: dict
+            parameters for stackSkyFrames()
+
+        Returns
+        -------
+        callable: takes a list of AD and returns a list of the stacked AD
+        """
+        log = self.log
+        params = params.copy()
+        if params["mask_objects"] and params["dilation"] > 0:
+            # Only dilate the object masks once, not for every stack
+            skies = self.dilateObjectMask(skies, dilation=params["dilation"])
+            params["dilation"] = 0
+        restack = partial(self.stackSkyFrames, **params)
+
+        operation = params["operation"]
+        reject_method = params["reject_method"]
+        apply_dq = params["apply_dq"]
+        mask_objects = params["mask_objects"]
+        if (not skies or operation not in SlidingStacker.combiners or
+                reject_method not in SlidingStacker.rejectors or
+                params["debug_pixel"] is not None or
+                any("PREPARED" not in ad.tags for ad in skies) or
+                len({len(ad) for ad in skies}) > 1 or
+                len({ext.nddata.shape for ad in skies for ext in ad}) > 1 or
+                len({ext.variance is None for ad in skies for ext in ad}) > 1 or
+                (apply_dq and len({ext.mask is None and not (
+                    mask_objects and hasattr(ext, 'OBJMASK'))
+                                   for ad in skies for ext in ad}) > 1)):
+            return restack
+
+        # The sorted stack, ids, data, mask, and variance for every frame
+        bytes_per_frame = sum(ext.data.size * (13 if ext.variance is None else 17)
+                              for ext in skies[0])
+        memory = params["memory"]
+        if memory is not None and capacity * bytes_per_frame > memory * 1e9:
+            log.debug("Not enough memory to stack sky frames incrementally")
+            return restack
+
+        scale, zero = params["scale"], params["zero"] and not params["scale"]
+        separate_ext = params["separate_ext"]
+        statsec = params["statsec"]
+        if statsec:
+            statsec = tuple([slice(int(start)-1, int(end))
+                             for x in reversed(statsec.strip('[]').split(','))
+                             for start, end in [x.split(':')]])
+        sky_ids = {id(ad) for ad in skies}
+        stackers = [SlidingStacker(capacity, combine=operation,
+                                   reject=reject_method, **params)
+                    for ext in skies[0]]
+        levels = {}
+
+        def sky_mask(ext):
+            if mask_objects and hasattr(ext, 'OBJMASK'):
+                return (ext.OBJMASK.copy() if ext.mask is None
+                        else ext.mask | ext.OBJMASK)
+            return ext.mask
+
+        def sky_levels(ad):
+            # Background levels are measured once for each frame
+            if id(ad) not in levels:
+                levels[id(ad)] = []
+                for ext in ad:
+                    mask = sky_mask(ext)
+                    if statsec is None:
+                        nddata = NDAstroData(ext.data, mask=mask)
+                    else:
+                        nddata = NDAstroData(ext.data[statsec], mask=None
+                                             if mask is None else mask[statsec])
+                    levels[id(ad)].append(gt.measure_bg_from_image(
+                        nddata, value_only=True))
+            return levels[id(ad)]
+
+        def stack(adinputs):
+            num_img = len(adinputs)
+            if (num_img < 2 or num_img > capacity or
+                    any(id(ad) not in sky_ids for ad in adinputs) or
+                    (reject_method == "minmax" and
+                     params["nlow"] + params["nhigh"] >= num_img)):
+                return restack(adinputs)
+
+            if scale or zero:
+                sky_level = np.array([sky_levels(ad) for ad in adinputs],
+                                     dtype=np.float32)
+                if not separate_ext:
+                    sky_level[:] = sky_level.mean(axis=1, keepdims=True)
+                # stackFrames() decides what to do with these
+                if not (np.isfinite(sky_level).all() and
+                        (zero or (sky_level > 0).all())):
+                    return restack(adinputs)
+
+            log.stdinfo("Combining {} sky frames ({} new)".format(
+                num_img, sum(id(ad) not in stackers[0] for ad in adinputs)))
+            ad_out = astrodata.create(adinputs[0].phu)
+            for index, stacker in enumerate(stackers):
+                frames = {}
+                for i, ad in enumerate(adinputs):
+                    if id(ad) not in stacker:
+                        ext = ad[index]
+                        frames[id(ad)] = (
+                            ext.data, sky_mask(ext) if apply_dq else None,
+                            ext.variance,
+                            1 / sky_level[i, index] if scale else 1.,
+                            -sky_level[i, index] if zero else 0.)
+                    else:
+                        frames[id(ad)] = None
+                stacker.update(frames)
+                if scale:
+                    result = stacker.result(scale=sky_level[0, index])
+                elif zero:
+                    result = stacker.result(zero=sky_level[0, index])
+                else:
+                    result = stacker.result()
+                ad_out.append(result, header=adinputs[0][index].hdr.copy())
+
+            gain_list, read_noise_list = self._stack_gain_read_noise(adinputs)
+            self._update_stack_headers(ad_out, adinputs, gain_list,
+                                       read_noise_list, params["suffix"])
+            gt.mark_history(ad_out, primname="stackFrames",
+                            keyword=self.timestamp_keys["stackFrames"])
+            ad_out.update_filename(suffix=params["suffix"], strip=True)
+            return [ad_out]
+
+        return stack
+
+    def _stack_gain_read_noise(self, adinputs):
+        """
+        Returns the gains (the mean of the inputs) and read noises (the
+        inputs added in quadrature) of the extensions of a stack.
+        """
+        gains = [ad.gain() for ad in adinputs]
+        read_noises = [ad.read_noise() for ad in adinputs]
+
+        assert all(gain is not None for gain in gains), "Gain problem"
+        assert all(rn is not None for rn in read_noises), "RN problem"
+
+        # Compute gain and read noise of final stacked images
+        nexts = len(gains[0])
+        gain_list = [np.mean([gain[i] for gain in gains])
+                     for i in range(nexts)]
+        read_noise_list = [np.sqrt(np.sum([rn[i]*rn[i] for rn in read_noises]))
+                           for i in range(nexts)]
+        return gain_list, read_noise_list
+
+    def _update_stack_headers(self, ad_out, adinputs, gain_list,
+                              read_noise_list, sfx):
+        """
+        Sets the REFCAT and the header keywords of a stack from those of
+        the inputs.
+        """
+        # Propagate REFCAT as the union of all input REFCATs
+        refcats = [ad.REFCAT for ad in adinputs if hasattr(ad, 'REFCAT')]
+        if refcats:
+            out_refcat = table.unique(table.vstack(refcats, metadata_conflicts='silent'),
+                                      keys='Cat_Id')
+            out_refcat['Id'] = list(range(1, len(out_refcat)+1))
+            ad_out.REFCAT = out_refcat
+
+        # Set AIRMASS to be the mean of the input values
+        try:
+            airmass_kw = ad_out._keyword_for('airmass')
+            mean_airmass = np.mean([ad.airmass() for ad in adinputs])
+        except Exception:  # generic implementation failure (probably non-Gemini)
+            pass
+        else:
+            ad_out.phu.set(airmass_kw, mean_airmass, "Mean airmass for the exposure")
+
+        # Set GAIN to the average of input gains. Set the RDNOISE to the
+        # sum in quadrature of the input read noises.
+        for ext, gain, rn in zip(ad_out, gain_list, read_noise_list):
+            ext.hdr.set('GAIN', gain, self.keyword_comments['GAIN'])
+            ext.hdr.set('RDNOISE', rn, self.keyword_comments['RDNOISE'])
+        # Stick the first extension's values in the PHU
+        ad_out.phu.set('GAIN', gain_list[0], self.keyword_comments['GAIN'])
+        ad_out.phu.set('RDNOISE', read_noise_list[0], self.keyword_comments['RDNOISE'])
+
+        # Add suffix to datalabel to distinguish from the reference frame
+        ad_out.phu.set('DATALAB', "{}{}".format(ad_out.data_label(), sfx),
+                       self.keyword_comments['DATALAB'])
+
+        # Add other keywords to the PHU about the stacking inputs
+        ad_out.orig_filename = ad_out.phu.get('ORIGNAME')
+        ad_out.phu.set('NCOMBINE', len(adinputs), self.keyword_comments['NCOMBINE'])
+        for i, ad in enumerate(adinputs, start=1):
+            ad_out.phu.set('IMCMB{:03d}'.format(i), ad.phu.get('ORIGNAME', ad.filename))
@@ -13,6 +13,7 @@ from scipy.ndimage import measurements
 from astrodata.provenance import add_provenance
 from gempy.gemini import gemini_tools as gt
 from gempy.gemini import irafcompat
+from gempy.library import maskstore
 from geminidr.gemini.lookups import DQ_definitions as DQ
 from geminidr import PrimitivesBASE
 from recipe_system.utils.md5 import md5sum
@@ -60,12 +61,14 @@ class Standardize(PrimitivesBASE):
         sfx = params["suffix"]
 
         # Getting all the filenames first prevents reopening the same file
-        # for each science AD
+        # for each science AD, and the default BPMs come from the mask store
+        # so they're only read once per process
         static_bpm_list = params['static_bpm']
         user_bpm_list = params['user_bpm']
 
         if static_bpm_list == "default":
-            static_bpm_list = [self._get_bpm_filename(ad) for ad in adinputs]
+            static_bpm_list = [self._read_mask(self._get_bpm_filename(ad))
+                               for ad in adinputs]
 
         for ad, static, user in zip(*gt.make_lists(adinputs, static_bpm_list,
                                                    user_bpm_list, force_ad=True)):
@@ -110,8 +113,8 @@ class Standardize(PrimitivesBASE):
                     log.fullinfo('Flagging saturated pixels in {}:{} '
                                  'above level {:.2f}'.
                                  format(ad.filename, extver, saturation_level))
-                    ext.mask |= np.where(ext.data >= saturation_level,
-                                         DQ.saturated, 0).astype(DQ.datatype)
+                    np.bitwise_or(ext.mask, DQ.saturated, out=ext.mask,
+                                  where=ext.data >= saturation_level)
 
                 if non_linear_level:
                     if saturation_level:
@@ -120,9 +123,9 @@ class Standardize(PrimitivesBASE):
                                          'above level {:.2f}'.
                                          format(ad.filename, extver,
                                                 non_linear_level))
-                            ext.mask |= np.where((ext.data >= non_linear_level) &
-                                                 (ext.data < saturation_level),
-                                                 DQ.non_linear, 0).astype(DQ.datatype)
+                            np.bitwise_or(ext.mask, DQ.non_linear, out=ext.mask,
+                                          where=((ext.data >= non_linear_level) &
+                                                 (ext.data < saturation_level)))
                             # Readout modes of IR detectors can result in
                             # saturated pixels having values below the
                             # saturation level. Flag those. Assume we have an
@@ -161,8 +164,8 @@ class Standardize(PrimitivesBASE):
                                      'above level {:.2f}'.
                                      format(ad.filename, extver,
                                             non_linear_level))
-                        ext.mask |= np.where(ext.data >= non_linear_level,
-                                             DQ.non_linear, 0).astype(DQ.datatype)
+                        np.bitwise_or(ext.mask, DQ.non_linear, out=ext.mask,
+                                      where=ext.data >= non_linear_level)
 
 
         # Handle latency if reqested
@@ -200,10 +203,11 @@ class Standardize(PrimitivesBASE):
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
         timestamp_key = self.timestamp_keys[self.myself()]
 
-        # Getting all the filenames first prevents reopening the same file
-        # for each science AD
+        # Getting all the masks first prevents reopening the same file
+        # for each science AD (and they're only read once per process)
         if illum_mask is None:
-            illum_mask = [self._get_illum_mask_filename(ad) for ad in adinputs]
+            illum_mask = [self._read_mask(self._get_illum_mask_filename(ad))
+                          for ad in adinputs]
 
         for ad, illum in zip(*gt.make_lists(adinputs, illum_mask, force_ad=True)):
             if ad.phu.get(timestamp_key):
@@ -223,9 +227,12 @@ class Standardize(PrimitivesBASE):
             for ext, illum_ext in zip(ad, final_illum):
                 if illum_ext is not None:
                     # Ensure we're only adding the unilluminated bit
-                    iext = np.where(illum_ext.data > 0, DQ.unilluminated,
-                                    0).astype(DQ.datatype)
-                    ext.mask = iext if ext.mask is None else ext.mask | iext
+                    if ext.mask is None:
+                        ext.mask = np.where(illum_ext.data > 0, DQ.unilluminated,
+                                            0).astype(DQ.datatype)
+                    else:
+                        np.bitwise_or(ext.mask, DQ.unilluminated, out=ext.mask,
+                                      where=illum_ext.data > 0)
 
             # Timestamp and update filename
             gt.mark_history(ad, primname=self.myself(), keyword=timestamp_key)
@@ -544,6 +551,23 @@ class Standardize(PrimitivesBASE):
                 os.path.join(bpm_dir, bpm)
         return None
 
+    def _read_mask(self, filename):
+        """
+        Reads a static mask (BPM or illumination mask) from the process-wide
+        mask store.
+
+        Returns
+        -------
+        AstroData/None: the (shared) mask, or None if there's no file or it
+                        can't be opened
+        """
+        if filename is None:
+            return None
+        try:
+            return maskstore.read_mask(filename)
+        except Exception:
+            self.log.warning("Cannot open file {}".format(filename))
+
     def _get_illum_mask_filename(self, ad):
         """
         Gets the illumMask filename for an input science frame, using
@@ -288,6 +288,45 @@ def test_QESpline_optimization():
     np.testing.assert_allclose(real_coeffs, 1. / result.x, atol=0.01)
 
 
+def test_fit_arc_lines_in_worker_matches_serial():
+    """
+    The wavelength solution for an extension must not depend on whether it
+    was determined in a separate process, or on the other extensions.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    np.random.seed(0)
+    arc_lines = np.sort(np.random.uniform(480, 720, size=80))
+    model = models.Chebyshev1D(degree=2, c0=600, c1=100, c2=1,
+                               domain=[0, 2047])
+    x = np.arange(2048)
+    wavelengths = model(x)
+
+    fit_kwargs = []
+    for seed, shift in enumerate([0, 1.5, -2]):
+        peaks = np.interp(arc_lines, wavelengths, x) + shift
+        data = sum(np.random.uniform(50, 200) *
+                   np.exp(-0.5 * ((x - peak) / 2) ** 2) for peak in peaks)
+        data = (data + np.random.normal(size=x.size)).astype(np.float32)
+        fit_kwargs.append({'data': data, 'mask': None,
+                           'variance': np.ones_like(data),
+                           'arc_lines': arc_lines, 'arc_weights': None,
+                           'cenwave': 601., 'dw': 0.1, 'fwidth': 4.7,
+                           'order': 3, 'seed': seed})
+
+    serial = [primitives_spect._fit_arc_lines(**kwargs)
+              for kwargs in fit_kwargs[::-1]][::-1]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        parallel = list(executor.map(primitives_spect._fit_arc_lines_in_worker,
+                                     fit_kwargs))
+
+    for fit_table, (worker_table, log_records) in zip(serial, parallel):
+        assert fit_table.colnames == worker_table.colnames
+        for col in fit_table.colnames:
+            np.testing.assert_array_equal(fit_table[col], worker_table[col])
+        assert log_records[-1][1].startswith("Matched")
+
+
 @pytest.mark.xfail(reason="The fake data needs a DQ plane")
 def test_find_apertures():
     _p = primitives_spect.Spect([])
@@ -76,3 +76,10 @@ def test_stackframes_refcat_propagation(adinputs):
     assert len(adout.REFCAT) == 3
     np.testing.assert_equal(adout.REFCAT['Id'], np.arange(1, 4))
     assert all(adout.REFCAT['Cat_Id'] == ['a', 'b', 'c'])
+
+
+def test_sky_stacker_without_skies(adinputs):
+    p = NIRIImage(adinputs)
+    params = dict(p.params["stackSkyFrames"].items())
+    stack_skies = p._sky_stacker([], capacity=0, **params)
+    assert stack_skies.func == p.stackSkyFrames
@@ -5,6 +5,8 @@ from gempy.library import config
 class measureBGConfig(config.Config):
     suffix = config.Field("Filename suffix", str, "_bgMeasured", optional=True)
     separate_ext = config.Field("Supply measurement for each extension?", bool, False)
+    tile_size = config.RangeField("Size of tiles for background statistics (pixels)",
+                                  int, None, min=16, optional=True)
 
 class measureCCConfig(config.Config):
     suffix = config.Field("Filename suffix", str, "_ccMeasured", optional=True)
@@ -58,6 +58,9 @@ class QA(PrimitivesBASE):
             remove the bias level (if present) before measuring background?
         separate_ext: bool
             report one value per extension, instead of a global value?
+        tile_size: int/None
+            measure the background as the median of the values in tiles of
+            this size (None => measure all the pixels together)
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -66,6 +69,7 @@ class QA(PrimitivesBASE):
         suffix = params["suffix"]
         remove_bias = params.get("remove_bias", False)
         separate_ext = params["separate_ext"]
+        tile_size = params.get("tile_size")
 
         for ad in adinputs:
             bias_level = None
@@ -98,7 +102,8 @@ class QA(PrimitivesBASE):
             exptime = ad.exposure_time()
 
             # Get background level from all extensions quick'n'dirty
-            bg_list = gt.measure_bg_from_image(ad, sampling=100, gaussfit=False)
+            bg_list = gt.measure_bg_from_image(ad, sampling=100, gaussfit=False,
+                                               tile_size=tile_size)
 
             info_list = []
             bg_mag_list = []
@@ -21,7 +21,7 @@ from geminidr.gemini.lookups import DQ_definitions as DQ
 from geminidr.gmos.lookups import geometry_conf as geotable
 
 from gempy.gemini import gemini_tools as gt
-from gempy.library import astromodels, transform
+from gempy.library import astromodels, filecache, transform
 
 from recipe_system.utils.decorators import parameter_override
 
@@ -417,4 +417,6 @@ class GMOSSpect(Spect, GMOS):
         filename = os.path.join(lookup_dir,
                                 'CuAr_GMOS{}.dat'.format('_mixord' if use_second_order else ''))
 
-        return np.loadtxt(filename, usecols=[0]), None
+        # The GMOS lists are in Angstroms, so w1 and w2 (nm) can't be used to
+        # trim them; determineWavelengthSolution() converts the units later
+        return filecache.read_linelist(filename).subset()[0], None
@@ -87,7 +87,7 @@ class GNIRSImage(GNIRS, Image, Photometry):
 
             # binary_OR the illumination mask or create a DQ plane from it.
             if ad[0].mask is None:
-                ad[0].mask = final_illum[0].data
+                ad[0].mask = final_illum[0].data.copy()
             else:
                 ad[0].mask |= final_illum[0].data
 
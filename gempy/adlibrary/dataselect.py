@@ -134,7 +134,7 @@ def select_data(inputs, tags=[], xtags=[], expression='True'):
     """
     selected_data = []
     for input in inputs:
-        ad = astrodata.open(input)
+        ad = astrodata.open(input, headers_only=True)
         adtags = ad.tags
         if set(tags).issubset(adtags) and \
                not len(set(xtags).intersection(adtags)) and \
@@ -143,6 +143,49 @@ def select_data(inputs, tags=[], xtags=[], expression='True'):
 
     return selected_data
 
+
+def select_data_from_index(inputs, tags=[], xtags=[], expression=None,
+                           strict=False, index=None):
+    """
+    Same as `select_data` but using a persistent index of tags and
+    descriptor values (see `gempy.adlibrary.fileindex`), which is first
+    brought up to date for the inputs. Expressions that cannot be
+    translated to SQL are evaluated on the files, as in `select_data`.
+
+    Parameters
+    ----------
+    inputs - list of strings
+        list of paths with full directory to a fits file
+    tags - list of strings
+        list with all the tags you want to make sure are in the inputs fits files
+    xtags - list of strings
+        list with all the tags you DO NOT want in the astrodata objects
+    expression - string or None
+        expression as given by the user, ie. NOT processed by expr_parser
+    strict - Bool
+        Defines if the expression is evaluated in "strict" mode
+    index - str or fileindex.FileIndex
+        The index, or the path to its database. Default is
+        fileindex.DEFAULT_INDEX
+
+    Returns
+    list of strings
+        the inputs that satisfy all the above requirements
+    -------
+    """
+    from . import fileindex
+
+    if index is None or isinstance(index, str):
+        index = fileindex.FileIndex(index or fileindex.DEFAULT_INDEX)
+    index.update(inputs)
+    try:
+        return index.select(inputs, tags, xtags, expression, strict=strict)
+    except fileindex.UntranslatableExpression:
+        candidates = index.select(inputs, tags, xtags)
+        return select_data(candidates, expression=expr_parser(expression,
+                                                              strict))
+
+
 def writeheader(fh, tags, xtags, expression):
     """
     Given a list of fits files, function will return a list of astrodata objects
@@ -0,0 +1,384 @@
+"""
+Persistent index of the tags and descriptor values of FITS files, to be
+used by dataselect. The index is an SQLite database; files are (re)indexed
+only when they are new or their size or modification time have changed.
+
+Selection expressions (the same accepted by dataselect) are translated to
+SQL, so that selecting files from the index doesn't require opening them.
+"""
+import ast
+import datetime
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+import astrodata
+import gemini_instruments
+
+DEFAULT_INDEX = '~/.geminidr/dataselect.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    datalab TEXT
+);
+CREATE INDEX IF NOT EXISTS files_datalab ON files (datalab);
+CREATE TABLE IF NOT EXISTS tags (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_file ON tags (file_id, tag);
+CREATE TABLE IF NOT EXISTS descriptors (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS descriptors_file ON descriptors (file_id, name);
+CREATE INDEX IF NOT EXISTS descriptors_value ON descriptors (name, value);
+"""
+
+# Descriptors that are also stored evaluated with extra arguments, under
+# a different name, to honour the "non strict" matching of dataselect
+EXTRA_DESCRIPTORS = {
+    'filter_name:pretty': ('filter_name', {'pretty': True}),
+}
+
+# Descriptors compared with dataselect.isclose when using '==' (non strict),
+# and their relative tolerance
+CLOSE_DESCRIPTORS = {
+    'exposure_time': 1e-2,
+    'central_wavelength': 1e-5,
+}
+
+# Formats used by dataselect to parse date/time literals
+DATETIME_FORMATS = {
+    'ut_date': ('%Y-%m-%d', 'date'),
+    'ut_time': ('%H:%M:%S', 'time'),
+    'local_time': ('%H:%M:%S', 'time'),
+    'ut_datetime': ('%Y-%m-%d %H:%M:%S', None),
+}
+
+SQL_OPERATORS = {
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+    ast.Eq: 'IS',
+    ast.NotEq: 'IS NOT',
+}
+
+
+class UntranslatableExpression(ValueError):
+    pass
+
+
+def _to_sql_value(value):
+    """Converts a descriptor value into something that SQLite can store"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, (datetime.date, datetime.time)):
+        # datetime is a subclass of date. ISO formatted strings sort in
+        # the same order as the objects they represent
+        return str(value)
+    return json.dumps(value, default=str)
+
+
+def _literal(descriptor, value):
+    """
+    Converts a literal from an expression into the value to be compared
+    with the stored `descriptor`, using the same rules as dataselect.
+    """
+    if descriptor in DATETIME_FORMATS and isinstance(value, str):
+        fmt, method = DATETIME_FORMATS[descriptor]
+        try:
+            parsed = datetime.datetime.strptime(value, fmt)
+        except ValueError as err:
+            raise UntranslatableExpression(str(err))
+        return _to_sql_value(getattr(parsed, method)() if method else parsed)
+    return _to_sql_value(value)
+
+
+class _SQLTranslator:
+    """
+    Translates a dataselect expression (eg. ``'exposure_time==30 and
+    observation_class!="acq"'``) into an SQL condition on the
+    ``files`` table. Raises UntranslatableExpression for anything that
+    is not a combination of comparisons between descriptors and literals.
+    """
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.params = []
+
+    def translate(self, expression):
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as err:
+            raise UntranslatableExpression(str(err))
+        return self.visit(tree.body)
+
+    def visit(self, node):
+        if isinstance(node, ast.BoolOp):
+            op = ' AND ' if isinstance(node.op, ast.And) else ' OR '
+            return '(' + op.join(self.visit(v) for v in node.values) + ')'
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return '(NOT {})'.format(self.visit(node.operand))
+        elif isinstance(node, ast.Compare):
+            left = node.left
+            clauses = []
+            for op, right in zip(node.ops, node.comparators):
+                clauses.append(self.comparison(left, op, right))
+                left = right
+            return '(' + ' AND '.join(clauses) + ')'
+        elif isinstance(node, ast.Constant) and isinstance(node.value, bool):
+            return '1' if node.value else '0'
+        raise UntranslatableExpression("Unsupported expression: {}"
+                                       .format(ast.dump(node)))
+
+    def comparison(self, left, op, right):
+        if isinstance(right, ast.Name) and isinstance(left, ast.Constant):
+            # Literal on the left: swap the operands (and the operator)
+            swapped = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt,
+                       ast.GtE: ast.LtE}
+            left, right = right, left
+            op = swapped.get(type(op), type(op))()
+        if not (isinstance(left, ast.Name) and isinstance(right, ast.Constant)):
+            raise UntranslatableExpression("Can only compare descriptors "
+                                           "with literals")
+        try:
+            sql_op = SQL_OPERATORS[type(op)]
+        except KeyError:
+            raise UntranslatableExpression("Unsupported operator {}"
+                                           .format(type(op).__name__))
+
+        descriptor = left.id
+        value = _literal(descriptor, right.value)
+        if descriptor == 'filter_name' and not self.strict:
+            descriptor = 'filter_name:pretty'
+
+        cond = 'd.value {} ?'.format(sql_op)
+        params = [value]
+        if (descriptor in CLOSE_DESCRIPTORS and sql_op == 'IS'
+                and not self.strict and isinstance(value, (int, float))):
+            # Same as dataselect.isclose(d.value, value, rel_tol)
+            cond = 'abs(d.value - ?) <= ? * max(abs(d.value), abs(?))'
+            params = [value, CLOSE_DESCRIPTORS[descriptor], value]
+
+        self.params.extend([descriptor] + params)
+        return ('EXISTS (SELECT 1 FROM descriptors d WHERE d.file_id = f.id '
+                'AND d.name = ? AND {})'.format(cond))
+
+
+def expr_to_sql(expression, strict=False):
+    """
+    Translates a dataselect expression into an SQL condition.
+
+    Parameters
+    ----------
+    expression : str
+        Expression using descriptor names, as typed by the user (ie. not
+        processed by `dataselect.expr_parser`)
+    strict : bool
+        Same meaning as for `dataselect.expr_parser`
+
+    Returns
+    -------
+    tuple
+        The SQL condition (referring to the ``files`` table as ``f``) and
+        the list of parameters for its placeholders
+
+    Raises
+    ------
+    UntranslatableExpression
+        If the expression uses constructs other than comparisons between
+        descriptors and literals, combined with and/or/not.
+    """
+    translator = _SQLTranslator(strict=strict)
+    condition = translator.translate(expression)
+    return condition, translator.params
+
+
+class FileIndex:
+    """
+    FileIndex(filename=DEFAULT_INDEX)
+
+    Persistent index of the tags and descriptor values of a collection of
+    FITS files.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the SQLite database. It will be created if needed.
+    """
+    def __init__(self, filename=DEFAULT_INDEX):
+        self.filename = os.path.expanduser(filename)
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(self.filename)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    @staticmethod
+    def _describe(path):
+        """
+        Returns the DATALAB, tags and descriptor values for a file, which is
+        opened reading only its headers.
+        """
+        ad = astrodata.open(path, headers_only=True)
+        descriptors = {}
+        names = [(name, name, {}) for name in ad.descriptors]
+        names.extend((key, name, kwargs) for (key, (name, kwargs))
+                     in EXTRA_DESCRIPTORS.items() if name in ad.descriptors)
+        for key, name, kwargs in names:
+            try:
+                value = getattr(ad, name)(**kwargs)
+            except Exception:
+                value = None
+            descriptors[key] = _to_sql_value(value)
+        return ad.phu.get('DATALAB'), ad.tags, descriptors
+
+    def update(self, paths):
+        """
+        Makes sure that the index is up to date for the files in `paths`.
+        Only files that are new, or whose size or modification time differ
+        from the recorded ones, are (re)read. Files that can't be opened as
+        AstroData objects are skipped.
+
+        Parameters
+        ----------
+        paths : iterable of str
+            Paths to the files
+
+        Returns
+        -------
+        int
+            Number of files that were (re)indexed
+        """
+        known = dict(((row[0], (row[1], row[2])) for row in
+                      self._conn.execute('SELECT path, mtime, size FROM files')))
+        indexed = 0
+        with self._conn:
+            for path in paths:
+                path = os.path.abspath(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if known.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+                try:
+                    datalab, tags, descriptors = self._describe(path)
+                except Exception:
+                    continue
+                self._conn.execute('DELETE FROM files WHERE path = ?', (path,))
+                file_id = self._conn.execute(
+                    'INSERT INTO files (path, mtime, size, datalab) '
+                    'VALUES (?, ?, ?, ?)',
+                    (path, stat.st_mtime, stat.st_size, datalab)).lastrowid
+                self._conn.executemany(
+                    'INSERT INTO tags (file_id, tag) VALUES (?, ?)',
+                    ((file_id, tag) for tag in sorted(tags)))
+                self._conn.executemany(
+                    'INSERT INTO descriptors (file_id, name, value) '
+                    'VALUES (?, ?, ?)',
+                    ((file_id, name, value) for (name, value)
+                     in descriptors.items()))
+                indexed += 1
+        return indexed
+
+    def prune(self):
+        """
+        Removes the entries for files that don't exist anymore.
+
+        Returns
+        -------
+        int
+            Number of entries removed
+        """
+        gone = [(path,) for (path,) in self._conn.execute('SELECT path FROM files')
+                if not os.path.exists(path)]
+        with self._conn:
+            self._conn.executemany('DELETE FROM files WHERE path = ?', gone)
+        return len(gone)
+
+    def select(self, paths, tags=(), xtags=(), expression=None, strict=False):
+        """
+        Returns the files from `paths` that have all of `tags`, none of
+        `xtags`, and satisfy the `expression`. The index must be up to date
+        for `paths` (see `update`); files not in the index are never
+        selected.
+
+        Parameters
+        ----------
+        paths : list of str
+            Paths to the candidate files
+        tags : iterable of str
+            Tags that must be present
+        xtags : iterable of str
+            Tags that must not be present
+        expression : str or None
+            A dataselect expression, as typed by the user
+        strict : bool
+            Same meaning as for `dataselect.expr_parser`
+
+        Returns
+        -------
+        list of str
+            The selected elements of `paths`, in the same order
+
+        Raises
+        ------
+        UntranslatableExpression
+            If the expression cannot be evaluated in SQL
+        """
+        tags, xtags = sorted(set(tags)), sorted(set(xtags))
+        conditions, params = [], []
+        if tags:
+            conditions.append(
+                '(SELECT COUNT(*) FROM tags t WHERE t.file_id = f.id AND '
+                't.tag IN ({})) = ?'.format(', '.join('?' * len(tags))))
+            params.extend(tags + [len(tags)])
+        if xtags:
+            conditions.append(
+                'NOT EXISTS (SELECT 1 FROM tags t WHERE t.file_id = f.id AND '
+                't.tag IN ({}))'.format(', '.join('?' * len(xtags))))
+            params.extend(xtags)
+        if expression and expression.strip() != 'True':
+            condition, expr_params = expr_to_sql(expression, strict=strict)
+            conditions.append(condition)
+            params.extend(expr_params)
+
+        abspaths = [os.path.abspath(path) for path in paths]
+        with self._conn:
+            self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS candidates '
+                               '(path TEXT PRIMARY KEY)')
+            self._conn.execute('DELETE FROM candidates')
+            self._conn.executemany('INSERT OR IGNORE INTO candidates VALUES (?)',
+                                   ((path,) for path in abspaths))
+            query = ('SELECT f.path FROM files f JOIN candidates c '
+                     'ON c.path = f.path')
+            if conditions:
+                query += ' WHERE ' + ' AND '.join(conditions)
+            selected = {row[0] for row in self._conn.execute(query, params)}
+
+        return [path for (path, abspath) in zip(paths, abspaths)
+                if abspath in selected]
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from gempy.adlibrary import dataselect, fileindex
+from gempy.utils import logutils
+
+logutils.config(file_name='dummy.log')
+
+
+@pytest.fixture
+def niri_files(tmpdir):
+    files = []
+    for i, (obstype, exptime) in enumerate([('DARK', 10.), ('DARK', 10.02),
+                                            ('OBJECT', 10.), ('OBJECT', 30.),
+                                            ('FLAT', 5.)]):
+        phu = fits.Header({'INSTRUME': 'NIRI', 'TELESCOP': 'Gemini-North',
+                           'OBSERVAT': 'Gemini-North', 'OBSTYPE': obstype,
+                           'OBSCLASS': 'science', 'OBJECT': 'Target',
+                           'EXPTIME': exptime, 'COADDS': 1,
+                           'DATE-OBS': '2019-0{}-01'.format(i + 1),
+                           'DATALAB': 'GN-2019A-Q-1-{}-001'.format(i)})
+        hdus = fits.HDUList([fits.PrimaryHDU(header=phu),
+                             fits.ImageHDU(np.zeros((4, 5), dtype=np.float32),
+                                           name='SCI')])
+        filename = str(tmpdir.join('N2019010{}S0001.fits'.format(i)))
+        hdus.writeto(filename)
+        files.append(filename)
+    return files
+
+
+@pytest.mark.parametrize('expression', [
+    'exposure_time==10',
+    'exposure_time!=10 and observation_class=="science"',
+    'not exposure_time>=10 or observation_type=="DARK"',
+    'ut_date<"2019-03-15"',
+])
+@pytest.mark.parametrize('strict', [False, True])
+def test_select_from_index_matches_select_data(niri_files, tmpdir,
+                                               expression, strict):
+    index = fileindex.FileIndex(str(tmpdir.join('index.db')))
+    expected = dataselect.select_data(
+        niri_files, expression=dataselect.expr_parser(expression, strict))
+    assert dataselect.select_data_from_index(
+        niri_files, expression=expression, strict=strict,
+        index=index) == expected
+
+
+def test_select_from_index_by_tags(niri_files, tmpdir):
+    index = fileindex.FileIndex(str(tmpdir.join('index.db')))
+    for tags, xtags in [(['DARK'], []), (['NIRI'], ['DARK']),
+                        (['NIRI', 'CAL'], []), ([], ['NIRI'])]:
+        expected = dataselect.select_data(niri_files, tags, xtags)
+        assert dataselect.select_data_from_index(
+            niri_files, tags, xtags, index=index) == expected
+
+
+def test_untranslatable_expression(niri_files, tmpdir):
+    index = fileindex.FileIndex(str(tmpdir.join('index.db')))
+    index.update(niri_files)
+    expression = 'exposure_time==15*2'
+    with pytest.raises(fileindex.UntranslatableExpression):
+        index.select(niri_files, expression=expression)
+    assert dataselect.select_data_from_index(
+        niri_files, expression=expression, index=index) == [niri_files[3]]
+
+
+def test_index_is_incremental(niri_files, tmpdir):
+    index = fileindex.FileIndex(str(tmpdir.join('index.db')))
+    assert index.update(niri_files) == len(niri_files)
+    assert index.update(niri_files) == 0
+    assert len(index) == len(niri_files)
+
+    with fits.open(niri_files[0], mode='update') as hdul:
+        hdul[0].header['OBSTYPE'] = 'OBJECT'
+    os.utime(niri_files[0], (0, 0))
+    assert index.update(niri_files) == 1
+    assert niri_files[0] not in index.select(niri_files, tags=['DARK'])
+
+    os.remove(niri_files[1])
+    assert index.prune() == 1
+    assert len(index) == len(niri_files) - 1
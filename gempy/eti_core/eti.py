@@ -1,6 +1,11 @@
+import itertools
+import threading
+from concurrent.futures import Future
 from multiprocessing import Process, Queue
 from subprocess import check_output, STDOUT, CalledProcessError
 
+from recipe_system.config import get_workers
+
 from ..utils import logutils
 
 
@@ -9,45 +14,122 @@ log = logutils.get_logger(__name__)
 
 def loop_process(in_queue, out_queue):
     """
-    Code to spawn a subprocess for running external tasks
+    Code to spawn a subprocess for running external tasks. Several of these
+    can read from the same queues, so commands sent as a (job_id, command)
+    tuple have their result returned as a (job_id, result) tuple.
 
     Parameters
     ----------
     in_queue : multiprocessing.Queue
-        (add docstring)
+        queue from which commands (lists of str) are read
     out_queue : multiprocessing.Queue
-        (add docstring)
+        queue to which the output (or CalledProcessError) is sent
     """
     while True:
-        cmd = in_queue.get()
+        job = in_queue.get()
+        job_id, cmd = job if isinstance(job, tuple) else (None, job)
         try:
             result = check_output(cmd, stderr=STDOUT)
         except CalledProcessError as e:
             result = e
-        out_queue.put(result)
+        out_queue.put(result if job_id is None else (job_id, result))
 
 
 class ETISubprocess:
     """
     A singleton class that creates an instance of __ETISubprocess, which
     any future instances of ETISubprocess will point to.
+
+    The instance is a pool of worker processes that run external tasks.
+    Commands sent with submit() are run concurrently, up to the number of
+    workers (by default, the number of workers for the reduction, see
+    recipe_system.config.get_workers()). Only one worker is started with
+    the pool; the rest are started by the first call to submit(), so
+    they're not created unless external tasks are run.
     """
     class __ETISubprocess:
-        def __init__(self):
+        def __init__(self, nworkers=None):
+            self.nworkers = max(1, get_workers() if nworkers is None
+                                else nworkers)
             self.inQueue = Queue()
             self.outQueue = Queue()
-            self.process = Process(target=loop_process,
-                                   args=(self.inQueue, self.outQueue))
-            self.process.start()
+            self.processes = []
+            self._start_workers(1)
+            self._jobs = {}
+            self._job_ids = itertools.count()
+            self._lock = threading.Lock()
+            self._collector = None
+
+        @property
+        def process(self):
+            return self.processes[0]
+
+        def _start_workers(self, nworkers):
+            """Start worker processes until there are `nworkers` of them"""
+            while len(self.processes) < nworkers:
+                process = Process(target=loop_process,
+                                  args=(self.inQueue, self.outQueue))
+                process.start()
+                self.processes.append(process)
+
+        def submit(self, cmd):
+            """
+            Send a command to the pool of workers.
+
+            Parameters
+            ----------
+            cmd : list of str
+                the command and its arguments
+
+            Returns
+            -------
+            concurrent.futures.Future : whose result is the output of the
+                command, or a CalledProcessError if it failed
+            """
+            future = Future()
+            with self._lock:
+                # Started on first use, so that it's not copied into the
+                # workers when they're forked, and the workers only exist
+                # if they're needed
+                if self._collector is None:
+                    self._start_workers(self.nworkers)
+                    self._collector = threading.Thread(target=self._collect,
+                                                       daemon=True)
+                    self._collector.start()
+                job_id = next(self._job_ids)
+                self._jobs[job_id] = future
+            self.inQueue.put((job_id, cmd))
+            return future
+
+        def _collect(self):
+            """Pass the results from the workers to the futures"""
+            while True:
+                item = self.outQueue.get()
+                if item is None:
+                    break
+                job_id, result = item
+                with self._lock:
+                    future = self._jobs.pop(job_id, None)
+                if future is not None:
+                    future.set_result(result)
 
         def terminate(self):
-            self.process.terminate()
+            for process in self.processes:
+                process.terminate()
+            with self._lock:
+                jobs, self._jobs = self._jobs, {}
+                collector = self._collector
+            for future in jobs.values():
+                future.set_exception(RuntimeError("ETI worker terminated"))
+            if collector is not None and collector.is_alive():
+                self.outQueue.put(None)
+                collector.join()
 
     instance = None
 
-    def __new__(cls):
+    def __new__(cls, nworkers=None):
         if not ETISubprocess.instance:
-            ETISubprocess.instance = ETISubprocess.__ETISubprocess()
+            ETISubprocess.instance = ETISubprocess.__ETISubprocess(nworkers)
         return ETISubprocess.instance
 
     def __getattr__(self, name):
@@ -90,6 +172,7 @@ class ExternalTaskInterface:
         self.file_objs = []
         self.inQueue = None
         self.outQueue = None
+        self.eti_subprocess = None
         try:
             self.inQueue = primitives_class.eti_subprocess.inQueue
             self.outQueue = primitives_class.eti_subprocess.outQueue
@@ -100,6 +183,8 @@ class ExternalTaskInterface:
             log.warning("ETI: One or both Queues is closed")
             self.inQueue = None
             self.outQueue = None
+        else:
+            self.eti_subprocess = primitives_class.eti_subprocess
 
     def run(self):
         log.debug("ExternalTaskInterface.run()")
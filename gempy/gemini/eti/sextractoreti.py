@@ -1,6 +1,5 @@
 import re
 import subprocess
-from astropy.io import fits
 from collections import deque
 
 from gempy.eti_core.eti import ExternalTaskInterface as ETI
@@ -98,12 +97,12 @@ class SExtractorETI(ETI):
                 for ext in ad:
                     ext.OBJCAT, objmask = objdata[i]
                     if self._getmask:
-                        ext.OBJMASK = fits.getdata(objmask, ext=0)
+                        ext.OBJMASK = objmask
                     i += 1
             except TypeError:
                 ad.OBJCAT, objmask = objdata[i]
                 if self._getmask:
-                    ad.OBJMASK = fits.getdata(objmask, ext=0)
+                    ad.OBJMASK = objmask
         self.clean()
         return self.inputs
 
@@ -124,7 +123,9 @@ class SExtractorETI(ETI):
             elif parameter != 'config':
                 cmd.extend(['-'+parameter, str(value)])
 
-        # Run SExtractor for each input file
+        # Run SExtractor for each input file (concurrently, if there's
+        # a pool of workers)
+        commands = []
         for file_obj in self.file_objs:
             files = ['-CATALOG_NAME', file_obj._catalog_file]
             if self._getmask:
@@ -137,7 +138,8 @@ class SExtractorETI(ETI):
             [files.extend([param, value.popleft()]) for param, value in
              list_params.items()]
             files.append(file_obj._sci_image)
-            self._execute(cmd+files)
+            commands.append(cmd+files)
+        self._execute_all(commands)
 
     def recover(self):
         for par in self.param_objs:
@@ -146,12 +148,24 @@ class SExtractorETI(ETI):
         return [fil.recover() for fil in self.file_objs]
 
     def _execute(self, command):
-        if self.inQueue is not None:
-            self.inQueue.put(command)
-            result = self.outQueue.get()
-            if isinstance(result, Exception):
-                raise result
-        else:
+        return self._execute_all([command])[0]
+
+    def _execute_all(self, commands):
+        """
+        Runs a list of commands, concurrently if the ETI has a pool of
+        workers, and returns their outputs in order.
+        """
+        if self.eti_subprocess is not None:
+            futures = [self.eti_subprocess.submit(command)
+                       for command in commands]
+            results = [future.result() for future in futures]
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            return results
+
+        results = []
+        for command in commands:
             pipe_out = subprocess.Popen(command,
                                         stdout=subprocess.PIPE,
                                         stderr=subprocess.PIPE,
@@ -161,4 +175,5 @@ class SExtractorETI(ETI):
                 errmsg = ("SExtractor returned an error:\n"
                           "{}{}".format(result, stderrdata))
                 raise Exception(errmsg)
-        return result
+            results.append(result)
+        return results
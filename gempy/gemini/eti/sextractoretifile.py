@@ -1,4 +1,7 @@
 import os
+import shutil
+import tempfile
+
 import numpy as np
 from astropy.io import fits
 from astropy.table import Table
@@ -18,6 +21,21 @@ PREFIX = "tmp"
 SUFFIX = ".fits"
 FLAGS_TO_MASK = None
 
+# Scratch files are written to a memory-backed filesystem if there is one
+SCRATCH_DIRS = ["/dev/shm"]
+
+
+def scratch_dir():
+    """
+    Returns the directory in which to write the scratch files, preferring
+    a tmpfs (so nothing goes to disk) to the usual temporary directory.
+    """
+    for dirname in SCRATCH_DIRS:
+        if os.path.isdir(dirname) and os.access(dirname, os.W_OK | os.X_OK):
+            return dirname
+    return tempfile.gettempdir()
+
+
 class SExtractorETIFile(ETIFile):
     """This class coordinates the ETI files as it pertains to Sextractor
     tasks in general.
@@ -40,12 +58,18 @@ class SExtractorETIFile(ETIFile):
                 self.data[(self.mask & mask_dq_bits)==0])
         self._disk_file = None
         self._catalog_file = None
+        self._objmask_file = None
+        self._scratch_dir = None
 
     def prepare(self):
-        # This looks silly, but we're pretending the array data is a "file"
-        self._catalog_file = PREFIX + self.name + '_cat' + SUFFIX
-        self._objmask_file = PREFIX + self.name + '_obj' + SUFFIX
-        filename = PREFIX + self.name + SUFFIX
+        # This looks silly, but we're pretending the array data is a "file".
+        # Each file gets its own directory, so there are no name clashes
+        # between extensions or frames that are being run concurrently
+        self._scratch_dir = tempfile.mkdtemp(prefix=PREFIX, dir=scratch_dir())
+        root = os.path.join(self._scratch_dir, os.path.basename(self.name))
+        self._catalog_file = root + '_cat' + SUFFIX
+        self._objmask_file = root + '_obj' + SUFFIX
+        filename = root + SUFFIX
         hdulist = fits.HDUList()
         hdulist.append(fits.ImageHDU(self.data,
                                      header=self.header, name='SCI'))
@@ -64,13 +88,13 @@ class SExtractorETIFile(ETIFile):
         self._disk_file = filename
 
     def recover(self):
+        # Read everything into memory so the scratch files can be deleted
         objcat = Table.read(self._catalog_file)
-        return (objcat, self._objmask_file)
+        objmask = (fits.getdata(self._objmask_file, ext=0, memmap=False)
+                   if os.path.isfile(self._objmask_file) else None)
+        return (objcat, objmask)
 
     def clean(self, remove_inputs=True):
-        if os.path.isfile(self._disk_file):
-            os.remove(self._disk_file)
-        if os.path.isfile(self._catalog_file):
-            os.remove(self._catalog_file)
-        if os.path.isfile(self._objmask_file):
-            os.remove(self._objmask_file)
+        if self._scratch_dir is not None:
+            shutil.rmtree(self._scratch_dir, ignore_errors=True)
+            self._scratch_dir = None
@@ -0,0 +1,64 @@
+import os
+from subprocess import CalledProcessError
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from gempy.eti_core.eti import ETISubprocess
+from gempy.gemini.eti import sextractoretifile
+from gempy.gemini.eti.sextractoreti import SExtractorETI
+
+
+@pytest.fixture
+def eti_subprocess():
+    # ETISubprocess is a singleton; an earlier test may have started one
+    if ETISubprocess.instance is not None:
+        ETISubprocess.instance.terminate()
+        ETISubprocess.instance = None
+    pool = ETISubprocess(nworkers=2)
+    yield pool
+    pool.terminate()
+    ETISubprocess.instance = None
+
+
+def test_commands_run_in_pool(eti_subprocess):
+    assert len(eti_subprocess.processes) == 1
+    task = SExtractorETI(primitives_class=SimpleNamespace(
+        eti_subprocess=eti_subprocess))
+    results = task._execute_all([['echo', str(i)] for i in range(6)])
+    assert len(eti_subprocess.processes) == eti_subprocess.nworkers
+    assert results == ['{}\n'.format(i).encode() for i in range(6)]
+
+    with pytest.raises(CalledProcessError):
+        task._execute_all([['echo'], ['false']])
+
+
+def test_scratch_files(tmpdir, monkeypatch):
+    monkeypatch.setattr(sextractoretifile, 'SCRATCH_DIRS',
+                        ['/nonexistent', str(tmpdir)])
+    data = np.arange(12, dtype=np.float32).reshape(3, 4)
+    mask = np.zeros_like(data, dtype=np.uint16)
+    mask[1, 1] = 1
+    ext = SimpleNamespace(filename='N20010101S0001.fits', data=data,
+                          mask=mask, hdr=fits.Header({'EXTVER': 1}))
+
+    file_obj = sextractoretifile.SExtractorETIFile(ext, mask_dq_bits=1)
+    file_obj.prepare()
+    assert os.path.dirname(file_obj._scratch_dir) == str(tmpdir)
+    assert file_obj._sci_image.startswith(file_obj._scratch_dir)
+    assert fits.getdata(file_obj._sci_image[:-3])[1, 1] == np.median(
+        data[mask == 0])
+
+    # Pretend SExtractor has run
+    fits.BinTableHDU.from_columns([fits.Column(
+        name='NUMBER', format='J', array=[1, 2])]).writeto(
+        file_obj._catalog_file)
+    fits.writeto(file_obj._objmask_file, np.ones_like(mask))
+    objcat, objmask = file_obj.recover()
+    assert objcat['NUMBER'].tolist() == [1, 2]
+    assert objmask.sum() == 12
+
+    file_obj.clean()
+    assert os.listdir(str(tmpdir)) == []
@@ -8,8 +8,12 @@ import os
 import re
 import numbers
 import itertools
+import threading
+import weakref
 import numpy as np
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from datetime import datetime
 from importlib import import_module
@@ -30,10 +34,23 @@ from ..library.nddops import NDStacker
 from ..utils import logutils
 
 import astrodata
+from recipe_system.config import get_workers
 
 from collections import namedtuple
 ArrayInfo = namedtuple("ArrayInfo", "detector_shape origins array_shapes "
                                     "extensions")
+BackgroundTiles = namedtuple("BackgroundTiles",
+                             "value std samples map std_map")
+
+# Results of measure_bg_tiles(), keyed on id(NDAstroData)
+_bg_tiles_cache = {}
+_bg_tiles_lock = threading.Lock()
+
+# Results of clip_auxiliary_data(), keyed on the auxiliary AD and the
+# geometry of the science AD, with a limit (in bytes) on their total size
+CLIP_CACHE_SIZE = 1 << 30
+_clip_cache = OrderedDict()
+_clip_cache_lock = threading.Lock()
 
 if minversion(astropy, '3.1'):
     sigma_clip = stats.sigma_clip
@@ -260,6 +277,14 @@ def check_inputs_match(adinput1=None, adinput2=None, check_filter=True,
     return
 
 
+# Descriptors that must be equal for instrument configurations to match
+INST_CONFIG_DESCRIPTORS = ['data_section', 'detector_roi_setting', 'read_mode',
+                           'well_depth_setting', 'gain_setting',
+                           'detector_x_bin', 'detector_y_bin', 'coadds',
+                           'camera', 'filter_name', 'focal_plane_mask',
+                           'lyot_stop', 'decker', 'pupil_mask', 'disperser']
+
+
 def matching_inst_config(ad1=None, ad2=None, check_exposure=False):
     """
     Compare two AstroData instances and report whether their instrument
@@ -297,12 +322,7 @@ def matching_inst_config(ad1=None, ad2=None, check_exposure=False):
                 break
 
     # Check all these descriptors for equality
-    things_to_check = ['data_section', 'detector_roi_setting', 'read_mode',
-                       'well_depth_setting', 'gain_setting', 'detector_x_bin',
-                       'detector_y_bin', 'coadds', 'camera', 'filter_name',
-                       'focal_plane_mask', 'lyot_stop', 'decker',
-                       'pupil_mask', 'disperser']
-    for descriptor in things_to_check:
+    for descriptor in INST_CONFIG_DESCRIPTORS:
         if getattr(ad1, descriptor)() != getattr(ad2, descriptor)():
             result = False
             log.debug('  Descriptor failure for {}'.format(descriptor))
@@ -330,6 +350,88 @@ def matching_inst_config(ad1=None, ad2=None, check_exposure=False):
 
     return result
 
+def matching_inst_config_matrix(adinputs1, adinputs2, check_exposure=False):
+    """
+    Compare every AstroData instance in one list with every one in another
+    and report whether their instrument configurations are identical, with
+    the same criteria as matching_inst_config(). The descriptors are only
+    evaluated once for each instance, and the comparisons are vectorized,
+    so this is much faster than calling matching_inst_config() for each
+    pair when the lists are long.
+
+    Parameters
+    ----------
+    adinputs1: list of AD
+    adinputs2: list of AD
+        single AstroData instances to compare
+    check_exposure: bool
+        if True, also check the exposure times
+
+    Returns
+    -------
+    ndarray of bool, shape (len(adinputs1), len(adinputs2))
+        element [i, j] is True if adinputs1[i] matches adinputs2[j]
+    """
+    summaries = {}
+    for ad in itertools.chain(adinputs1, adinputs2):
+        if id(ad) not in summaries:
+            summaries[id(ad)] = (
+                [len(ad), [ndd.shape for ndd in ad.nddata]] +
+                [getattr(ad, descriptor)()
+                 for descriptor in INST_CONFIG_DESCRIPTORS],
+                ad.central_wavelength(),
+                ad.exposure_time() if check_exposure else None)
+
+    # Assign codes to the values compared for equality, so that the
+    # comparisons can be done as arrays
+    def encode(values):
+        unique, codes = [], []
+        for value in values:
+            for i, other in enumerate(unique):
+                if value == other:
+                    codes.append(i)
+                    break
+            else:
+                codes.append(len(unique))
+                unique.append(value)
+        return np.array(codes)
+
+    def numbers_and_codes(values):
+        numeric = np.array([isinstance(v, numbers.Real) for v in values],
+                           dtype=bool)
+        floats = np.array([v if isinstance(v, numbers.Real) else np.nan
+                           for v in values], dtype=float)
+        return numeric, floats, encode(values)
+
+    n1 = len(adinputs1)
+    all_summaries = [summaries[id(ad)]
+                     for ad in itertools.chain(adinputs1, adinputs2)]
+    config_codes = encode([summary[0] for summary in all_summaries])
+    result = config_codes[:n1, np.newaxis] == config_codes[np.newaxis, n1:]
+
+    # The central wavelengths are compared with a tolerance if numeric
+    numeric, cwaves, codes = numbers_and_codes([summary[1]
+                                                for summary in all_summaries])
+    both_numeric = numeric[:n1, np.newaxis] & numeric[np.newaxis, n1:]
+    with np.errstate(invalid='ignore'):
+        result &= np.where(both_numeric,
+                           abs(cwaves[:n1, np.newaxis] -
+                               cwaves[np.newaxis, n1:]) < 0.001,
+                           codes[:n1, np.newaxis] == codes[np.newaxis, n1:])
+
+    if check_exposure:
+        numeric, exptimes, _ = numbers_and_codes([summary[2]
+                                                  for summary in all_summaries])
+        if not numeric.all():
+            log = logutils.get_logger(__name__)
+            log.error('Non-numeric type from exposure_time() descriptor')
+        with np.errstate(invalid='ignore'):
+            result &= ~(numeric[:n1, np.newaxis] & numeric[np.newaxis, n1:] &
+                        (abs(exptimes[:n1, np.newaxis] -
+                             exptimes[np.newaxis, n1:]) > 0.01))
+    return result
+
+
 @handle_single_adinput
 def clip_auxiliary_data(adinput=None, aux=None, aux_type=None,
                         return_dtype=None):
@@ -354,11 +456,29 @@ def clip_auxiliary_data(adinput=None, aux=None, aux_type=None,
     -------
     list/AD:
         auxiliary file(s), appropriately clipped
+
+    The clipped files are cached, so each auxiliary file is only clipped
+    once for all the science frames with the same geometry, which are
+    given the same AstroData object. Its arrays are read-only, so it must
+    be copied before it is modified.
     """
     log = logutils.get_logger(__name__)
     aux_output_list = []
 
     for ad, this_aux in zip(*make_lists(adinput, aux, force_ad=True)):
+        key = _clip_cache_key(ad, this_aux, aux_type, return_dtype)
+        with _clip_cache_lock:
+            cached = _clip_cache.get(key)
+            if cached is not None:
+                _clip_cache.move_to_end(key)
+        if cached is not None:
+            new_aux, clipped_this_ad, _ = cached
+            if clipped_this_ad:
+                log.stdinfo("Clipping {} to match science data.".
+                            format(os.path.basename(this_aux.filename)))
+            aux_output_list.append(new_aux)
+            continue
+
         clipped_this_ad = False
 
         # Make a new auxiliary file for appending to, starting with PHU
@@ -504,6 +624,7 @@ def clip_auxiliary_data(adinput=None, aux=None, aux_type=None,
                   "{} in {}[SCI,{}]".format(this_aux.filename, detsec,
                                        ad.filename, ext.hdr['EXTVER']))
 
+        _cache_clipped_aux(key, this_aux, new_aux, clipped_this_ad)
         if clipped_this_ad:
             log.stdinfo("Clipping {} to match science data.".
                         format(os.path.basename(this_aux.filename)))
@@ -511,6 +632,52 @@ def clip_auxiliary_data(adinput=None, aux=None, aux_type=None,
 
     return aux_output_list
 
+
+def _clip_cache_key(ad, aux, aux_type, return_dtype):
+    """
+    Key for the clipped version of an auxiliary AD that matches a science
+    AD. The auxiliary AD is identified by the versions of its pixel planes
+    (so arithmetic on it changes the key) and the science AD by its
+    sections, shapes, and binning.
+    """
+    aux_arrays = tuple(ext.nddata.version for ext in aux)
+    geometry = tuple(zip(ad.detector_section(), ad.data_section(),
+                         ad.array_section(),
+                         [ext.data.shape[-2:] for ext in ad]))
+    dtype = None if return_dtype is None else np.dtype(return_dtype).str
+    return (id(aux), aux_arrays, aux_type, dtype, geometry,
+            ad.detector_x_bin(), ad.detector_y_bin())
+
+
+def _cache_clipped_aux(key, aux, new_aux, clipped_this_ad):
+    """
+    Make the arrays of a clipped auxiliary AD read-only and add it to the
+    cache, evicting the least recently used entries if the cache is full.
+    The entries are removed when the original auxiliary AD is deleted, and
+    those for earlier versions of its pixel planes when it is modified.
+    """
+    nbytes = 0
+    for ext in new_aux:
+        for arr in (ext.data, ext.variance, ext.mask):
+            if arr is not None:
+                arr.flags.writeable = False
+                nbytes += arr.nbytes
+
+    with _clip_cache_lock:
+        for stale in [k for k in _clip_cache
+                      if k[0] == key[0] and k[1] != key[1]]:
+            del _clip_cache[stale]
+        if key not in _clip_cache:
+            try:
+                weakref.finalize(aux, _clip_cache.pop, key, None)
+            except TypeError:  # can't be weakly referenced, so don't cache
+                return
+        _clip_cache[key] = (new_aux, clipped_this_ad, nbytes)
+        total = sum(entry[2] for entry in _clip_cache.values())
+        while total > CLIP_CACHE_SIZE and len(_clip_cache) > 1:
+            total -= _clip_cache.popitem(last=False)[1][2]
+
+
 @handle_single_adinput
 def clip_auxiliary_data_GSAOI(adinput=None, aux=None, aux_type=None,
                         return_dtype=None):
@@ -1309,7 +1476,7 @@ def mark_history(adinput=None, keyword=None, primname=None, comment=None):
 
 
 def measure_bg_from_image(ad, sampling=10, value_only=False, gaussfit=True,
-                          separate_ext=True):
+                          separate_ext=True, tile_size=None):
     """
     Return background value, and its std deviation, as measured directly
     from pixels in the SCI image. DQ plane are used (if they exist)
@@ -1327,6 +1494,9 @@ def measure_bg_from_image(ad, sampling=10, value_only=False, gaussfit=True,
         if True, fit a Gaussian to the pixel values, instead of sigma-clipping?
     separate_ext: bool
         return information for each extension, rather than the whole AD?
+    tile_size: int/None
+        if not None, use measure_bg_tiles() with tiles of this size, instead
+        of measuring all the pixels together (gaussfit is then ignored)
 
     Returns
     -------
@@ -1342,6 +1512,23 @@ def measure_bg_from_image(ad, sampling=10, value_only=False, gaussfit=True,
         single = True
     input_list = [ad] if single or not separate_ext else [ext for ext in ad]
 
+    if tile_size is not None:
+        results = [measure_bg_tiles(ext, tile_size=tile_size, sampling=sampling)
+                   for ext in ([ad] if single else ad)]
+        if single or separate_ext:
+            output_list = [(r.value, r.std, r.samples) for r in results]
+        else:
+            # Combine the tiles of all the extensions
+            values = np.concatenate([r.map.ravel() for r in results])
+            stds = np.concatenate([r.std_map.ravel() for r in results])
+            good = ~np.isnan(values)
+            output_list = [(np.median(values[good]), np.median(stds[good]),
+                            sum(r.samples for r in results)) if good.any()
+                           else (None, None, 0)]
+        if value_only:
+            output_list = [bg for bg, _, _ in output_list]
+        return output_list[0] if single or not separate_ext else output_list
+
     output_list = []
     for ext in input_list:
         # Use DQ and OBJMASK to flag pixels
@@ -1389,6 +1576,129 @@ def measure_bg_from_image(ad, sampling=10, value_only=False, gaussfit=True,
     return output_list[0] if single or not separate_ext else output_list
 
 
+def measure_bg_tiles(ext, tile_size=256, sampling=10, sigma=2., maxiters=2):
+    """
+    Measure the background of an image from sigma-clipped statistics of the
+    unflagged pixels (DQ and OBJMASK) in a regular grid of tiles. The
+    pixels are sampled 1-in-n, and the tiles are processed in parallel,
+    using partial sorts to find the medians. The global values are the
+    medians of the values of the tiles, so they are robust against large
+    objects and gradients.
+
+    Results are cached, keyed on the version of the pixel planes (see
+    `NDAstroData.version`) and the OBJMASK, so later calls on unmodified
+    data do not repeat the calculation. Changes made directly to the arrays
+    are not noticed.
+
+    Parameters
+    ----------
+    ext: single-slice AstroData/NDData
+        image to measure
+    tile_size: int
+        size of the (square) tiles, in pixels
+    sampling: int
+        1-in-n sampling factor
+    sigma: float
+        clipping threshold, in standard deviations
+    maxiters: int
+        maximum number of clipping iterations
+
+    Returns
+    -------
+    BackgroundTiles namedtuple
+        value: background level (None if there are no pixels)
+        std: standard deviation of the background (None if no pixels)
+        samples: number of pixels used (after clipping)
+        map: 2D array of the background level in each tile (NaN if the
+             tile has no good pixels)
+        std_map: 2D array of the standard deviation in each tile
+    """
+    nddata = getattr(ext, 'nddata', ext)
+    objmask = getattr(ext, 'OBJMASK', None)
+    version = (getattr(nddata, 'version', None), tile_size, sampling,
+               sigma, maxiters)
+    with _bg_tiles_lock:
+        cached = _bg_tiles_cache.get(id(nddata))
+    if (cached is not None and cached[0] == version and
+            _dereference(cached[1]) is objmask):
+        return cached[2]
+
+    data = ext.data
+    ny, nx = data.shape if data.ndim == 2 else (1, data.size)
+    nty, ntx = -(-ny // tile_size), -(-nx // tile_size)
+
+    values = np.asarray(data).reshape(-1)[::sampling].astype(np.float64)
+    flags = np.zeros(values.shape, dtype=bool)
+    for plane in (ext.mask, objmask):
+        if plane is not None:
+            flags |= np.asarray(plane).reshape(-1)[::sampling] != 0
+    good = ~flags if (~flags).any() else np.ones_like(flags)
+
+    indices = np.arange(0, ny * nx, sampling)[good]
+    tiles = (indices // nx // tile_size) * ntx + indices % nx // tile_size
+    counts = np.bincount(tiles, minlength=nty * ntx)
+    groups = np.split(values[good][np.argsort(tiles, kind='stable')],
+                      np.cumsum(counts)[:-1])
+
+    def stats(group):
+        return _clipped_stats(group, sigma=sigma, maxiters=maxiters)
+
+    nworkers = min(get_workers(), len(groups))
+    if nworkers > 1:
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            results = list(executor.map(stats, groups))
+    else:
+        results = [stats(group) for group in groups]
+
+    bg_map, std_map, nsamples = (np.array(x, dtype=float) for x in zip(*results))
+    bg_map, std_map = bg_map.reshape(nty, ntx), std_map.reshape(nty, ntx)
+    bg_map.flags.writeable = std_map.flags.writeable = False
+    ok = ~np.isnan(bg_map)
+    result = BackgroundTiles(np.median(bg_map[ok]) if ok.any() else None,
+                             np.median(std_map[ok]) if ok.any() else None,
+                             int(nsamples.sum()), bg_map, std_map)
+
+    if version[0] is None:  # not versioned, so don't cache
+        return result
+    objmask_ref = None if objmask is None else weakref.ref(objmask)
+    with _bg_tiles_lock:
+        if id(nddata) not in _bg_tiles_cache:
+            weakref.finalize(nddata, _bg_tiles_cache.pop, id(nddata), None)
+        _bg_tiles_cache[id(nddata)] = (version, objmask_ref, result)
+    return result
+
+
+def _dereference(ref):
+    """The object a weak reference (or None) refers to"""
+    return None if ref is None else ref()
+
+
+def _clipped_stats(values, sigma=2., maxiters=2):
+    """
+    Median, standard deviation, and number of the values after iterative
+    sigma-clipping about the median, with the medians found by partial
+    sorting. NaNs are returned for an empty array.
+    """
+    if values.size == 0:
+        return np.nan, np.nan, 0
+    for _ in range(maxiters):
+        median, std = _partition_median(values), values.std()
+        keep = abs(values - median) <= sigma * std
+        if keep.all():
+            break
+        values = values[keep]
+    return _partition_median(values), values.std(), values.size
+
+
+def _partition_median(values):
+    """Median of a (non-empty) 1D array, using np.partition"""
+    k = values.size // 2
+    if values.size % 2:
+        return np.partition(values, k)[k]
+    partitioned = np.partition(values, [k - 1, k])
+    return 0.5 * (partitioned[k - 1] + partitioned[k])
+
+
 def measure_bg_from_objcat(ad, min_ok=5, value_only=False, separate_ext=True):
     """
     Return a list of triples of background values, (and their std deviations
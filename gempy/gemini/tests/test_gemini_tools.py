@@ -1,7 +1,11 @@
+import numpy as np
+
 import astrodata
 import gemini_instruments
+from astrodata import NDAstroData
 from geminidr.gmos.primitives_gmos_image import GMOSImage
 from gempy.gemini import gemini_tools as gt
+from astropy.io import fits
 from astropy.table import Table
 import os
 
@@ -22,3 +26,101 @@ def test_fit_continuum_slit_image(path_to_inputs):
         assert isinstance(tbl, Table)
         assert len(tbl) == 1
         assert abs(tbl['fwhm_arcsec'].data[0] - fwhm) < 0.05
+
+
+def test_measure_bg_tiles():
+    rng = np.random.RandomState(0)
+    data = rng.normal(100., 5., size=(512, 700))
+    data[200:260, 300:360] += 1000.  # an object
+    mask = np.zeros(data.shape, dtype=np.uint16)
+    mask[:, 10] = 1
+    data[:, 10] = 1e6  # a bad column
+    ndd = NDAstroData(data, mask=mask)
+
+    result = gt.measure_bg_tiles(ndd, tile_size=128, sampling=5)
+    assert result.map.shape == result.std_map.shape == (4, 6)
+    assert abs(result.value - 100) < 0.5
+    assert 3.5 < result.std < 5  # 2-sigma clipping reduces the std
+    assert np.all(abs(result.map - 100) < 2)
+    assert gt.measure_bg_from_image(ndd, sampling=5, tile_size=128) == \
+        (result.value, result.std, result.samples)
+
+    # Same data => cached result; modified data => new result
+    assert gt.measure_bg_tiles(ndd, tile_size=128, sampling=5) is result
+    ndd.data += 10
+    result = gt.measure_bg_tiles(ndd, tile_size=128, sampling=5)
+    assert abs(result.value - 110) < 0.5
+
+    # A new OBJMASK => new result
+    ndd.OBJMASK = np.zeros(data.shape, dtype=np.uint8)
+    ndd.OBJMASK[200:260, 300:360] = 1
+    assert gt.measure_bg_tiles(ndd, tile_size=128, sampling=5) is not result
+
+
+def test_matching_inst_config_matrix():
+    class FakeAD:
+        nddata = [NDAstroData(np.zeros((2, 3)))]
+
+        def __init__(self, filter_name, central_wavelength, exposure_time):
+            self._values = {'filter_name': filter_name,
+                            'central_wavelength': central_wavelength,
+                            'exposure_time': exposure_time}
+
+        def __len__(self):
+            return 1
+
+        def __getattr__(self, descriptor):
+            return lambda: self._values.get(descriptor)
+
+    adinputs = [FakeAD('K', 2.2, 10.), FakeAD('K', 2.2005, 10.005),
+                FakeAD('K', 2.3, 10.), FakeAD('J', 2.2, 10.),
+                FakeAD('K', None, 30.), FakeAD('K', None, None)]
+    for check_exposure in (False, True):
+        expected = [[gt.matching_inst_config(ad1, ad2, check_exposure)
+                     for ad2 in adinputs[1:]] for ad1 in adinputs]
+        np.testing.assert_array_equal(
+            gt.matching_inst_config_matrix(adinputs, adinputs[1:],
+                                           check_exposure), expected)
+
+
+def test_clip_auxiliary_data_cache():
+    def make_ad(shape, detsecs, datasec, arraysec):
+        phu = fits.PrimaryHDU()
+        phu.header['OBSERVAT'] = 'GEMINI-NORTH'
+        ad = astrodata.create(phu)
+        for i, detsec in enumerate(detsecs):
+            hdr = fits.Header({'DETSEC': detsec, 'DATASEC': datasec,
+                               'ARRAYSEC': arraysec})
+            data = np.arange(np.prod(shape), dtype=np.float32).reshape(shape)
+            ad.append(fits.ImageHDU(data=data + 1000 * i, header=hdr))
+        ad.filename = 'test.fits'
+        return ad
+
+    bias = make_ad((200, 100), ['[1:100,1:200]', '[101:200,1:200]'],
+                   '[1:100,1:200]', '[1:100,1:200]')
+    adinputs = [make_ad((50, 100), ['[1:100,51:100]', '[101:200,51:100]'],
+                        '[1:100,1:50]', '[1:100,51:100]') for _ in range(3)]
+
+    clipped = [gt.clip_auxiliary_data(ad, aux=bias, aux_type='cal')
+               for ad in adinputs]
+    assert all(aux is clipped[0] for aux in clipped)
+    for ext, auxext in zip(bias, clipped[0]):
+        np.testing.assert_array_equal(auxext.data, ext.data[50:100])
+        assert not auxext.data.flags.writeable
+    assert clipped[0].detector_section() == adinputs[0].detector_section()
+
+    # Changing the bias changes the key
+    bias.multiply(2)
+    new_clipped = gt.clip_auxiliary_data(adinputs[0], aux=bias,
+                                         aux_type='cal')
+    assert new_clipped is not clipped[0]
+    np.testing.assert_array_equal(new_clipped[0].data, bias[0].data[50:100])
+    # and the clip of the old version is dropped
+    assert not any(entry[0] is clipped[0]
+                   for entry in gt._clip_cache.values())
+
+    # So does replacing a plane
+    bias[1].data = bias[1].data + 1
+    clipped = gt.clip_auxiliary_data(adinputs[0], aux=bias, aux_type='cal')
+    assert clipped is not new_clipped
+    np.testing.assert_array_equal(clipped[1].data, bias[1].data[50:100])
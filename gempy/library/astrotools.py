@@ -58,6 +58,235 @@ def boxcar(data, operation=np.median, size=1):
                              for i in range(len(data))])
     return boxarray
 
+def running_median(data, size=2):
+    """
+    Calculate the running median along the last axis of an array, using
+    a window of width 2*size+1 which is truncated at the ends of the array
+    (so the result is the same as boxcar(data, np.median, size) for a 1D
+    array). This is vectorized, so many 1D arrays can be processed at once.
+
+    Parameters
+    ----------
+    data: ndarray
+        the data, which will be filtered along the last axis
+    size: int
+        the window width will be 2*size+1
+
+    Returns
+    -------
+    ndarray: same shape as data, the running median
+    """
+    data = np.asarray(data)
+    length = data.shape[-1]
+    runmed = np.empty(data.shape, dtype=np.result_type(data, float))
+    if length > 2 * size:
+        windows = np.lib.stride_tricks.as_strided(
+            data, shape=data.shape[:-1] + (length - 2*size, 2*size+1),
+            strides=data.strides + data.strides[-1:], writeable=False)
+        runmed[..., size:length-size] = np.median(windows, axis=-1)
+    for i in list(range(min(size, length))) + list(range(max(length-size, size),
+                                                          length)):
+        runmed[..., i] = np.median(data[..., max(i-size, 0):i+size+1], axis=-1)
+    return runmed
+
+
+def median_fill(data, mask, footprint, max_iters=1, chunk_size=65536):
+    """
+    Replace the masked pixels of an array with the median of the pixels in
+    a footprint around each of them. This gives the same result as::
+
+        for i in range(max_iters):
+            if not mask.any():
+                break
+            data = np.where(mask, median_filter(data, footprint=footprint),
+                            data)
+            if i < max_iters - 1:
+                mask = median_filter(mask, footprint=footprint)
+
+    i.e., each iteration replaces all the pixels that are still masked, and
+    a pixel remains (or becomes) masked if more than half the pixels in its
+    footprint are masked. However, the medians are only computed for the
+    masked pixels, by gathering their neighbours, so the cost scales with
+    the number of masked pixels rather than the size of the array.
+
+    Parameters
+    ----------
+    data: ndarray
+        the data
+    mask: ndarray (bool)
+        pixels to be replaced
+    footprint: ndarray
+        footprint of the median filter (must be symmetric about its centre)
+    max_iters: int
+        maximum number of iterations
+    chunk_size: int
+        maximum number of pixels whose medians are computed at once
+
+    Returns
+    -------
+    ndarray: the data with masked pixels replaced (the input array itself
+             if no pixels are masked)
+    """
+    from scipy.ndimage import median_filter
+
+    data = np.asarray(data)
+    footprint = np.asarray(footprint)
+    offsets = (np.array(np.nonzero(footprint)) -
+               np.array(footprint.shape)[:, np.newaxis] // 2)
+    rank = offsets.shape[1] // 2
+    reach = np.array(footprint.shape)[:, np.newaxis] // 2
+    points = np.array(np.nonzero(mask))
+    result = data
+    for iteration in range(max_iters):
+        if points.shape[1] == 0:
+            break
+        old_data, result = result, result.copy()
+        for start in range(0, points.shape[1], chunk_size):
+            chunk = points[:, start:start+chunk_size]
+            values = old_data[tuple(_reflect(chunk[:, :, np.newaxis] +
+                                             offsets[:, np.newaxis], data.shape))]
+            medians = np.partition(values, rank, axis=1)[:, rank]
+            # NaNs can't be ordered, so let scipy deal with those pixels, on
+            # a cutout that gives it the same neighbourhood as the full array
+            if values.dtype.kind == 'f':
+                for i in np.nonzero(np.isnan(values).any(axis=1))[0]:
+                    point = chunk[:, i]
+                    lower = np.maximum(point - reach[:, 0], 0)
+                    cutout = old_data[tuple(slice(x1, x2) for x1, x2 in
+                                            zip(lower, point + reach[:, 0] + 1))]
+                    medians[i] = median_filter(cutout, footprint=footprint)[
+                        tuple(point - lower)]
+            result[tuple(chunk)] = medians
+        if iteration < max_iters - 1:
+            points = _masked_median(points, offsets, reach, data.shape,
+                                    offsets.shape[1] - rank)
+    return result
+
+
+def _reflect(indices, shape):
+    """
+    Map indices beyond the edges of an array back into it, in the same way
+    as the "reflect" mode of scipy.ndimage filters
+
+    Parameters
+    ----------
+    indices: ndarray
+        indices along each axis (first axis must match shape)
+    shape: tuple
+        shape of array
+    """
+    shape = np.reshape(shape, (-1,) + (1,) * (indices.ndim - 1))
+    indices = np.mod(indices, 2 * shape)
+    return np.where(indices >= shape, 2 * shape - 1 - indices, indices)
+
+
+def _masked_median(points, offsets, reach, shape, threshold):
+    """
+    Return the pixels that are masked after a median filter is applied to
+    a boolean mask, i.e., those where at least "threshold" pixels in the
+    footprint are masked. Only the neighbours of masked pixels can be.
+
+    Parameters
+    ----------
+    points: ndarray (ndim, npoints)
+        indices of the masked pixels
+    offsets: ndarray (ndim, nfootprint)
+        offsets of the pixels in the footprint from its centre
+    reach: ndarray (ndim, 1)
+        maximum offset along each axis
+    shape: tuple
+        shape of the mask
+    threshold: int
+        minimum number of masked pixels in the footprint
+
+    Returns
+    -------
+    ndarray (ndim, npoints): indices of the masked pixels
+    """
+    array_shape = np.array(shape)[:, np.newaxis]
+    candidates = (points[:, :, np.newaxis] - offsets[:, np.newaxis]).reshape(
+        len(shape), -1)
+    # Away from the edges, the number of masked pixels in the footprint of
+    # each neighbour is the number of times it appears in the candidates
+    interior = np.all((candidates >= reach) &
+                      (candidates < array_shape - reach), axis=0)
+    new_points, counts = np.unique(np.ravel_multi_index(
+        tuple(candidates[:, interior]), shape), return_counts=True)
+    new_points = new_points[counts >= threshold]
+
+    # Near the edges, the footprints are reflected, so the pixels in them
+    # have to be counted (masked pixels within twice the reach can matter)
+    near_edge = np.any((points < 2 * reach) |
+                       (points >= array_shape - 2 * reach), axis=0)
+    if near_edge.any():
+        edge_points = points[:, near_edge, np.newaxis]
+        candidates = _reflect(np.concatenate(
+            [edge_points - offsets[:, np.newaxis],
+             edge_points + offsets[:, np.newaxis]], axis=1), shape)
+        candidates = np.unique(np.ravel_multi_index(
+            tuple(candidates.reshape(len(shape), -1)), shape))
+        candidates = np.array(np.unravel_index(candidates, shape))
+        candidates = candidates[:, ~np.all((candidates >= reach) &
+                                           (candidates < array_shape - reach),
+                                           axis=0)]
+        masked = np.sort(np.ravel_multi_index(tuple(points), shape))
+        neighbours = np.ravel_multi_index(tuple(_reflect(
+            candidates[:, :, np.newaxis] + offsets[:, np.newaxis], shape)),
+            shape)
+        index = np.minimum(np.searchsorted(masked, neighbours), masked.size-1)
+        counts = (masked[index] == neighbours).sum(axis=1)
+        new_points = np.union1d(new_points, np.ravel_multi_index(
+            tuple(candidates[:, counts >= threshold]), shape))
+    return np.array(np.unravel_index(new_points, shape))
+
+
+def fit_chebyshev(x, y, degree, mask=None):
+    """
+    Fit Chebyshev polynomials to many datasets at once by linear least
+    squares. Each fit is the same as that of a Chebyshev1D model by the
+    astropy LinearLSQFitter, i.e., its domain is the range of the unmasked
+    x values, but all the fits are solved together as a stack of linear
+    least-squares problems.
+
+    Parameters
+    ----------
+    x: 1D ndarray
+        independent variable (the same for all the datasets)
+    y: ndarray
+        dependent variable, with the datasets along the leading axes and
+        the last axis the same length as x
+    degree: int
+        degree of the polynomials
+    mask: bool ndarray/None
+        same shape as y, with True for points to be ignored in the fits
+
+    Returns
+    -------
+    callable: takes a 1D array of x values and returns the values of all
+              the fitted polynomials there, in an array with the leading
+              axes of y
+    """
+    y = np.asarray(y, dtype=float)
+    good = np.ones(y.shape, dtype=bool) if mask is None else ~mask
+    xx = np.broadcast_to(x, y.shape)
+    xmin = np.where(good, xx, np.inf).min(axis=-1)[..., np.newaxis]
+    xmax = np.where(good, xx, -np.inf).max(axis=-1)[..., np.newaxis]
+
+    # Map the domain onto the window [-1, 1], as astropy does
+    def vander(xnew):
+        shift = (-xmax - xmin) / (xmax - xmin)
+        scale = 2 / (xmax - xmin)
+        return np.polynomial.chebyshev.chebvander(shift + scale * xnew, degree)
+
+    lhs = vander(x) * good[..., np.newaxis]
+    coeffs = np.linalg.pinv(lhs) @ np.where(good, y, 0)[..., np.newaxis]
+
+    def evaluate(xnew):
+        return (vander(np.asarray(xnew)) @ coeffs)[..., 0]
+
+    return evaluate
+
+
 def divide0(numerator, denominator):
     """
     Perform division, replacing division by zero with zero. This expands
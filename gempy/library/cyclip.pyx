@@ -23,7 +23,7 @@ cimport cython
 @cython.boundscheck(False)
 @cython.wraparound(False)
 cdef float median(float data[], unsigned short mask[], int has_mask,
-                  int data_size):
+                  int data_size) nogil:
     """
     One-dimensional true median, with optional masking.
 
@@ -94,7 +94,7 @@ cdef float median(float data[], unsigned short mask[], int has_mask,
 @cython.wraparound(False)
 @cython.cdivision(True)
 cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
-                long data_size, int return_median, double result[2]):
+                long data_size, int return_median, double result[2]) nogil:
     """
     Returns either the mean or median (and variance) of the unmasked pixels in
     an array.
@@ -129,7 +129,7 @@ cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
         sum = sumall
         sumsq = sumsqall
         nused = data_size
-    mean = sum / float(nused)
+    mean = sum / <double>nused
     if return_median:
         result[0] = <double>median(data, mask, has_mask, data_size)
     else:
@@ -137,7 +137,7 @@ cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
     result[1] = sumsq / nused - mean*mean
 
 
-cdef long num_good(unsigned short mask[], long data_size):
+cdef long num_good(unsigned short mask[], long data_size) nogil:
     """
     Returns the number of unmasked pixels in an array.
 
@@ -169,6 +169,8 @@ def iterclip(float [:] data, unsigned short [:] mask, float [:] variance,
              double hsigma, int max_iters, int mclip, int sigclip):
     """
     Iterative sigma-clipping. This is the function that interfaces with python.
+    The GIL is released while clipping, so several threads can clip
+    different sections of a stack at the same time.
 
     Parameters
     ----------
@@ -218,37 +220,38 @@ def iterclip(float [:] data, unsigned short [:] mask, float [:] variance,
     if max_iters == 0:
         max_iters = 100
 
-    for i in range(data_size):
-        iter = 0
-        return_median = 1
-        for n in range(num_img):
-            tmpdata[n] = data[n*data_size+i]
-            tmpmask[n] = mask[n*data_size+i]
-        ngood = num_good(tmpmask, num_img)
-        while iter < max_iters:
-            mask_stats(tmpdata, tmpmask, 1, num_img, return_median, result)
-            avg = result[0]
-            if has_var == 0 or sigclip:
-                std = sqrt(result[1])
-                low_limit = avg - lsigma * std
-                high_limit = avg + hsigma * std
-                for n in range(num_img):
-                    if tmpdata[n] < low_limit or tmpdata[n] > high_limit:
-                        tmpmask[n] |= 1
-            else:
-                for n in range(num_img):
-                    std = sqrt(variance[n*data_size+i])
-                    if tmpdata[n] < avg-lsigma*std or tmpdata[n] > avg+hsigma*std:
-                        tmpmask[n] |= 1
-
-            new_ngood = num_good(tmpmask, num_img)
-            if new_ngood == ngood:
-                break
-            if not mclip:
-                return_median = 0
-            ngood = new_ngood
-            iter += 1
-        for n in range(num_img):
-            mask[n*data_size+i] = tmpmask[n]
+    with nogil:
+        for i in range(data_size):
+            iter = 0
+            return_median = 1
+            for n in range(num_img):
+                tmpdata[n] = data[n*data_size+i]
+                tmpmask[n] = mask[n*data_size+i]
+            ngood = num_good(tmpmask, num_img)
+            while iter < max_iters:
+                mask_stats(tmpdata, tmpmask, 1, num_img, return_median, result)
+                avg = result[0]
+                if has_var == 0 or sigclip:
+                    std = sqrt(result[1])
+                    low_limit = avg - lsigma * std
+                    high_limit = avg + hsigma * std
+                    for n in range(num_img):
+                        if tmpdata[n] < low_limit or tmpdata[n] > high_limit:
+                            tmpmask[n] |= 1
+                else:
+                    for n in range(num_img):
+                        std = sqrt(variance[n*data_size+i])
+                        if tmpdata[n] < avg-lsigma*std or tmpdata[n] > avg+hsigma*std:
+                            tmpmask[n] |= 1
+
+                new_ngood = num_good(tmpmask, num_img)
+                if new_ngood == ngood:
+                    break
+                if not mclip:
+                    return_median = 0
+                ngood = new_ngood
+                iter += 1
+            for n in range(num_img):
+                mask[n*data_size+i] = tmpmask[n]
 
     return np.asarray(data), np.asarray(mask), np.asarray(variance)
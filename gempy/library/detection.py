@@ -0,0 +1,514 @@
+# Copyright(c) 2020 Association of Universities for Research in Astronomy, Inc.
+
+"""
+detection.py
+
+This module contains an in-process alternative to SExtractor, which finds
+sources in an image and measures them, producing a catalog with the columns
+(and, as far as is practical, the definitions) of the SExtractor catalogs
+used to make OBJCATs. Everything is done with vectorized operations on the
+whole image, so it is much faster than running SExtractor as an external
+task, but it is less sophisticated: there is no deblending, and the
+stellarity index is a simple measure of compactness rather than the output
+of a neural network.
+
+Functions in this module:
+estimate_background: make maps of the background level and its rms
+read_filter:         read a SExtractor convolution filter file
+detect_sources:      find and measure sources, returning a catalog and a
+                     segmentation image
+classify_sources:    calculate the stellarity index (CLASS_STAR)
+"""
+import numpy as np
+from astropy.table import Table
+from scipy import interpolate, ndimage
+
+# Half-sizes of the boxes used for the aperture photometry. Each source is
+# measured in the smallest that contains its aperture.
+APERTURE_BOXES = (4, 8, 16, 32, 64, 128)
+# Maximum number of pixels in the boxes of a batch of sources
+MAX_BATCH_PIXELS = 2 ** 22
+
+
+def estimate_background(data, back_size=32, back_filtersize=3, nsigma=3.,
+                        maxiters=5):
+    """
+    Estimates the background and its rms in the manner of SExtractor. The
+    image is divided into square meshes, the pixels in each mesh are
+    iteratively sigma-clipped about their median, and the background is
+    estimated as 2.5*median - 1.5*mean (or just the median in crowded
+    meshes). The mesh values are median-filtered and interpolated with a
+    bicubic spline to make full-size maps.
+
+    Parameters
+    ----------
+    data: ndarray
+        2D image (non-finite pixels are ignored)
+    back_size: int
+        size of the meshes (pixels)
+    back_filtersize: int
+        size of the median filter (meshes)
+    nsigma: float
+        clipping threshold (standard deviations)
+    maxiters: int
+        maximum number of clipping iterations
+
+    Returns
+    -------
+    ndarray: background level
+    ndarray: background rms
+    """
+    ny, nx = data.shape
+    nby, nbx = -(-ny // back_size), -(-nx // back_size)
+
+    # Pad the image with NaNs to a whole number of meshes, and sort the
+    # pixels in each mesh (the NaNs go to the end). The clipped pixels in
+    # each mesh are then a contiguous range of the sorted pixels, and the
+    # clipped statistics can be calculated from cumulative sums.
+    padded = np.full((nby * back_size, nbx * back_size), np.nan,
+                     dtype=np.result_type(data.dtype, np.float32))
+    padded[:ny, :nx] = data
+    padded[~np.isfinite(padded)] = np.nan
+    meshes = np.sort(padded.reshape(nby, back_size, nbx, back_size).
+                     swapaxes(1, 2).reshape(nby * nbx, -1), axis=1)
+    ngood = np.isfinite(meshes).sum(axis=1)
+    values = np.nan_to_num(meshes)
+    csum = np.concatenate([np.zeros((values.shape[0], 1)),
+                           np.cumsum(values, axis=1, dtype=float)], axis=1)
+    csum2 = np.concatenate([np.zeros((values.shape[0], 1)),
+                            np.cumsum(np.square(values, dtype=float),
+                                      axis=1)], axis=1)
+    rows = np.arange(meshes.shape[0])
+
+    lo, hi = np.zeros_like(ngood), ngood.copy()
+    for _ in range(maxiters):
+        n = np.maximum(hi - lo, 1)
+        mean = (csum[rows, hi] - csum[rows, lo]) / n
+        std = np.sqrt(np.maximum((csum2[rows, hi] - csum2[rows, lo]) / n
+                                 - mean ** 2, 0))
+        median = 0.5 * (meshes[rows, np.maximum(lo + (n - 1) // 2, 0)] +
+                        meshes[rows, np.maximum(lo + n // 2, 0)])
+        with np.errstate(invalid='ignore'):
+            new_lo = (meshes < (median - nsigma * std)[:, np.newaxis]).sum(axis=1)
+            new_hi = np.minimum((meshes <= (median + nsigma * std)[:, np.newaxis]
+                                 ).sum(axis=1), ngood)
+        if np.array_equal(new_lo, lo) and np.array_equal(new_hi, hi):
+            break
+        lo, hi = new_lo, new_hi
+
+    n = hi - lo
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crowded = (mean - median) > 0.3 * std
+        bkg = np.where(crowded, median, 2.5 * median - 1.5 * mean)
+    # Meshes that are mostly bad are replaced by their nearest good mesh
+    bad = (n < 0.5 * ngood) | (ngood < 0.1 * back_size ** 2) | ~np.isfinite(bkg)
+    bkg, rms = bkg.reshape(nby, nbx), std.reshape(nby, nbx)
+    bad = bad.reshape(nby, nbx)
+    if bad.all():
+        return np.zeros_like(data, dtype=float), np.zeros_like(data, dtype=float)
+    if bad.any():
+        indices = ndimage.distance_transform_edt(bad, return_distances=False,
+                                                 return_indices=True)
+        bkg, rms = bkg[tuple(indices)], rms[tuple(indices)]
+
+    if back_filtersize > 1:
+        bkg = ndimage.median_filter(bkg, size=back_filtersize, mode='nearest')
+        rms = ndimage.median_filter(rms, size=back_filtersize, mode='nearest')
+
+    ycen = np.minimum(np.arange(nby) * back_size + 0.5 * (back_size - 1),
+                      0.5 * (np.arange(nby) * back_size + ny - 1))
+    xcen = np.minimum(np.arange(nbx) * back_size + 0.5 * (back_size - 1),
+                      0.5 * (np.arange(nbx) * back_size + nx - 1))
+    return (_interpolate_meshes(bkg, ycen, xcen, ny, nx),
+            _interpolate_meshes(rms, ycen, xcen, ny, nx))
+
+
+def _interpolate_meshes(values, ycen, xcen, ny, nx):
+    """Interpolate a grid of mesh values onto the full image (bicubic)"""
+    for axis, centres, npix in ((0, ycen, ny), (1, xcen, nx)):
+        if centres.size > 1:
+            values = interpolate.CubicSpline(centres, values,
+                                             axis=axis)(np.arange(npix))
+        else:
+            values = np.repeat(values, npix, axis=axis)
+    return values
+
+
+def read_filter(filename):
+    """
+    Reads a SExtractor convolution filter (.conv) file.
+
+    Parameters
+    ----------
+    filename: str
+        name of filter file
+
+    Returns
+    -------
+    ndarray: the (normalized, if requested by the file) filter kernel
+    """
+    normalize = True
+    rows = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if line.startswith('CONV'):
+                normalize = 'NONORM' not in line
+                continue
+            rows.append([float(x) for x in line.split()])
+    kernel = np.array(rows)
+    if normalize and kernel.sum() != 0:
+        kernel /= np.abs(kernel).sum()
+    return kernel
+
+
+def detect_sources(data, mask=None, wcs=None, detect_minarea=8,
+                   detect_thresh=2., analysis_thresh=2., filter_kernel=None,
+                   back_size=32, back_filtersize=3, phot_autoparams=(2.5, 3.5),
+                   satur_level=None, gain=1., seeing_fwhm=None):
+    """
+    Finds the sources in an image and measures them. The background is
+    subtracted, the image is (optionally) convolved with a filter, and
+    connected (8-neighbour) regions above the threshold are labelled.
+    The measurements of each source are made from the background-subtracted
+    (unfiltered) pixels in its region, except the Kron (FLUX_AUTO)
+    photometry, which is made in an elliptical aperture and replaces pixels
+    that belong to other sources by those symmetrically opposite.
+
+    Parameters
+    ----------
+    data: ndarray
+        2D image
+    mask: ndarray/None
+        DQ plane, used only for the IMAFLAGS_ISO and NIMAFLAGS_ISO columns
+    wcs: astropy.wcs.WCS/None
+        WCS of the image, used to calculate the _WORLD columns
+    detect_minarea: int
+        minimum number of pixels above the detection threshold
+    detect_thresh: float
+        detection threshold (in units of the background rms)
+    analysis_thresh: float
+        threshold defining the extent of each source (in units of the
+        background rms)
+    filter_kernel: ndarray/None
+        kernel to convolve with the image before thresholding
+    back_size: int
+        background mesh size (pixels)
+    back_filtersize: int
+        background filtering scale (meshes)
+    phot_autoparams: 2-tuple
+        Kron factor and minimum radius (in units of A_IMAGE and B_IMAGE)
+        of the FLUX_AUTO aperture
+    satur_level: float/None
+        pixel value above which pixels are saturated
+    gain: float
+        gain, for calculating the Poisson contribution to FLUXERR_AUTO
+    seeing_fwhm: float/None
+        FWHM of stars (pixels), used to calculate CLASS_STAR
+
+    Returns
+    -------
+    Table: catalog of sources with SExtractor-like columns
+    ndarray: segmentation image (pixels in each source have the value of
+             its NUMBER, and background pixels are zero)
+    """
+    data = np.asarray(data)
+    ny, nx = data.shape
+    bkg, rms = estimate_background(data, back_size=back_size,
+                                   back_filtersize=back_filtersize)
+    image = data - bkg
+    filtered = (image if filter_kernel is None else
+                ndimage.convolve(image, filter_kernel, mode='nearest'))
+
+    # Find the regions above the analysis threshold, and keep those with
+    # enough pixels above the detection threshold
+    with np.errstate(invalid='ignore'):
+        significance = filtered / rms
+    regions, nregions = ndimage.label(
+        significance > min(detect_thresh, analysis_thresh),
+        structure=np.ones((3, 3), dtype=bool))
+    detected_area = np.bincount(regions[significance > detect_thresh],
+                                minlength=nregions + 1)
+    keep = detected_area >= detect_minarea
+    keep[0] = False
+    numbers = np.zeros(nregions + 1, dtype=np.int32)
+    numbers[keep] = np.arange(1, keep.sum() + 1)
+    segmap = numbers[regions]
+    nsources = int(keep.sum())
+
+    # Pixel lists of all the sources, ordered by source
+    index = np.flatnonzero(segmap)
+    label = segmap.ravel()[index] - 1
+    order = np.argsort(label, kind='stable')
+    index, label = index[order], label[order]
+    area = np.bincount(label, minlength=nsources)
+    starts = np.cumsum(area) - area
+    y, x = np.divmod(index, nx)
+    y, x = y.astype(float), x.astype(float)
+    pixels = image.ravel()[index]
+
+    def total(weights):
+        return np.bincount(label, weights=weights, minlength=nsources)
+
+    # Barycentres and second moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        flux_iso = total(pixels)
+        xbar = total(pixels * x) / flux_iso
+        ybar = total(pixels * y) / flux_iso
+        dx, dy = x - xbar[label], y - ybar[label]
+        x2 = total(pixels * dx * dx) / flux_iso
+        y2 = total(pixels * dy * dy) / flux_iso
+        xy = total(pixels * dx * dy) / flux_iso
+    # Handle singular (e.g., single-row) sources as SExtractor does
+    singular = x2 * y2 - xy * xy < 1. / 144
+    x2[singular] += 1. / 12
+    y2[singular] += 1. / 12
+    a_image, b_image, theta_image = _ellipse(x2, y2, xy)
+
+    peak = np.full(nsources, -np.inf)
+    if nsources:
+        peak = np.maximum.reduceat(pixels, starts)
+    halfmax_area = total((pixels >= 0.5 * peak[label]).astype(float))
+    fwhm_image = 2 * np.sqrt(halfmax_area / np.pi)
+
+    # Radius enclosing half the isophotal flux
+    radius = np.sqrt(dx * dx + dy * dy)
+    by_radius = np.lexsort((radius, label))
+    cumflux = np.cumsum(pixels[by_radius])
+    cumflux -= np.repeat(cumflux[starts] - pixels[by_radius][starts], area)
+    reached = np.flatnonzero(cumflux >= 0.5 * flux_iso[label])
+    sources, first = np.unique(label[reached], return_index=True)
+    flux_radius = np.zeros(nsources)
+    flux_radius[sources] = radius[by_radius][reached[first]]
+
+    # Flags
+    flags = np.zeros(nsources, dtype=np.int32)
+    on_edge = (x == 0) | (y == 0) | (x == nx - 1) | (y == ny - 1)
+    flags[total(on_edge.astype(float)) > 0] |= 8
+    if satur_level is not None:
+        saturated = data.ravel()[index] >= satur_level
+        flags[total(saturated.astype(float)) > 0] |= 4
+    if mask is not None and nsources:
+        dq = np.asarray(mask).ravel()[index].astype(np.int32)
+        imaflags = np.bitwise_or.reduceat(dq, starts)
+        nimaflags = total((dq > 0).astype(float)).astype(np.int32)
+    else:
+        imaflags = nimaflags = None
+
+    # Kron radius (first moment of the elliptical radius) and aperture flux
+    cxx, cyy, cxy = _ellipse_coefficients(a_image, b_image, theta_image)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rell = np.sqrt(np.maximum(cxx[label] * dx * dx + cyy[label] * dy * dy
+                                  + cxy[label] * dx * dy, 0))
+        kron_radius = total(pixels * rell) / flux_iso
+    kron_factor, min_radius = phot_autoparams
+    aperture = np.fmax(kron_factor * np.nan_to_num(kron_radius), min_radius)
+    flux_auto, var_auto, aper_flags = _aperture_photometry(
+        image, rms * rms, segmap, xbar, ybar, cxx, cyy, cxy, aperture,
+        aperture * a_image)
+    flags |= aper_flags
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fluxerr_auto = np.sqrt(var_auto + np.maximum(flux_auto, 0) / gain)
+        mag_auto = np.where(flux_auto > 0, -2.5 * np.log10(flux_auto), 99.)
+        magerr_auto = np.where(flux_auto > 0,
+                               1.0857 * fluxerr_auto / flux_auto, 99.)
+
+    objcat = Table()
+    objcat['NUMBER'] = np.arange(1, nsources + 1, dtype=np.int32)
+    objcat['X_IMAGE'] = xbar + 1  # FITS convention
+    objcat['Y_IMAGE'] = ybar + 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = rms.ravel()[index] ** 2
+        errx2 = total(variance * dx * dx) / flux_iso ** 2
+        erry2 = total(variance * dy * dy) / flux_iso ** 2
+        errxy = total(variance * dx * dy) / flux_iso ** 2
+    objcat['ERRX2_IMAGE'] = errx2
+    objcat['ERRY2_IMAGE'] = erry2
+    objcat['ERRXY_IMAGE'] = errxy
+    objcat['A_IMAGE'] = a_image.astype(np.float32)
+    objcat['B_IMAGE'] = b_image.astype(np.float32)
+    objcat['THETA_IMAGE'] = theta_image.astype(np.float32)
+    erra, errb, errtheta = _ellipse(errx2, erry2, errxy)
+    objcat['ERRA_IMAGE'] = erra.astype(np.float32)
+    objcat['ERRB_IMAGE'] = errb.astype(np.float32)
+    objcat['ERRTHETA_IMAGE'] = errtheta.astype(np.float32)
+    objcat['FWHM_IMAGE'] = fwhm_image.astype(np.float32)
+    objcat['FLUX_RADIUS'] = flux_radius.astype(np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        objcat['ELLIPTICITY'] = (1 - b_image / a_image).astype(np.float32)
+    objcat['FLUX_AUTO'] = flux_auto.astype(np.float32)
+    objcat['FLUXERR_AUTO'] = fluxerr_auto.astype(np.float32)
+    objcat['MAG_AUTO'] = mag_auto.astype(np.float32)
+    objcat['MAGERR_AUTO'] = magerr_auto.astype(np.float32)
+    objcat['FLUX_MAX'] = peak.astype(np.float32)
+    objcat['ISOAREA_IMAGE'] = area.astype(np.int32)
+    objcat['FLAGS'] = flags
+    if imaflags is not None:
+        objcat['IMAFLAGS_ISO'] = imaflags
+        objcat['NIMAFLAGS_ISO'] = nimaflags
+    xpix = np.clip(np.round(np.nan_to_num(xbar)).astype(int), 0, nx - 1)
+    ypix = np.clip(np.round(np.nan_to_num(ybar)).astype(int), 0, ny - 1)
+    objcat['BACKGROUND'] = bkg[ypix, xpix].astype(np.float32)
+
+    if wcs is not None:
+        if nsources:
+            ra, dec = wcs.all_pix2world(objcat['X_IMAGE'], objcat['Y_IMAGE'], 1)
+        else:
+            ra = dec = np.array([])
+        objcat['X_WORLD'] = ra
+        objcat['Y_WORLD'] = dec
+        # Transform the moments with the (linear) pixel -> sky matrix
+        jacobian = wcs.pixel_scale_matrix
+        moments = np.array([[x2, xy], [xy, y2]]).transpose(2, 0, 1)
+        moments = jacobian @ moments @ jacobian.T
+        a_world, b_world, theta_world = _ellipse(
+            moments[:, 0, 0], moments[:, 1, 1], moments[:, 0, 1])
+        objcat['A_WORLD'] = a_world.astype(np.float32)
+        objcat['B_WORLD'] = b_world.astype(np.float32)
+        objcat['THETA_WORLD'] = theta_world.astype(np.float32)
+        pixscale = np.sqrt(abs(np.linalg.det(jacobian)))
+        objcat['FWHM_WORLD'] = (fwhm_image * pixscale).astype(np.float32)
+
+    objcat['CLASS_STAR'] = classify_sources(objcat, seeing_fwhm)
+    return objcat, segmap
+
+
+def classify_sources(objcat, seeing_fwhm=None):
+    """
+    Calculates a stellarity index for each source in a catalog. The FWHM
+    that a Gaussian source with the measured total flux and peak would
+    have is compared with the FWHM of stars, and the index falls from 1
+    as the ratio of the two departs from unity (so both extended sources
+    and cosmic rays have low values).
+
+    Parameters
+    ----------
+    objcat: Table
+        catalog with FLUX_AUTO, FLUXERR_AUTO, and FLUX_MAX columns
+    seeing_fwhm: float/None
+        FWHM of stars (pixels). If None, the median value of the
+        high-S/N sources is used, which assumes most of them are stars.
+
+    Returns
+    -------
+    ndarray: stellarity index (between 0 and 1)
+    """
+    flux = np.asarray(objcat['FLUX_AUTO'], dtype=float)
+    fluxerr = np.asarray(objcat['FLUXERR_AUTO'], dtype=float)
+    peak = np.asarray(objcat['FLUX_MAX'], dtype=float)
+    good = (flux > 0) & (peak > 0)
+    peak_fwhm = np.full(flux.shape, np.nan)
+    peak_fwhm[good] = np.sqrt(4 * np.log(2) * flux[good] / (np.pi * peak[good]))
+    if seeing_fwhm is None:
+        bright = good & (flux > 25 * fluxerr)
+        if not bright.any():
+            return np.zeros(flux.shape, dtype=np.float32)
+        seeing_fwhm = np.median(peak_fwhm[bright])
+
+    class_star = np.zeros(flux.shape, dtype=np.float32)
+    sigma2 = 0.01 + (0.5 * fluxerr[good] / flux[good]) ** 2
+    class_star[good] = np.exp(-0.5 * np.log(peak_fwhm[good] / seeing_fwhm) ** 2
+                              / sigma2)
+    return class_star
+
+
+def _ellipse(x2, y2, xy):
+    """Semi-major and -minor axes and position angle from second moments"""
+    with np.errstate(invalid='ignore'):
+        mean = 0.5 * (x2 + y2)
+        diff = np.sqrt(0.25 * (x2 - y2) ** 2 + xy * xy)
+        a = np.sqrt(mean + diff)
+        b = np.sqrt(np.maximum(mean - diff, 0))
+    theta = np.degrees(0.5 * np.arctan2(2 * xy, x2 - y2))
+    return a, b, theta
+
+
+def _ellipse_coefficients(a, b, theta):
+    """Coefficients of the ellipse equation cxx*x^2 + cyy*y^2 + cxy*x*y = R^2"""
+    cos, sin = np.cos(np.radians(theta)), np.sin(np.radians(theta))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cxx = cos * cos / (a * a) + sin * sin / (b * b)
+        cyy = sin * sin / (a * a) + cos * cos / (b * b)
+        cxy = 2 * cos * sin * (1 / (a * a) - 1 / (b * b))
+    return cxx, cyy, cxy
+
+
+def _aperture_photometry(image, variance, segmap, xcen, ycen, cxx, cyy, cxy,
+                         radius, extent):
+    """
+    Sums the pixels in elliptical apertures. The sources are grouped by the
+    size of box needed to contain their apertures and each group is measured
+    in batches of cutouts, taken as views of the padded image. Pixels in the
+    aperture belonging to other sources are replaced by the pixels opposite
+    them (or zero if those also belong to another source).
+
+    Returns
+    -------
+    flux: ndarray
+        sum of pixels in each aperture
+    var: ndarray
+        sum of the variance in each aperture
+    flags: ndarray
+        SExtractor flags (1 if other sources were replaced in the aperture,
+        8 if the aperture extends beyond the image)
+    """
+    nsources = xcen.size
+    flux = np.zeros(nsources)
+    var = np.zeros(nsources)
+    flags = np.zeros(nsources, dtype=np.int32)
+    good = np.isfinite(xcen) & np.isfinite(ycen) & np.isfinite(radius) & \
+        np.isfinite(cxx) & np.isfinite(cyy) & np.isfinite(cxy)
+    if not good.any():
+        return flux, var, flags
+
+    pad = APERTURE_BOXES[-1]
+    padded_image = np.pad(image, pad, mode='constant')
+    padded_var = np.pad(variance, pad, mode='constant')
+    padded_seg = np.pad(segmap, pad, mode='constant', constant_values=-1)
+    halfsize = np.ceil(np.nan_to_num(extent)) + 1
+    boxes = np.searchsorted(APERTURE_BOXES, halfsize)
+    boxes[boxes == len(APERTURE_BOXES)] -= 1
+    xint = np.round(np.where(good, xcen, 0)).astype(int)
+    yint = np.round(np.where(good, ycen, 0)).astype(int)
+
+    for ibox, size in enumerate(APERTURE_BOXES):
+        sources = np.flatnonzero(good & (boxes == ibox))
+        if sources.size == 0:
+            continue
+        width = 2 * size + 1
+        offsets = np.arange(-size, size + 1)
+        # Views of all the (width, width) windows of the padded arrays
+        windows = [np.lib.stride_tricks.as_strided(
+                       arr, shape=(arr.shape[0] - width + 1,
+                                   arr.shape[1] - width + 1, width, width),
+                       strides=arr.strides * 2, writeable=False)
+                   for arr in (padded_image, padded_var, padded_seg)]
+        batch_size = max(1, MAX_BATCH_PIXELS // (width * width))
+        for start in range(0, sources.size, batch_size):
+            batch = sources[start:start + batch_size]
+            # Window (i, j) is centred on pixel (i - pad + size, j - pad + size)
+            iy, ix = yint[batch] + pad - size, xint[batch] + pad - size
+            data, noise, seg = (w[iy, ix] for w in windows)
+            dx = (xint[batch] - xcen[batch])[:, np.newaxis, np.newaxis] + offsets
+            dy = (yint[batch] - ycen[batch])[:, np.newaxis, np.newaxis] + \
+                offsets[:, np.newaxis]
+            inside = (cxx[batch, np.newaxis, np.newaxis] * dx * dx +
+                      cyy[batch, np.newaxis, np.newaxis] * dy * dy +
+                      cxy[batch, np.newaxis, np.newaxis] * dx * dy <=
+                      (radius[batch] ** 2)[:, np.newaxis, np.newaxis])
+            number = (batch + 1)[:, np.newaxis, np.newaxis]
+            other = inside & (seg > 0) & (seg != number)
+            outside = inside & (seg < 0)
+            flipped = seg[:, ::-1, ::-1]
+            usable = (flipped == 0) | (flipped == number)
+            data = np.where(other, np.where(usable, data[:, ::-1, ::-1], 0),
+                            data)
+            noise = np.where(other, np.where(usable, noise[:, ::-1, ::-1], 0),
+                             noise)
+            flux[batch] = (data * inside).sum(axis=(1, 2))
+            var[batch] = (noise * inside).sum(axis=(1, 2))
+            flags[batch] |= np.where(other.any(axis=(1, 2)), 1, 0)
+            flags[batch] |= np.where(outside.any(axis=(1, 2)), 8, 0)
+    return flux, var, flags
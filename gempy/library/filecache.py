@@ -0,0 +1,310 @@
+# Copyright(c) 2020 Association of Universities for Research in Astronomy, Inc.
+"""
+A process-wide cache of data parsed from text files that are read over and
+over during a reduction, such as arc line lists and the tables of
+spectrophotometric standards. Entries are keyed on the absolute path of the
+file and are only valid while the file's modification time and size are
+unchanged. The parsed data are held as (read-only) numpy arrays and can
+optionally be saved to, and reloaded from, ``.npz`` sidecar files in a
+cache directory so that other processes don't need to parse the files
+again.
+
+>>> linelist = read_linelist("CuAr_GMOS.dat")
+>>> wavelengths, weights = linelist.subset(500, 600)
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from astropy import units as u
+from astropy.table import Table, MaskedColumn
+
+
+class FileCache:
+    """
+    Cache of arrays parsed from files. Subclasses can use `_cached()` to
+    cache other sorts of objects made from files.
+
+    Parameters
+    ----------
+    directory: str/None
+        if not None, a directory where the parsed arrays are saved as
+        ``.npz`` files, and from which they are reloaded if the file
+        hasn't changed
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename, parser, kind):
+        """
+        Returns the arrays and metadata parsed from a file, parsing the
+        file only if it's not in the cache (or has changed since it was).
+
+        Parameters
+        ----------
+        filename: str
+            name of file
+        parser: callable
+            function that takes the full path of the file and returns a
+            dict of arrays and a JSON-serializable dict of metadata
+        kind: str
+            identifies what sort of parsing is done (the same file could be
+            parsed in different ways)
+
+        Returns
+        -------
+        dict: {name: array} of read-only arrays
+        dict: metadata
+
+        Raises
+        ------
+        FileNotFoundError: if the file does not exist
+        """
+        def load(path, stamp):
+            entry = self._load((kind, path), stamp)
+            if entry is None:
+                arrays, meta = parser(path)
+                arrays = {name: np.array(arr) for name, arr in arrays.items()}
+                self._save((kind, path), stamp, arrays, meta)
+            else:
+                arrays, meta = entry
+            for arr in arrays.values():
+                arr.flags.writeable = False
+            return arrays, meta
+
+        return self._cached(filename, kind, load)
+
+    def _cached(self, filename, kind, load):
+        """
+        Returns the entry for a file, calling `load(path, stamp)` to make
+        it if the file is not in the cache (or has changed since it was).
+        The stamp is the file's [modification time, size].
+        """
+        path = os.path.abspath(os.path.expanduser(filename))
+        stat = os.stat(path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        key = (kind, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+
+        value = load(path, stamp)
+        with self._lock:
+            self.misses += 1
+            entry = self._entries.get(key)
+            # Another thread may have loaded it in the meantime
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+            self._entries[key] = (stamp, value)
+        return value
+
+    def clear(self):
+        """Empty the (in-memory) cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def _sidecar(self, key):
+        kind, path = key
+        digest = hashlib.sha1("{}:{}".format(kind, path).encode()).hexdigest()
+        return os.path.join(self.directory, "{}_{}.npz".format(
+            os.path.basename(path), digest[:16]))
+
+    def _load(self, key, stamp):
+        """Load arrays from a sidecar file, if it's valid for this stamp"""
+        if self.directory is None:
+            return
+        try:
+            with np.load(self._sidecar(key), allow_pickle=False) as npz:
+                header = json.loads(str(npz['__header__']))
+                if header['stamp'] != stamp:
+                    return
+                arrays = {name: npz[name] for name in header['arrays']}
+        except (OSError, KeyError, ValueError):
+            return
+        return arrays, header['meta']
+
+    def _save(self, key, stamp, arrays, meta):
+        """Save arrays to a sidecar file (atomically)"""
+        if self.directory is None:
+            return
+        header = json.dumps({'stamp': stamp, 'arrays': list(arrays),
+                             'meta': meta})
+        atomic_save(self._sidecar(key), lambda tmpfile: np.savez(
+            tmpfile, __header__=np.array(header), **arrays))
+
+
+def atomic_save(filename, save):
+    """
+    Writes a file by calling `save` with the name of a temporary file in
+    the same directory, which is then renamed, so that other processes
+    never see a partly-written file.
+
+    Parameters
+    ----------
+    filename: str
+        name of the file to write
+    save: callable
+        function that writes the file whose name it is given
+
+    Returns
+    -------
+    bool: whether the file was written
+    """
+    root, ext = os.path.splitext(filename)
+    tmpfile = "{}.{}.tmp{}".format(root, os.getpid(), ext)
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        save(tmpfile)
+        os.replace(tmpfile, filename)
+    except OSError:
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+class LineList:
+    """
+    The wavelengths (and, optionally, weights) of the lines in a line list,
+    in the order in which they appear in the file. The (read-only) arrays
+    are shared by all users of the cache, so use `subset()` to get arrays
+    that can be modified.
+
+    Attributes
+    ----------
+    wavelengths: ndarray
+        wavelengths of the lines
+    weights: ndarray/None
+        weights of the lines (if the file has a second column)
+    """
+    def __init__(self, wavelengths, weights=None, order=None):
+        self.wavelengths = wavelengths
+        self.weights = weights
+        self._order = (np.argsort(wavelengths, kind='stable')
+                       if order is None else order)
+        self._sorted = wavelengths[self._order]
+
+    def __len__(self):
+        return self.wavelengths.size
+
+    def subset(self, w1=None, w2=None):
+        """
+        Returns copies of the wavelengths and weights of the lines with
+        wavelengths between w1 and w2 (inclusive), in file order.
+
+        Parameters
+        ----------
+        w1: float/None
+            shortest wavelength (None => no limit)
+        w2: float/None
+            longest wavelength (None => no limit)
+
+        Returns
+        -------
+        ndarray: wavelengths of the lines
+        ndarray/None: weights of the lines
+        """
+        if w1 is None and w2 is None:
+            indices = slice(None)
+        else:
+            i1 = 0 if w1 is None else np.searchsorted(self._sorted, w1, 'left')
+            i2 = (self._sorted.size if w2 is None else
+                  np.searchsorted(self._sorted, w2, 'right'))
+            indices = np.sort(self._order[i1:i2])
+        return (self.wavelengths[indices].copy(),
+                None if self.weights is None else self.weights[indices].copy())
+
+
+def _parse_linelist(path):
+    with open(path) as f:
+        lines = f.readlines()
+    arrays = {'wavelengths': np.loadtxt(lines, usecols=[0], ndmin=1)}
+    try:
+        arrays['weights'] = np.loadtxt(lines, usecols=[1], ndmin=1)
+    except (IndexError, ValueError):  # no second column
+        pass
+    arrays['order'] = np.argsort(arrays['wavelengths'], kind='stable')
+    return arrays, {}
+
+
+def read_linelist(filename, cache=None):
+    """
+    Reads a line list, a text file whose first column contains the
+    wavelengths and whose (optional) second column contains the weights.
+
+    Parameters
+    ----------
+    filename: str
+        name of file
+    cache: FileCache/None
+        cache to use (None => the process-wide cache)
+
+    Returns
+    -------
+    LineList
+    """
+    cache = file_cache if cache is None else cache
+    arrays, _ = cache.get(filename, _parse_linelist, 'linelist')
+    return LineList(arrays['wavelengths'], arrays.get('weights'),
+                    order=arrays['order'])
+
+
+def read_table(filename, parser, cache=None):
+    """
+    Reads a Table from a file with the given function, keeping the columns
+    (with their units) in the cache. A new Table is returned each time, so
+    it can be modified.
+
+    Parameters
+    ----------
+    filename: str
+        name of file
+    parser: callable
+        function that takes the full path of the file and returns a Table
+    cache: FileCache/None
+        cache to use (None => the process-wide cache)
+
+    Returns
+    -------
+    Table
+    """
+    def parse_table(path):
+        tbl = parser(path)
+        arrays, columns = {}, []
+        for i, col in enumerate(tbl.itercols()):
+            arrays['col{}'.format(i)] = np.ma.getdata(col)
+            masked = isinstance(col, MaskedColumn)
+            if masked:
+                arrays['mask{}'.format(i)] = np.ma.getmaskarray(col)
+            columns.append({'name': col.name, 'masked': masked,
+                            'unit': None if col.unit is None
+                            else col.unit.to_string()})
+        return arrays, {'columns': columns}
+
+    cache = file_cache if cache is None else cache
+    kind = 'table:{}.{}'.format(getattr(parser, '__module__', None),
+                                getattr(parser, '__qualname__', parser))
+    arrays, meta = cache.get(filename, parse_table, kind)
+    tbl = Table()
+    for i, column in enumerate(meta['columns']):
+        data = arrays['col{}'.format(i)].copy()
+        if column['masked']:
+            data = np.ma.masked_array(data, mask=arrays['mask{}'.format(i)])
+        tbl[column['name']] = data
+        if column['unit'] is not None:
+            tbl[column['name']].unit = u.Unit(column['unit'],
+                                              parse_strict='silent')
+    return tbl
+
+
+file_cache = FileCache()
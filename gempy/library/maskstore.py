@@ -0,0 +1,112 @@
+# Copyright(c) 2020 Association of Universities for Research in Astronomy, Inc.
+"""
+A process-wide store of the static masks (the bad pixel masks and
+illumination masks in ``geminidr/<instrument>/lookups/BPM``) that are
+looked up for every frame by addDQ and addIllumMaskToDQ. Each file is only
+read once per process (or again if it changes), and the same AstroData
+object is returned every time, so the clipped versions made by
+`gemini_tools.clip_auxiliary_data()` are reused too.
+
+The pixel planes are held as read-only uint16 arrays. If a cache directory
+is set (see `recipe_system.config.get_mask_cache()`), they are saved there
+as ``.npy`` files and memory-mapped, so all the processes on a machine
+share a single copy of each mask.
+
+>>> bpm = read_mask("gmos-n_bpm_HAM_22_12amp_v1.fits")
+"""
+import hashlib
+import os
+
+import numpy as np
+
+import astrodata
+from geminidr.gemini.lookups import DQ_definitions as DQ
+from gempy.library.filecache import FileCache, atomic_save
+from recipe_system.config import get_mask_cache
+
+
+class MaskStore(FileCache):
+    """
+    Store of masks read from FITS files.
+
+    Parameters
+    ----------
+    directory: str/None
+        directory where the pixel planes are saved as ``.npy`` files to be
+        memory-mapped (None => use the configured directory, if any)
+    """
+    def get(self, filename):
+        """
+        Returns the mask in a file, reading it only if it's not in the
+        store (or has changed since it was read).
+
+        Parameters
+        ----------
+        filename: str
+            name of file
+
+        Returns
+        -------
+        AstroData: the mask, with read-only uint16 data planes
+
+        Raises
+        ------
+        FileNotFoundError: if the file does not exist
+        """
+        return self._cached(filename, 'mask', self._read)
+
+    def _read(self, path, stamp):
+        ad = astrodata.open(path)
+        directory = self.directory or get_mask_cache()
+        for index, ext in enumerate(ad):
+            plane = None
+            if directory is not None:
+                plane = _mapped_plane(ext, directory, [path, index] + stamp)
+            if plane is None:
+                plane = ext.data.astype(DQ.datatype)
+                plane.flags.writeable = False
+            ext.data = plane
+        return ad
+
+
+def _mapped_plane(ext, directory, key):
+    """
+    Memory-map the data plane of an extension from a ``.npy`` file, which
+    is written first if it doesn't exist. Returns None if this fails, or
+    the file doesn't match the extension.
+    """
+    digest = hashlib.sha1(":".join(str(x) for x in key).encode()).hexdigest()
+    filename = os.path.join(directory, "{}_{}_{}.npy".format(
+        os.path.basename(key[0]), digest[:16], key[1]))
+    if not (os.path.exists(filename) or atomic_save(
+            filename, lambda tmpfile: np.save(tmpfile,
+                                              ext.data.astype(DQ.datatype)))):
+        return
+    try:
+        plane = np.load(filename, mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return
+    if plane.shape == ext.shape and plane.dtype == DQ.datatype:
+        return plane.view(np.ndarray)
+
+
+def read_mask(filename, store=None):
+    """
+    Reads a static mask (BPM or illumination mask).
+
+    Parameters
+    ----------
+    filename: str
+        name of file
+    store: MaskStore/None
+        store to use (None => the process-wide store)
+
+    Returns
+    -------
+    AstroData: the mask, which is shared, so must not be modified
+    """
+    store = mask_store if store is None else store
+    return store.get(filename)
+
+
+mask_store = MaskStore()
@@ -6,6 +6,7 @@ from astropy.modeling.fitting import (_validate_model,
                                       _fitter_to_model_params,
                                       _model_to_fit_params, Fitter,
                                       _convert_input)
+from astropy.modeling.core import CompoundModel
 from astropy.wcs import WCS
 
 from scipy import optimize, spatial
@@ -646,18 +647,12 @@ class KDTreeFitter(Fitter):
                     getattr(model_copy, p).value = 20 * xtol if pval == 0 \
                         else (np.sign(pval) * 20 * xtol)
 
-        if in_weights is None:
-            in_weights = np.ones((len(in_coords[0]),))
-        if ref_weights is None:
-            ref_weights = np.ones((len(ref_coords[0]),))
-        # cKDTree.query() returns a value of n for no neighbour so make coding
-        # easier by allowing this to match a zero-weighted reference
-        ref_weights = np.append(ref_weights, (0,))
-
-        tree = spatial.cKDTree(list(zip(*ref_coords)))
+        in_weights, ref_weights, tree = self._prepare(in_coords, ref_coords,
+                                                      in_weights, ref_weights)
         # avoid _convert_input since tree can't be coerced to a float
         farg = (model_copy, in_coords, in_weights, ref_weights, tree)
         p0, _ = _model_to_fit_params(model_copy)
+        self._fit_parameters = (model_copy, self._free_parameters(model_copy))
 
         arg_names = inspect.getfullargspec(self._opt_method).args
         args = [self.objective_function]
@@ -686,6 +681,161 @@ class KDTreeFitter(Fitter):
         self.niter = result['nit']
         return model_copy
 
+    def batch_statistic(self, model, params, in_coords, ref_coords,
+                        in_weights=None, ref_weights=None):
+        """
+        Evaluate the fitting statistic for many sets of parameters at once.
+        This is much faster than evaluating them one at a time, since the
+        model is evaluated (if it can broadcast its parameters) and the
+        KDTree queried only once for all the sets.
+
+        Parameters
+        ----------
+        model: FittableModel
+            model defining transformation; its parameters are not modified
+        params: array-like (S x P)
+            S sets of the P free (not fixed or tied) parameters of the model
+        in_coords: array-like (n x N)
+            array of input coordinates
+        ref_coords: array-like (n x M)
+            array of reference coordinates
+        in_weights: array-like (N,)
+            weights for input coordinates
+        ref_weights: array-like (M,)
+            weights for reference coordinates
+
+        Returns
+        -------
+        ndarray (S,): statistic (to be minimized) for each set of parameters
+        """
+        model_copy = model.copy()
+        try:
+            iter(in_coords[0])
+        except TypeError:
+            in_coords = (in_coords,)
+        try:
+            iter(ref_coords[0])
+        except TypeError:
+            ref_coords = (ref_coords,)
+        in_weights, ref_weights, tree = self._prepare(in_coords, ref_coords,
+                                                      in_weights, ref_weights)
+        return self._kdstat_batch(tree, model_copy, np.atleast_2d(params),
+                                  in_coords, in_weights, ref_weights)
+
+    def _prepare(self, in_coords, ref_coords, in_weights, ref_weights):
+        """
+        Set up the weights arrays and the KDTree of the reference coordinates
+        """
+        if in_weights is None:
+            in_weights = np.ones((len(in_coords[0]),))
+        if ref_weights is None:
+            ref_weights = np.ones((len(ref_coords[0]),))
+        in_weights = np.asarray(in_weights)
+        # cKDTree.query() returns a value of n for no neighbour so make coding
+        # easier by allowing this to match a zero-weighted reference
+        ref_weights = np.append(ref_weights, (0,))
+        tree = spatial.cKDTree(np.array(ref_coords, dtype=float).T)
+        return in_weights, ref_weights, tree
+
+    def objective_function(self, fps, *args):
+        """
+        Function to minimize. This is the same as the Fitter method but,
+        unless the model has tied parameters, the fitted parameters are
+        put into the model in a single operation, since the astropy helper
+        function takes far longer than computing the statistic.
+        """
+        model = args[0]
+        fit_model, free_params = getattr(self, '_fit_parameters', (None, None))
+        if model is not fit_model or free_params is None:
+            return super().objective_function(fps, *args)
+        indices, lower, upper = free_params
+        parameters = model.parameters
+        parameters[indices] = np.fmin(np.fmax(fps, lower), upper)
+        model.parameters = parameters
+        return self._stat_method(args[-1], model, *args[1:-1])
+
+    @staticmethod
+    def _free_parameters(model):
+        """
+        Describe where the fitted parameters go in the model's parameter
+        array, and their bounds (NaN for no bound, to be used with np.fmax
+        and np.fmin as astropy does).
+
+        Returns
+        -------
+        tuple: (indices, lower bounds, upper bounds) arrays, or None if
+               the model has tied parameters
+        """
+        if any(model.tied.values()):
+            return None
+        fixed, bounds = model.fixed, model.bounds
+        indices = [np.array([], dtype=int)]
+        lower, upper = [np.array([])], [np.array([])]
+        for name in model.param_names:
+            if fixed[name]:
+                continue
+            slice_ = model._param_metrics[name]['slice']
+            index = np.arange(slice_.start, slice_.stop)
+            lo, hi = bounds[name]
+            indices.append(index)
+            lower.append(np.full(index.size, np.nan if lo is None else lo))
+            upper.append(np.full(index.size, np.nan if hi is None else hi))
+        return (np.concatenate(indices), np.concatenate(lower),
+                np.concatenate(upper))
+
+    @staticmethod
+    def _batch_model_outputs(model, params, in_coords):
+        """
+        Transform the input coordinates with the model for each set of free
+        parameters. The model's evaluate() method is given all the parameter
+        sets at once if its parameters are scalars and the result for the
+        first set agrees with a normal model call; otherwise the model is
+        called once per set. The model's parameters are not modified.
+
+        Returns
+        -------
+        ndarray (S x n x N): output coordinates for each parameter set
+        """
+        in_coords = [np.asarray(coords, dtype=float) for coords in in_coords]
+        saved_params = model.parameters.copy()
+        free_params = KDTreeFitter._free_parameters(model)
+        if free_params is None:
+            all_params = []
+            for fps in params:
+                _fitter_to_model_params(model, fps)
+                all_params.append(model.parameters.copy())
+            all_params = np.array(all_params)
+        else:
+            indices, lower, upper = free_params
+            all_params = np.tile(saved_params, (len(params), 1))
+            all_params[:, indices] = np.fmin(np.fmax(params, lower), upper)
+
+        def call_model(parameters):
+            model.parameters = parameters
+            return np.array(model(*in_coords), ndmin=2)
+
+        try:
+            if not isinstance(model, CompoundModel) and all(
+                    model._param_metrics[p]['shape'] == ()
+                    for p in model.param_names):
+                try:
+                    out = model.evaluate(*in_coords,
+                                         *all_params.T[:, :, np.newaxis])
+                    if model.n_outputs == 1:
+                        out = (out,)
+                    out = np.stack(np.broadcast_arrays(*out), axis=1)
+                    if (out.shape == (len(params), model.n_outputs,
+                                      len(in_coords[0])) and
+                            np.allclose(out[-1], call_model(all_params[-1]),
+                                        rtol=1e-12, equal_nan=True)):
+                        return out
+                except (TypeError, ValueError, IndexError):
+                    pass
+            return np.array([call_model(parameters)
+                             for parameters in all_params])
+        finally:
+            model.parameters = saved_params
+
     @staticmethod
     def gaussian(distance, sigma):
         return np.exp(-0.5 * distance * distance / (sigma * sigma))
@@ -728,18 +878,40 @@ class KDTreeFitter(Fitter):
         if len(in_coords) == 1:
             out_coords = (out_coords,)
 
-        dist, idx = tree.query(list(zip(*out_coords)), k=self.k,
+        dist, idx = tree.query(np.array(out_coords, ndmin=2).T, k=self.k,
                                distance_upper_bound=self.maxsep)
-
         if self.k > 1:
-            result = sum(in_wt * ref_weights[i] * self.proximity_function(d)
-                         for in_wt, dd, ii in zip(in_weights, dist, idx)
-                         for d, i in zip(dd, ii))
-        else:
-            result = sum(in_wt * ref_weights[i] * self.proximity_function(d)
-                         for in_wt, d, i in zip(in_weights, dist, idx))
+            in_weights = np.asarray(in_weights)[:, np.newaxis]
+
+        return -np.sum(in_weights * ref_weights[idx] *
+                       self.proximity_function(dist))  # to minimize
 
-        return -result  # to minimize
+    def _kdstat_batch(self, tree, model, params, in_coords, in_weights,
+                      ref_weights):
+        """
+        Compute the statistic (as `_kdstat`) for each of a set of free
+        parameters, querying the KDTree once for all of them.
+
+        Parameters
+        ----------
+        params: ndarray (S x P)
+            S sets of the P free parameters of the model
+
+        Other parameters are as for `_kdstat`
+
+        Returns
+        -------
+        ndarray (S,): statistic for each set of parameters
+        """
+        out_coords = self._batch_model_outputs(model, params, in_coords)
+        nsets, ndim, npts = out_coords.shape
+        dist, idx = tree.query(out_coords.transpose(0, 2, 1).reshape(-1, ndim),
+                               k=self.k, distance_upper_bound=self.maxsep)
+        dist = dist.reshape(nsets, npts, -1)
+        idx = idx.reshape(nsets, npts, -1)
+        in_weights = np.asarray(in_weights)[:, np.newaxis]
+        return -np.sum(in_weights * ref_weights[idx] *
+                       self.proximity_function(dist), axis=(1, 2))
 
 
 def fit_model(model, xin, xout, sigma=5.0, tolerance=1e-8, brute=True,
@@ -42,6 +42,8 @@ DQhierarchy = (DQ.no_data, DQ.unilluminated, DQ.bad_pixel, DQ.overlap,
                DQ.cosmic_ray, DQ.non_linear | DQ.saturated)
 ZERO = DQ.datatype(0)
 ONE = DQ.datatype(DQ.bad_pixel)
+# The DQ bits that do not stop a pixel being used
+FLAGS = (DQ.non_linear, DQ.saturated)
 
 
 def take_along_axis(arr, ind, axis):
@@ -152,6 +154,13 @@ def rejector(fn):
 class NDStacker:
     # Base class from which all stacking functions should subclass.
     # Put helper functions here so they can be inherited.
+
+    # Bytes per input pixel of the temporary arrays made while rejecting
+    # and combining, beyond the stacked float32 data and variance and
+    # uint16 mask: copies of all three (eg. by cyclip) and an int64 index
+    # for sorting (eg. by minmax)
+    temporary_bytes = 18
+
     def __init__(self, combine='mean', reject='none', log=None, **kwargs):
         self._log = log
         try:
@@ -577,6 +586,312 @@ class NDStacker:
             mask |= clipped_data.mask
         return data, mask, variance
 
+class SlidingStacker:
+    """
+    Combines a window of frames that can be changed by adding and removing
+    individual frames, without restacking the frames that remain in it.
+    A per-pixel sorted stack of the (unmasked) values in the window is
+    maintained, so each frame that is added or removed costs O(N) array
+    operations for a window of N frames, and the median (or mean after
+    minmax rejection) can be read off the sorted stack. This makes a
+    running sky from a long sequence much cheaper than stacking every
+    window from scratch.
+
+    Only the combine/reject methods that can be computed from the sorted
+    values are supported (see `combiners` and `rejectors`), and the results
+    are the same as NDStacker's to within float32 rounding. Output pixels
+    with no good input pixels are combined by NDStacker, so that the DQ
+    hierarchy is respected.
+
+    Parameters
+    ----------
+    capacity: int
+        maximum number of frames in the window
+    combine: str
+        combining method (one of `combiners`)
+    reject: str
+        rejection method (one of `rejectors`)
+    kwargs: dict
+        arguments for the rejection method, which are selected in the same
+        way as by NDStacker
+    """
+    combiners = ('mean', 'median', 'lmedian')
+    rejectors = ('none', 'minmax')
+
+    def __init__(self, capacity, combine='median', reject='none', **kwargs):
+        if combine not in self.combiners or reject not in self.rejectors:
+            raise ValueError("Cannot combine with {} and {} rejection "
+                             "incrementally".format(combine, reject))
+        self.capacity = capacity
+        self.combine = combine
+        self.reject = reject
+        self._rej_args = {k: v for k, v in kwargs.items()
+                          if k in getattr(NDStacker, reject).required_args}
+        self.nlow = self._rej_args.get('nlow', 0)
+        self.nhigh = self._rej_args.get('nhigh', 0)
+        self._keys = []
+        self._slots = {}
+        self._data = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def _allocate(self, data, mask, variance):
+        shape = (self.capacity,) + data.shape
+        self._data = np.empty(shape, dtype=np.float32)
+        self._mask = (None if mask is None else
+                      np.empty(shape, dtype=DQ.datatype))
+        self._variance = (None if variance is None else
+                          np.empty(shape, dtype=np.float32))
+        self._sorted = np.full(shape, np.inf, dtype=np.float32)
+        self._ids = np.full(shape, -1, dtype=np.int8 if self.capacity < 128
+                            else np.int16)
+        self._free = list(reversed(range(self.capacity)))
+        # Running totals over the good pixels in the window: the number of
+        # them, the sum of their variances, and how many have each of the
+        # DQ bits that do not make a pixel bad
+        self._ngood = np.zeros(data.shape, dtype=np.int16)
+        self._var_sum = (None if variance is None else
+                         np.zeros(data.shape, dtype=np.float64))
+        self._flag_counts = (None if mask is None else
+                             np.zeros((len(FLAGS),) + data.shape,
+                                      dtype=np.int16))
+
+    def _good(self, slot):
+        return (np.ones(self._data.shape[1:], dtype=bool)
+                if self._mask is None else (self._mask[slot] & BAD) == 0)
+
+    def _update_totals(self, slot, sign):
+        good = self._good(slot)
+        self._ngood += sign * good
+        if self._variance is not None:
+            self._var_sum += sign * np.where(good, self._variance[slot], 0)
+        if self._mask is not None:
+            for counts, flag in zip(self._flag_counts, FLAGS):
+                counts += sign * (good & (self._mask[slot] & flag > 0))
+        return good
+
+    def _store(self, key, data, mask, variance, scale, zero):
+        if self._data is None:
+            self._allocate(data, mask, variance)
+        if (mask is None) != (self._mask is None) or (
+                (variance is None) != (self._variance is None)):
+            raise ValueError("All frames must have masks and variances, "
+                             "or none may")
+        if not self._free:
+            raise ValueError("Window is full ({} frames)".format(self.capacity))
+        slot = self._free.pop()
+        self._data[slot] = data * scale + zero
+        if mask is not None:
+            self._mask[slot] = mask
+        if variance is not None:
+            self._variance[slot] = variance * scale * scale
+        self._keys.append(key)
+        self._slots[key] = slot
+        good = self._update_totals(slot, 1)
+        return slot, np.where(good, self._data[slot], np.inf)
+
+    def add(self, key, data, mask=None, variance=None, scale=1., zero=0.):
+        """
+        Adds a frame to the window, inserting its values into the sorted
+        stack.
+
+        Parameters
+        ----------
+        key: hashable
+            identifier for the frame
+        data: ndarray
+            pixel data
+        mask: ndarray/None
+            DQ values (all frames must have masks, or none may)
+        variance: ndarray/None
+            variance (all frames must have variances, or none may)
+        scale: float
+            multiplicative factor to apply to the data
+        zero: float
+            offset to add to the (scaled) data
+        """
+        n = len(self)
+        slot, values = self._store(key, data, mask, variance, scale, zero)
+        pos = np.count_nonzero(self._sorted[:n] <= values, axis=0)
+        positions = np.arange(n + 1).reshape((n + 1,) + (1,) * pos.ndim)
+        shift = positions[1:] > pos
+        np.copyto(self._sorted[1:n+1], self._sorted[:n], where=shift)
+        np.copyto(self._ids[1:n+1], self._ids[:n], where=shift)
+        insert = positions == pos
+        np.copyto(self._sorted[:n+1], values, where=insert)
+        np.copyto(self._ids[:n+1], slot, where=insert)
+
+    def remove(self, key):
+        """Removes a frame from the window"""
+        n = len(self)
+        slot = self._slots.pop(key)
+        self._keys.remove(key)
+        pos = np.argmax(self._ids[:n] == slot, axis=0)
+        positions = np.arange(n - 1).reshape((n - 1,) + (1,) * pos.ndim)
+        shift = positions >= pos
+        np.copyto(self._sorted[:n-1], self._sorted[1:n], where=shift)
+        np.copyto(self._ids[:n-1], self._ids[1:n], where=shift)
+        self._sorted[n-1] = np.inf
+        self._ids[n-1] = -1
+        self._update_totals(slot, -1)
+        self._free.append(slot)
+
+    def update(self, frames):
+        """
+        Changes the window so that it contains exactly the frames given,
+        adding and removing frames as required. If more frames are being
+        added than are already in the window, the stack is sorted afresh
+        instead of inserting each frame separately.
+
+        Parameters
+        ----------
+        frames: dict
+            {key: (data, mask, variance, scale, zero)} for each frame that
+            should be in the window, in order (the values for frames that
+            are already in the window are not used, and can be None)
+        """
+        for key in [key for key in self._keys if key not in frames]:
+            self.remove(key)
+        new_keys = [key for key in frames if key not in self]
+        if len(new_keys) > len(self):
+            for key in new_keys:
+                self._store(key, *frames[key])
+            self._sort()
+        else:
+            for key in new_keys:
+                self.add(key, *frames[key])
+        self._keys = list(frames)
+
+    def _sort(self):
+        n = len(self)
+        slots = np.array([self._slots[key] for key in self._keys],
+                         dtype=self._ids.dtype)
+        values = self._data[slots]
+        if self._mask is not None:
+            values[(self._mask[slots] & BAD) > 0] = np.inf
+        order = np.argsort(values, axis=0, kind='stable')
+        self._sorted[:n] = take_along_axis(values, order, axis=0)
+        self._ids[:n] = slots[order]
+
+    def result(self, scale=1., zero=0.):
+        """
+        Combines the frames in the window.
+
+        Parameters
+        ----------
+        scale: float
+            multiplicative factor to apply to the combined data
+        zero: float
+            offset to add to the (scaled) combined data
+
+        Returns
+        -------
+        NDAstroData: the combined frame
+        """
+        n = len(self)
+        values, ids = self._sorted[:n], self._ids[:n]
+        masked = self._mask is not None or self.reject == 'minmax'
+
+        # Range [lo, hi) of sorted values that are combined
+        if self._mask is None:
+            ngood = np.full(values.shape[1:], n)
+        else:
+            ngood = self._ngood.astype(int)
+        if self.reject == 'minmax':
+            if self._mask is None:
+                lo = np.full_like(ngood, int(self.nlow + 0.001))
+                hi = ngood - int(self.nhigh + 0.001)
+            else:
+                lo = (ngood * float(self.nlow) / n + 0.001).astype(int)
+                hi = ngood - (ngood * float(self.nhigh) / n + 0.001).astype(int)
+        else:
+            lo, hi = np.zeros_like(ngood), ngood
+        num_img = hi - lo
+        positions = np.arange(n).reshape((n,) + (1,) * ngood.ndim)
+        used = (positions >= lo) & (positions < hi)
+
+        # Remove the rejected pixels from the running totals. At most
+        # nlow (nhigh) pixels are rejected from the bottom (top)
+        var_sum, flag_counts = self._var_sum, self._flag_counts
+        rejected = ([(np.full_like(lo, j), j < lo)
+                     for j in range(int(self.nlow + 0.001))] +
+                    [(ngood - 1 - j, ngood - 1 - j >= hi)
+                     for j in range(int(self.nhigh + 0.001))])
+        if rejected:
+            var_sum = None if var_sum is None else var_sum.copy()
+            flag_counts = None if flag_counts is None else flag_counts.copy()
+        for index, reject in rejected:
+            slots = take_along_axis(ids, np.clip(index, 0, n - 1), axis=0)
+            if var_sum is not None:
+                var_sum -= np.where(reject, take_along_axis(
+                    self._variance, slots, axis=0), 0)
+            if flag_counts is not None:
+                mask = take_along_axis(self._mask, slots, axis=0)
+                for counts, flag in zip(flag_counts, FLAGS):
+                    counts -= reject & (mask & flag > 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.combine == 'mean':
+                out_data = (np.where(used, values, 0).sum(axis=0, dtype=np.float32)
+                            / num_img).astype(np.float32)
+            elif self.combine == 'median':
+                med_index = num_img // 2
+                index1 = np.clip(lo + np.where(num_img % 2, med_index,
+                                               med_index - 1), 0, n - 1)
+                index2 = np.clip(lo + med_index, 0, n - 1)
+                out_data = ((take_along_axis(values, index1, axis=0) +
+                             take_along_axis(values, index2, axis=0)) / 2)
+            else:
+                index2 = np.clip(lo + (num_img - 1) // 2, 0, n - 1)
+                out_data = take_along_axis(values, index2, axis=0)
+
+            # Variances are calculated as NDStacker's combiners do, with a
+            # factor of pi/2 for a median (Laplace), except when the median
+            # of an odd number of unmasked pixels is a single pixel
+            laplace = self.combine != 'mean'
+            if self._variance is None:
+                out_var = divide0(np.where(used, np.square(values - out_data), 0)
+                                  .sum(axis=0, dtype=np.float32),
+                                  num_img * (num_img - 1))
+            elif self.combine == 'median' and not masked and n % 2:
+                out_var = take_along_axis(
+                    self._variance, take_along_axis(ids, index2, axis=0), axis=0)
+                laplace = False
+            else:
+                out_var = var_sum / num_img / num_img
+            if laplace:
+                out_var = out_var * (0.5 * np.pi)
+
+        if self._mask is None:
+            out_mask = None
+        else:
+            out_mask = np.zeros(ngood.shape, dtype=DQ.datatype)
+            for counts, flag in zip(flag_counts, FLAGS):
+                out_mask[counts > 0] |= flag
+            # Output pixels without any good inputs are combined by
+            # NDStacker, working down the DQ hierarchy
+            bad = ngood == 0
+            if bad.any():
+                slots = [self._slots[key] for key in self._keys]
+                data, mask, variance = NDStacker.combine(
+                    self._data[:, bad][slots], self._mask[:, bad][slots],
+                    None if self._variance is None else
+                    self._variance[:, bad][slots], rejector=self.reject,
+                    combiner=self.combine, **self._rej_args)
+                out_data[bad] = data
+                out_mask[bad] = mask
+                out_var[bad] = variance
+
+        out_data = (out_data * scale + zero).astype(np.float32)
+        ret_value = NDAstroData(out_data, mask=out_mask)
+        ret_value.variance = (out_var * scale * scale).astype(np.float32)
+        return ret_value
+
+
 def sum1d(ndd, x1, x2, proportional_variance=True):
     """
     This function sums the pixels between x1 and x2 of a 1-dimensional
@@ -77,3 +77,52 @@ def test_clipped_mean():
     results = at.clipped_mean(dist)
     expected_values = (6.1, 3.7)
     assert np.allclose(results, expected_values)
+
+def test_running_median():
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(3, 50))
+    runmed = at.running_median(data, size=2)
+    for row, result in zip(data, runmed):
+        np.testing.assert_array_equal(result, at.boxcar(row, np.median, size=2))
+    np.testing.assert_array_equal(at.running_median([1., 5., 3.], size=2),
+                                  [3., 3., 3.])
+    # Not contiguous along the last axis
+    np.testing.assert_array_equal(at.running_median(data.T, size=2),
+                                  at.running_median(data.T.copy(), size=2))
+
+def test_median_fill():
+    from scipy.ndimage import median_filter
+    rng = np.random.RandomState(0)
+    footprint = np.ones((5, 5), dtype=int)
+    footprint[1:4, 1:4] = 0
+    for shape in ((60, 50), (3, 4)):
+        data = rng.normal(size=shape).astype(np.float32)
+        mask = rng.random_sample(shape) < 0.05
+        mask[:6, :7] = True  # bad region in a corner
+        data[rng.random_sample(shape) < 0.02] = np.nan
+        expected, bad = data, mask
+        for i in range(3):
+            expected = np.where(bad, median_filter(expected, footprint=footprint),
+                                expected)
+            bad = median_filter(bad, footprint=footprint)
+        result = at.median_fill(data, mask, footprint, max_iters=3,
+                                chunk_size=10)
+        assert result.dtype == np.float32
+        np.testing.assert_array_equal(result, expected)
+    assert at.median_fill(data, np.zeros_like(mask), footprint) is data
+
+def test_fit_chebyshev():
+    from astropy.modeling import models, fitting
+    rng = np.random.RandomState(0)
+    x = np.arange(10, 510)
+    y = 0.01 * x + 1e-5 * x ** 2 + rng.normal(size=(4, x.size))
+    mask = rng.random_sample(y.shape) < 0.1
+    mask[1, :100] = True  # changes the domain
+    fit = at.fit_chebyshev(x, y, 3, mask=mask)
+    xnew = np.arange(600)
+    fitted = fit(xnew)
+    assert fitted.shape == (4, 600)
+    for yy, mm, result in zip(y, mask, fitted):
+        model = fitting.LinearLSQFitter()(models.Chebyshev1D(degree=3),
+                                          x[~mm], yy[~mm])
+        np.testing.assert_allclose(result, model(xnew), atol=1e-9)
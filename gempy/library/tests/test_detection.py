@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from astropy.wcs import WCS
+from scipy.spatial import cKDTree
+
+from gempy.library import detection
+
+FWHM = 3.
+
+
+@pytest.fixture
+def image():
+    rng = np.random.RandomState(0)
+    ny, nx = 512, 600
+    data = rng.normal(100., 5., size=(ny, nx))
+    yy, xx = np.mgrid[:ny, :nx]
+    sigma = FWHM / np.sqrt(8 * np.log(2))
+
+    xstars = rng.uniform(20, nx - 20, size=40)
+    ystars = rng.uniform(20, ny - 20, size=40)
+    fluxes = rng.uniform(5e3, 5e4, size=40)
+    for x, y, flux in zip(xstars, ystars, fluxes):
+        data += flux / (2 * np.pi * sigma ** 2) * np.exp(
+            -0.5 * ((xx - x) ** 2 + (yy - y) ** 2) / sigma ** 2)
+    # And an extended source
+    data += 30 * np.exp(-np.hypot(xx - 300.5, yy - 250.5) / 6)
+    return data.astype(np.float32), np.array([xstars, ystars, fluxes])
+
+
+def test_estimate_background():
+    yy, xx = np.mgrid[:192, :320]
+    rng = np.random.RandomState(0)
+    data = 50 + 0.05 * xx + rng.normal(0, 2, size=xx.shape)
+    data[100:103, 100:103] = 1e5
+    bkg, rms = detection.estimate_background(data, back_size=32,
+                                             back_filtersize=1)
+    assert bkg.shape == rms.shape == data.shape
+    assert np.mean(abs(bkg - (50 + 0.05 * xx))) < 0.2
+    np.testing.assert_allclose(bkg, 50 + 0.05 * xx, atol=2.)
+    np.testing.assert_allclose(np.median(rms), 2, rtol=0.1)
+
+
+def test_read_filter(tmpdir):
+    filename = str(tmpdir.join('default.conv'))
+    with open(filename, 'w') as f:
+        f.write("CONV NORM\n# 3x3 convolution mask\n1 2 1\n2 4 2\n1 2 1\n")
+    kernel = detection.read_filter(filename)
+    assert kernel.shape == (3, 3)
+    assert kernel.sum() == pytest.approx(1)
+    assert kernel[1, 1] == pytest.approx(0.25)
+
+
+def test_detect_sources(image):
+    data, (xstars, ystars, fluxes) = image
+    mask = np.zeros(data.shape, dtype=np.uint16)
+    mask[250:252, 300] = 2
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.cdelt = [-0.1 / 3600, 0.1 / 3600]
+    wcs.wcs.crval = [120., 30.]
+    wcs.wcs.crpix = [300., 250.]
+
+    objcat, segmap = detection.detect_sources(data, mask=mask, wcs=wcs,
+                                              back_filtersize=3)
+    assert segmap.max() == len(objcat)
+    assert objcat['NUMBER'].tolist() == list(range(1, len(objcat) + 1))
+
+    # Every star found, in the right place (1-indexed) with the right flux
+    dist, index = cKDTree(np.array([objcat['X_IMAGE'] - 1,
+                                    objcat['Y_IMAGE'] - 1]).T).query(
+        np.array([xstars, ystars]).T)
+    isolated = cKDTree(np.array([xstars, ystars]).T).query(
+        np.array([xstars, ystars]).T, k=2)[0][:, 1] > 20
+    assert np.all(dist[isolated] < 0.05)
+    stars = objcat[index[isolated]]
+    np.testing.assert_allclose(stars['FLUX_AUTO'], fluxes[isolated], rtol=0.02)
+    np.testing.assert_allclose(stars['FWHM_IMAGE'], FWHM, rtol=0.2)
+    np.testing.assert_allclose(stars['FWHM_WORLD'] * 3600, 0.1 * FWHM, rtol=0.2)
+    assert np.all(stars['CLASS_STAR'] > 0.8)
+    assert np.all(stars['ELLIPTICITY'] < 0.1)
+    ra, dec = wcs.all_pix2world(xstars[isolated], ystars[isolated], 0)
+    np.testing.assert_allclose(stars['X_WORLD'], ra, atol=1e-6)
+    np.testing.assert_allclose(stars['Y_WORLD'], dec, atol=1e-6)
+
+    galaxy = objcat[np.argmin(np.hypot(objcat['X_IMAGE'] - 301.5,
+                                       objcat['Y_IMAGE'] - 251.5))]
+    assert galaxy['CLASS_STAR'] < 0.5
+    assert galaxy['IMAFLAGS_ISO'] == 2 and galaxy['NIMAFLAGS_ISO'] == 2
+    np.testing.assert_allclose(objcat['BACKGROUND'], 100, atol=1)
+
+    # Using the seeing FWHM to classify the sources
+    class_star = detection.classify_sources(stars, seeing_fwhm=FWHM * 2)
+    assert np.all(class_star < 0.5)
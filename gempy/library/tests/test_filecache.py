@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.table import Table
+
+from gempy.library import filecache
+
+
+@pytest.fixture
+def linelist(tmpdir):
+    filename = str(tmpdir.join('linelist.dat'))
+    with open(filename, 'w') as f:
+        f.write("# wavelength weight\n")
+        for wavelength, weight in ((500., 1), (450., 2), (700., 3), (600., 4)):
+            f.write("{} {}\n".format(wavelength, weight))
+    return filename
+
+
+def test_linelist_cache(linelist, tmpdir):
+    cache = filecache.FileCache()
+    lines = filecache.read_linelist(linelist, cache=cache)
+    np.testing.assert_array_equal(lines.wavelengths, [500, 450, 700, 600])
+    np.testing.assert_array_equal(lines.weights, [1, 2, 3, 4])
+    assert not lines.wavelengths.flags.writeable
+
+    wavelengths, weights = lines.subset(480, 600)
+    np.testing.assert_array_equal(wavelengths, [500, 600])
+    np.testing.assert_array_equal(weights, [1, 4])
+    wavelengths *= 0.1  # a copy, so this is allowed
+
+    assert filecache.read_linelist(linelist, cache=cache).wavelengths is \
+        lines.wavelengths
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Changing the file invalidates the entry
+    with open(linelist, 'a') as f:
+        f.write("800. 5\n")
+    assert len(filecache.read_linelist(linelist, cache=cache)) == 5
+    assert cache.misses == 2
+
+
+def test_linelist_without_weights(tmpdir):
+    filename = str(tmpdir.join('lines.dat'))
+    np.savetxt(filename, [300., 200.])
+    lines = filecache.read_linelist(filename, cache=filecache.FileCache())
+    assert lines.weights is None
+    assert lines.subset(250)[0].tolist() == [300.]
+
+
+def test_sidecar_files(linelist, tmpdir):
+    directory = str(tmpdir.join('cache'))
+    lines = filecache.read_linelist(linelist,
+                                    cache=filecache.FileCache(directory))
+    assert len(os.listdir(directory)) == 1
+
+    def fail(path):
+        raise AssertionError("File should not have been parsed")
+
+    cache = filecache.FileCache(directory)
+    cache.get(linelist, fail, 'linelist')
+    np.testing.assert_array_equal(
+        filecache.read_linelist(linelist, cache=cache).wavelengths,
+        lines.wavelengths)
+
+
+def test_table_cache(tmpdir):
+    filename = str(tmpdir.join('standard.dat'))
+    np.savetxt(filename, [[3000., 12.1, 50.], [3050., 12.3, 50.]])
+
+    def parser(path):
+        tbl = Table.read(path, format='ascii')
+        tbl['col1'].unit = u.AA
+        tbl['col2'].unit = u.mag
+        return tbl
+
+    cache = filecache.FileCache(str(tmpdir.join('cache')))
+    tbl = filecache.read_table(filename, parser, cache=cache)
+    tbl['col1'][0] = 0  # doesn't affect the cache
+
+    for cache in (cache, filecache.FileCache(str(tmpdir.join('cache')))):
+        tbl = filecache.read_table(filename, parser, cache=cache)
+        assert tbl.colnames == ['col1', 'col2', 'col3']
+        assert tbl['col1'].unit == u.AA and tbl['col2'].unit == u.mag
+        np.testing.assert_array_equal(tbl['col1'], [3000., 3050.])
+
+
+def test_atomic_save(tmpdir):
+    filename = str(tmpdir.join('out', 'arr.npy'))
+    assert filecache.atomic_save(filename,
+                                 lambda tmpfile: np.save(tmpfile, [1, 2]))
+    np.testing.assert_array_equal(np.load(filename), [1, 2])
+
+    def fail(tmpfile):
+        with open(tmpfile, 'w') as f:
+            f.write('partial')
+        raise OSError
+
+    assert not filecache.atomic_save(filename, fail)
+    assert os.listdir(str(tmpdir.join('out'))) == ['arr.npy']
+    np.testing.assert_array_equal(np.load(filename), [1, 2])
+
+
+@pytest.mark.parametrize("w1,w2", [(None, None), (450., 600.), (460., None),
+                                   (None, 650.), (800., 900.)])
+def test_linelist_subset_matches_loadtxt(linelist, w1, w2):
+    # The cached list, trimmed, gives what the lines used to be read with
+    arc_lines = np.loadtxt(linelist, usecols=[0])
+    weights = np.loadtxt(linelist, usecols=[1])
+    keep = np.ones_like(arc_lines, dtype=bool)
+    if w1 is not None:
+        keep &= arc_lines >= w1
+    if w2 is not None:
+        keep &= arc_lines <= w2
+
+    lines = filecache.read_linelist(linelist, cache=filecache.FileCache())
+    wavelengths, wts = lines.subset(w1, w2)
+    np.testing.assert_array_equal(wavelengths, arc_lines[keep])
+    np.testing.assert_array_equal(wts, weights[keep])
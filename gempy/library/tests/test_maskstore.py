@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from gempy.library import maskstore
+
+
+@pytest.fixture
+def bpm(tmpdir):
+    filename = str(tmpdir.join('bpm.fits'))
+    data = np.zeros((20, 10), dtype=np.int32)
+    data[5, :] = 1
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.ImageHDU(data=data, name='SCI'),
+                  fits.ImageHDU(data=data[::-1], name='SCI')]).writeto(filename)
+    return filename
+
+
+def test_mask_store(bpm):
+    store = maskstore.MaskStore()
+    ad = maskstore.read_mask(bpm, store=store)
+    assert len(ad) == 2
+    for ext in ad:
+        assert ext.data.dtype == np.uint16
+        assert not ext.data.flags.writeable
+    np.testing.assert_array_equal(ad[0].data[5], 1)
+    np.testing.assert_array_equal(ad[1].data[14], 1)
+
+    assert maskstore.read_mask(bpm, store=store) is ad
+    assert (store.hits, store.misses) == (1, 1)
+
+    # Changing the file invalidates the entry
+    with fits.open(bpm, mode='update') as hdulist:
+        hdulist[1].data[0, 0] = 2
+    ad = maskstore.read_mask(bpm, store=store)
+    assert ad[0].data[0, 0] == 2
+    assert store.misses == 2
+
+
+def test_memory_mapped_masks(bpm, tmpdir):
+    directory = str(tmpdir.join('masks'))
+    ad = maskstore.read_mask(bpm, store=maskstore.MaskStore(directory))
+    assert len(os.listdir(directory)) == 2
+
+    # Another process would map the same files
+    ad2 = maskstore.read_mask(bpm, store=maskstore.MaskStore(directory))
+    assert len(os.listdir(directory)) == 2
+    for ext, ext2 in zip(ad, ad2):
+        assert isinstance(ext2.data.base, np.memmap)
+        assert not ext2.data.flags.writeable
+        np.testing.assert_array_equal(ext.data, ext2.data)
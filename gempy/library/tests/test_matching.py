@@ -11,6 +11,7 @@ import numpy as np
 import pytest
 
 from astropy.modeling import models
+from scipy import spatial
 from gempy.library import matching, astromodels
 from gempy.library.transform import Transform
 
@@ -51,6 +52,36 @@ def test_KDTreeFitter_can_fit_a_chebyshev1d_function(chebyshev1d):
     np.testing.assert_allclose(fitted_model.parameters, chebyshev1d.parameters, atol=1)
 
 
+@pytest.mark.parametrize('k', [1, 3])
+def test_KDTreeFitter_batch_statistic(k):
+    rng = np.random.RandomState(SEED)
+    xin = (rng.uniform(0, 100, 30), rng.uniform(0, 100, 30))
+    xref = (xin[0] + 1.5, xin[1] - 2)
+    in_weights = rng.uniform(1, 2, 30)
+    model = models.Shift(0) & models.Shift(0)
+    params = rng.normal(scale=2, size=(10, 2))
+    params[3] = (1.5, -2)
+
+    fitter = matching.KDTreeFitter(sigma=1, k=k)
+    stats = fitter.batch_statistic(model, params, xin, xref,
+                                   in_weights=in_weights)
+    assert np.argmin(stats) == 3
+    assert model.parameters.tolist() == [0, 0]
+
+    ref_weights = np.append(np.ones(30), 0)
+    tree = spatial.cKDTree(np.array(xref).T)
+    for p, stat in zip(params, stats):
+        model.parameters = p
+        dist, idx = tree.query(np.array(model(*xin)).T, k=k,
+                               distance_upper_bound=fitter.maxsep)
+        expected = sum(w * ref_weights[i] * np.exp(-0.5 * d * d)
+                       for w, dd, ii in zip(in_weights, dist, idx)
+                       for d, i in zip(np.atleast_1d(dd), np.atleast_1d(ii)))
+        np.testing.assert_allclose(stat, -expected)
+        np.testing.assert_allclose(
+            fitter._kdstat(tree, model, xin, in_weights, ref_weights), stat)
+
+
 @pytest.fixture
 def make_catalog():
     np.random.seed(SEED)
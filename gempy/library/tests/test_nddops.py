@@ -1,6 +1,6 @@
 import numpy as np
 import pytest
-from gempy.library.nddops import NDStacker, sum1d
+from gempy.library.nddops import NDStacker, SlidingStacker, sum1d
 from geminidr.gemini.lookups import DQ_definitions as DQ
 from astrodata import NDAstroData
 
@@ -45,6 +45,35 @@ def test_varclip():
     np.testing.assert_array_equal(result.mask, [0])
 
 
+
+@pytest.mark.parametrize('combine', SlidingStacker.combiners)
+@pytest.mark.parametrize('reject', SlidingStacker.rejectors)
+def test_sliding_stacker(combine, reject):
+    rng = np.random.RandomState(0)
+    frames = []
+    for i in range(8):
+        ndd = NDAstroData(rng.normal(100, 10, size=(20, 30)).astype(np.float32))
+        ndd.mask = np.where(rng.random_sample(ndd.shape) < 0.2, DQ.bad_pixel,
+                            0).astype(DQ.datatype)
+        ndd.mask[rng.random_sample(ndd.shape) < 0.1] |= DQ.saturated
+        ndd.mask[:2, :2] = DQ.cosmic_ray  # no good pixels here
+        ndd.variance = rng.uniform(1, 2, size=ndd.shape).astype(np.float32)
+        frames.append(ndd)
+
+    stacker = SlidingStacker(5, combine=combine, reject=reject, nlow=1, nhigh=1)
+    reference = NDStacker(combine=combine, reject=reject, nlow=1, nhigh=1)
+    for window in ([0, 1, 2, 3, 4], [1, 2, 3, 4, 5], [3, 4, 5, 6],
+                   [4, 5, 6, 7], [0, 7, 6]):
+        stacker.update({i: (frames[i].data, frames[i].mask,
+                            frames[i].variance, 0.5, 1.) for i in window})
+        result = stacker.result(scale=2., zero=-2.)
+        expected = reference([frames[i] for i in window])
+        np.testing.assert_allclose(result.data, expected.data, rtol=1e-6)
+        np.testing.assert_allclose(result.variance, expected.variance,
+                                   rtol=1e-5)
+        np.testing.assert_array_equal(result.mask, expected.mask)
+
+
 @pytest.mark.xfail(reason='review this')
 def test_sum1d():
     big_value = 10
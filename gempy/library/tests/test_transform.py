@@ -1,12 +1,106 @@
 import pytest
 
 import numpy as np
+from astropy.modeling import models
+from astrodata.nddata import NDAstroData
 from geminidr.gmos.primitives_gmos_image import GMOSImage
+from geminidr.gemini.lookups import DQ_definitions as DQ
 from gempy.library import transform
 
 # Star locations: Use unique y values to enable sorting
 GMOS_STAR_LOCATIONS = ((200, 50), (204, 450), (4000, 50), (4004, 450))
 
+
+@pytest.mark.parametrize('order', [0, 1])
+@pytest.mark.parametrize('subsample', [1, 2])
+@pytest.mark.parametrize('chunk_size', [37, 2**20])
+@pytest.mark.parametrize('threshold', [0.01, 0.5])
+@pytest.mark.parametrize('model', [
+    (models.Shift(1.3) & models.Shift(-2.7)) | models.Rotation2D(3.),
+    models.Shift(0.5) & models.Shift(-0.25)])
+def test_bitmask_transform_matches_bit_by_bit(monkeypatch, order, subsample,
+                                              chunk_size, threshold, model):
+    monkeypatch.setattr(transform, 'COORDINATE_CHUNK_SIZE', chunk_size)
+    rng = np.random.RandomState(0)
+    mask = np.zeros((50, 60), dtype=DQ.datatype)
+    for bit in (DQ.bad_pixel, DQ.saturated, DQ.cosmic_ray, DQ.no_data):
+        mask |= (rng.random_sample(mask.shape) < 0.05).astype(DQ.datatype) * bit
+    mask[:, :20] |= DQ.unilluminated
+    nd = NDAstroData(np.zeros(mask.shape, dtype=np.float32), mask=mask)
+
+    def transform_mask():
+        dg = transform.DataGroup([nd], [transform.Transform(model)])
+        dg.no_data['mask'] = DQ.no_data
+        return dg.transform(attributes=['mask'], order=order,
+                            subsample=subsample, threshold=threshold)['mask']
+
+    result = transform_mask()
+
+    # Transform each bit separately with ndimage
+    def bit_by_bit(self, input_array, mapping, output_key, output_shape,
+                   bits, cval=0, threshold=0.01, **kwargs):
+        out_array = np.zeros(output_shape, dtype=input_array.dtype)
+        for bit in bits:
+            self._apply_geometric_transform(
+                input_array & bit, mapping, 'bit', output_shape,
+                cval=bit & cval, threshold=threshold*bit, **kwargs)
+            out_array[self.output_arrays.pop('bit')] |= bit
+        self.output_arrays[output_key] = out_array
+
+    monkeypatch.setattr(transform.DataGroup, '_transform_bitmask', bit_by_bit)
+    np.testing.assert_array_equal(result, transform_mask())
+
+
+def test_parallel_transform_matches_serial(monkeypatch):
+    monkeypatch.setenv('_GEM_REDUCE_WORKERS', '3')
+    rng = np.random.RandomState(0)
+    nds = [NDAstroData(rng.random_sample((40, 30)).astype(np.float32),
+                       mask=(rng.random_sample((40, 30)) * 8).astype(DQ.datatype))
+           for _ in range(4)]
+    models_ = [models.Shift(0.4 + 35 * i) & models.Shift(0.7)
+               for i in range(len(nds))]
+
+    def transform_all(parallel):
+        dg = transform.DataGroup(nds, [transform.Transform(m)
+                                       for m in models_])
+        dg.no_data['mask'] = DQ.no_data
+        return dg.transform(attributes=['data', 'mask'], parallel=parallel)
+
+    serial, parallel = transform_all(False), transform_all(True)
+    for attr in ('data', 'mask'):
+        np.testing.assert_array_equal(serial[attr], parallel[attr])
+
+
+def test_geomap_cache(monkeypatch, tmpdir):
+    def model(c0_0=0.5):
+        return ((models.Shift(1.3) & models.Shift(-2.7)) |
+                models.Mapping((0, 1, 0, 1)) |
+                (models.Chebyshev2D(2, 2, c0_0=c0_0, c1_0=30) &
+                 models.Polynomial2D(1, c0_1=1.01)))
+
+    cache = transform.GeoMapCache(directory=str(tmpdir))
+    monkeypatch.setattr(transform, 'geomap_cache', cache)
+
+    geomap = transform.GeoMap(model(), (20, 30), inverse=True)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert not geomap.coords.flags.writeable
+
+    # Same geometry, different Model instances
+    assert transform.GeoMap(model(), (20, 30), inverse=True).coords is geomap.coords
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    transform.GeoMap(model(c0_0=1), (20, 30), inverse=True)
+    transform.GeoMap(model(), (20, 31), inverse=True)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # Reload from disk
+    cache.clear()
+    coords = transform.GeoMap(model(), (20, 30), inverse=True).coords
+    assert cache.hits == 2
+    assert isinstance(coords, np.memmap)
+    np.testing.assert_array_equal(coords, geomap.coords)
+
+
 astrofaker = pytest.importorskip("astrofaker")
 
 
@@ -14,6 +14,8 @@ Classes:
                a transformation from one set of coordinates to another
     GeoMap: a callable object that accepts coordinates and returns
             geometrically-transformed coordinates
+    GeoMapCache: a cache of the coordinate arrays of GeoMaps, so that
+                 the same transformation is only evaluated once
     DataGroup: a collection of array-like objects and transforms that will be
                combined into a single output (more precisely, a single output
                per attribute)
@@ -25,10 +27,19 @@ Functions:
 """
 import numpy as np
 import copy
+import hashlib
+import os
+import re
+import threading
 from functools import reduce
-from collections import namedtuple
-
-from astropy.modeling import models, Model
+from itertools import product
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED
+
+from astropy.modeling import models, Model, Parameter
+from astropy.modeling.core import CompoundModel
+from astropy.modeling.polynomial import PolynomialBase
 from astropy.modeling.core import _model_oper
 from astropy import table
 from astropy.wcs import WCS
@@ -37,16 +48,20 @@ from scipy import ndimage
 from gempy.library import astrotools as at
 from gempy.gemini import gemini_tools as gt
 
-import multiprocessing as multi
 from geminidr.gemini.lookups import DQ_definitions as DQ
 
 import astrodata, gemini_instruments
 
 from .astromodels import Rotate2D, Shift2D, Scale2D
 from ..utils import logutils
+from recipe_system.config import get_workers
 
 AffineMatrices = namedtuple("AffineMatrices", "matrix offset")
 
+# Number of output pixels whose input coordinates are computed at a time
+# when transforming bitmasks (each one takes about 8*(ndim+2**ndim) bytes)
+COORDINATE_CHUNK_SIZE = 2**20
+
 # Table attribute names that should be modified to represent the
 # coordinates in the Block, not their individual arrays.
 # NB. Standard python ordering!
@@ -768,6 +783,174 @@ class Transform:
         return transform
 #----------------------------------------------------------------------------------
 
+# Instance attributes of astropy Models that don't affect their evaluation
+# (parameter values are taken from the "_parameters" array)
+_IGNORED_MODEL_ATTRIBUTES = {'_inputs', '_outputs', '_name', '_mconstraints',
+                             '_param_metrics', '_param_names', '_parameters',
+                             '_input_units_strict', '_user_inverse',
+                             '_input_units_allow_dimensionless',
+                             '_user_bounding_box', '_bounding_box',
+                             '_default_domain_window'}
+
+
+def _value_signature(value):
+    """Hashable representation of a model attribute, or TypeError"""
+    if value is None or isinstance(value, (bool, int, float, complex, str,
+                                           np.number, np.bool_)):
+        return repr(value)
+    elif isinstance(value, (tuple, list)):
+        return tuple(_value_signature(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _value_signature(v)) for k, v in value.items()))
+    elif isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+        return (value.dtype.str, value.shape,
+                hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest())
+    raise TypeError("Cannot represent {}".format(type(value).__name__))
+
+
+def model_signature(model):
+    """
+    Returns a hashable representation of everything that determines the
+    result of evaluating a Model or Transform (its structure, parameter
+    values, and other attributes such as polynomial domains).
+
+    Parameters
+    ----------
+    model: Model/Transform
+        the transformation
+
+    Returns
+    -------
+    tuple/None: the signature, or None if one can't be constructed (e.g.,
+                if the model has attributes of unknown types)
+    """
+    try:
+        if isinstance(model, Transform):
+            return ('Transform',) + tuple(model_signature(m) for m in model)
+        elif isinstance(model, CompoundModel):
+            left, right = model_signature(model.left), model_signature(model.right)
+            if left is None or right is None:
+                return
+            return (model.op, left, right)
+        elif not isinstance(model, Model):
+            return
+
+        signature = [type(model).__module__, type(model).__qualname__,
+                     _value_signature(model.parameters)]
+        for attr, value in sorted(vars(model).items()):
+            if (attr in _IGNORED_MODEL_ATTRIBUTES or
+                    isinstance(value, Parameter) or
+                    # Workspace arrays from the last evaluation
+                    (isinstance(model, PolynomialBase) and
+                     re.match(r'r\d+$', attr))):
+                continue
+            signature.append((attr, _value_signature(value)))
+        return tuple(signature)
+    except TypeError:
+        return
+
+
+class GeoMapCache:
+    """
+    A cache of the coordinate arrays calculated by GeoMap objects, keyed on
+    the transformation (see `model_signature`) and the output shape, so that
+    all the arrays and frames sharing a geometry only need to evaluate the
+    transformation once. The least recently used entries are evicted when
+    the cache exceeds its memory limit. If a directory is provided, the
+    arrays are also saved there as .npy files, which are memory-mapped when
+    loaded, so they can be reused by later reductions.
+
+    Parameters
+    ----------
+    max_bytes: int
+        maximum size of the arrays held in memory
+    directory: str/None
+        directory where the arrays are saved (None means not to save them)
+    """
+    def __init__(self, max_bytes=2**30, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    @staticmethod
+    def key(transform, shape):
+        """Returns the cache key, or None if the transform can't be cached"""
+        signature = model_signature(transform)
+        if signature is not None:
+            return hashlib.sha1(repr((signature, tuple(shape))).encode()).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, 'geomap_{}.npy'.format(key))
+
+    def get(self, key):
+        """Returns the (read-only) coordinates array, or None"""
+        with self._lock:
+            try:
+                coords = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return coords
+
+        coords = None
+        if self.directory is not None:
+            try:
+                coords = np.load(self._filename(key), mmap_mode='r')
+            except (OSError, ValueError):
+                pass
+        if coords is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._store(key, coords)
+        return coords
+
+    def put(self, key, coords):
+        """Adds a coordinates array to the cache and returns a read-only
+        version of it"""
+        coords = np.asarray(coords)
+        coords.setflags(write=False)
+        if self.directory is not None:
+            filename = self._filename(key)
+            tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(tmpname, 'wb') as fileobj:
+                    np.save(fileobj, coords)
+                os.replace(tmpname, filename)
+            except OSError:
+                pass
+        self._store(key, coords)
+        return coords
+
+    def _store(self, key, coords):
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = coords
+                self._nbytes += coords.nbytes
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+
+# Shared by all the GeoMaps (and hence by all the frames and attributes
+# transformed with the same geometry)
+geomap_cache = GeoMapCache()
+
+
 class GeoMap:
     """
     Class to store ndim mapping arrays (one for each axis) indicating the
@@ -777,6 +960,9 @@ class GeoMap:
     the affinity() function describing how good the affine approximation is
     (although this is not yet used in the codebase).
 
+    The coordinates are stored in (and retrieved from) the module's
+    `geomap_cache`, so they are read-only.
+
     Parameters
     ----------
     transform: Transform/Model
@@ -786,16 +972,23 @@ class GeoMap:
     inverse: bool
         if True, then the transform is already the output->input transform,
         and doesn't need to be inverted
+    cache: bool
+        use the cache of coordinate arrays?
     """
-    def __init__(self, transform, shape, inverse=False):
-        # X then Y (for Transform)
-        grids = np.meshgrid(*(np.arange(length) for length in shape[::-1]))
+    def __init__(self, transform, shape, inverse=False, cache=True):
         self._transform = transform if inverse else transform.inverse
         self._shape = shape
-        transformed = (self._transform(*grids)[::-1] if len(shape) > 1
-                       else self._transform(grids))
-        #self.coords = [coord.astype(np.float32) for coord in transformed]
-        self.coords = transformed
+        key = GeoMapCache.key(self._transform, shape) if cache else None
+        coords = None if key is None else geomap_cache.get(key)
+        if coords is None:
+            # X then Y (for Transform)
+            grids = np.meshgrid(*(np.arange(length) for length in shape[::-1]))
+            transformed = (self._transform(*grids)[::-1] if len(shape) > 1
+                           else self._transform(grids))
+            coords = np.asarray(transformed)
+            if key is not None:
+                coords = geomap_cache.put(key, coords)
+        self.coords = coords
 
     def affinity(self):
         """
@@ -939,7 +1132,8 @@ class DataGroup:
         array. The inputs, after transforming, shouldn't interfere with each
         other (i.e., no output pixel should have signal from more than one
         input object). Bit-masks (identified as being arrays of unsigned
-        integer type) are transformed bit-by-bit. If an attribute's name is a
+        integer type) are transformed bit-by-bit (for order<=1, all the bits
+        are interpolated together). If an attribute's name is a
         key in the no_data dict, then that value is used to represent empty
         regions in the output array of this attribute.
 
@@ -957,164 +1151,165 @@ class DataGroup:
         conserve: bool
             conserve flux by applying Jacobian?
         parallel: bool
-            perform operations in parallel using multiprocessing?
+            perform operations in parallel using a pool of threads? The
+            number of threads is set by the reduce configuration (see
+            `recipe_system.config.get_workers`)
 
         Returns
         -------
         dict: {key: array} of arrays containing the transformed attributes
         """
-        if parallel:
-            processes = []
-            process_keys = []
-            manager = multi.Manager()
-            self.output_arrays = manager.dict()
-        else:
-            self.output_arrays = {}
-
+        self.output_arrays = {}
         if self.output_shape is None:
             self.calculate_output_shape()
 
         self.corners = []
         self.jfactors = []
 
-        for input_array, transform in zip(self._arrays, self._transforms):
-            # Since this may be modified, deepcopy to preserve the one if
-            # the DataGroup's _transforms list
-            transform = copy.deepcopy(transform)
-            if self.origin:
-                transform.append(reduce(Model.__and__,
-                                 [models.Shift(-offset) for offset in self.origin[::-1]]))
-            output_corners = self._prepare_for_output(input_array,
-                                                      transform, subsample)
-            output_array_shape = tuple(max_ - min_ for min_, max_ in output_corners)
-
-            # This can happen if the origin and/or output_shape are modified
-            if not all(length > 0 for length in output_array_shape):
-                self.log.stdinfo("Array falls outside output region")
-                continue
-
-            # Create a mapping from output pixel to input pixels
-            mapping = transform.inverse.affine_matrices(shape=output_array_shape)
-            jfactor = abs(np.linalg.det(mapping.matrix)) if conserve else 1.0
-            self.jfactors.append(jfactor)
-
-            integer_shift = (transform.is_affine
-                and np.array_equal(mapping.matrix, np.eye(mapping.matrix.ndim)) and
-                                 np.array_equal(mapping.offset, mapping.offset.astype(int)))
-
-            if not integer_shift:
-                ndim = transform.ndim
-                # Apply scale and shift for subsampling. Recall that (0,0) is the middle of
-                # the pixel, not the corner, so a shift is required as well.
-                if subsample > 1:
-                    rescale = reduce(Model.__and__, [models.Scale(subsample)] * ndim)
-                    rescale_shift = reduce(Model.__and__, [models.Shift(0.5 * (subsample - 1))] * ndim)
-                    transform.append([rescale, rescale_shift])
-
-                trans_output_shape = tuple(length * subsample for length in output_array_shape)
-                if transform.inverse.is_affine:
-                    mapping = transform.inverse.affine_matrices(shape=trans_output_shape)
-                else:
-                    # If we're conserving the flux, we need to compute the
-                    # Jacobian at every input point. This is done by numerical
-                    # derivatives so expand the output pixel grid.
-                    if conserve:
-                        jacobian_shape = tuple(length + 2 for length in trans_output_shape)
-                        transform.append(reduce(Model.__and__, [models.Shift(1)] * ndim))
-
-                        # These are the coordinates in the input frame corresponding to each
-                        # (subsampled) output pixel in a frame with an additional 1-pixel boundary
-                        jacobian_mapping = GeoMap(transform, jacobian_shape)
-                        det_matrices = np.empty((ndim, ndim, np.multiply.reduce(trans_output_shape)))
-                        for num_axis in range(ndim):
-                            coords = jacobian_mapping.coords[num_axis]
-                            for denom_axis in range(ndim):
-                                diff_coords = coords - np.roll(coords, 2, axis=denom_axis)
-                                slice_ = [slice(1, -1)] * ndim
-                                slice_[denom_axis] = slice(2, None)
-                                # Account for the fact that we are measuring
-                                # differences in the subsampled plane
-                                det_matrices[num_axis, denom_axis] = 2. / (
-                                    diff_coords[tuple(slice_)].flatten() * subsample)
-                        jfactor = 1. / abs(np.linalg.det(np.moveaxis(det_matrices, -1, 0))).reshape(trans_output_shape)
-                        # Delete the extra Shift(1) and put a better jfactor in the list
-                        del transform[-1]
-                        self.jfactors[-1] = np.mean(jfactor)
-                    mapping = GeoMap(transform, trans_output_shape)
-
-            for attr in attributes:
-                if isinstance(input_array, np.ndarray) and attr == "data":
-                    arr = input_array
-                else:  # let this raise an AttributeError
-                    arr = getattr(input_array, attr)
-
-                # Create an output array if we haven't seen this attribute yet.
-                # We only do this now so that we know the dtype.
-                cval = self.no_data.get(attr, 0)
-                if attr not in self.output_dict:
-                    self.output_dict[attr] = np.full(self.output_shape, cval, dtype=arr.dtype)
-
-                # Integer shifts mean the output will be unchanged by the
-                # transform, so we can put it straight in the output, since
-                # only this array will map into the region.
-                #
-                # The origin and output_shape may have been set in order to
-                # only transform some of the input image into the final output
-                # array, so we need to account for that (with slice_2)
-                if integer_shift:
-                    self.log.debug("Placing {} array in [".format(attr) +
-                                   ",".join(["{}:{}".format(limits[0] + 1, limits[1])
-                                             for limits in output_corners[::-1]]) + "]")
-                    slice_ = tuple(slice(min_, max_) for min_, max_ in output_corners)
-                    slice_2 = tuple(slice(int(offset), int(offset) + max_ - min_)
-                                    for offset, (min_, max_) in zip(mapping.offset, output_corners))
-                    self.output_dict[attr][slice_] = arr[slice_2]
+        # The executor only starts threads when jobs are submitted to it,
+        # so it costs nothing if we're not running in parallel
+        max_workers = get_workers() if parallel else 1
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for input_array, transform in zip(self._arrays, self._transforms):
+                # Since this may be modified, deepcopy to preserve the one if
+                # the DataGroup's _transforms list
+                transform = copy.deepcopy(transform)
+                if self.origin:
+                    transform.append(reduce(Model.__and__,
+                                     [models.Shift(-offset) for offset in self.origin[::-1]]))
+                output_corners = self._prepare_for_output(input_array,
+                                                          transform, subsample)
+                output_array_shape = tuple(max_ - min_ for min_, max_ in output_corners)
+
+                # This can happen if the origin and/or output_shape are modified
+                if not all(length > 0 for length in output_array_shape):
+                    self.log.stdinfo("Array falls outside output region")
                     continue
 
-                # Set up the functions to call to transform this attribute
-                jobs = []
-                if np.issubdtype(arr.dtype, np.unsignedinteger):
-                    for j in range(0, 16):
-                        bit = 2**j
-                        if bit == cval or np.sum(arr & bit) > 0:
-                            key = ((attr,bit), output_corners)
-                            jobs.append((key, arr & bit, {'cval': bit & cval,
-                                                          'threshold': threshold*bit}))
-                else:
-                    key = (attr, output_corners)
-                    jobs.append((key, arr, {}))
-
-                # Perform the jobs (in parallel, if we can)
-                for (key, arr, kwargs) in jobs:
-                    args = (arr, mapping, key, output_array_shape)
-                    kwargs.update({'dtype': self.output_dict[attr].dtype,
-                                   'order': order,
-                                   'subsample': subsample,
-                                   'jfactor': jfactor})
-                    if parallel:
-                        p = multi.Process(target=self._apply_geometric_transform,
-                                          args=args, kwargs=kwargs)
-                        processes.append(p)
-                        process_keys.append(key)
-                        p.start()
+                # Create a mapping from output pixel to input pixels
+                mapping = transform.inverse.affine_matrices(shape=output_array_shape)
+                jfactor = abs(np.linalg.det(mapping.matrix)) if conserve else 1.0
+                self.jfactors.append(jfactor)
+
+                integer_shift = (transform.is_affine
+                    and np.array_equal(mapping.matrix, np.eye(mapping.matrix.ndim)) and
+                                     np.array_equal(mapping.offset, mapping.offset.astype(int)))
+
+                if not integer_shift:
+                    ndim = transform.ndim
+                    # Apply scale and shift for subsampling. Recall that (0,0) is the middle of
+                    # the pixel, not the corner, so a shift is required as well.
+                    if subsample > 1:
+                        rescale = reduce(Model.__and__, [models.Scale(subsample)] * ndim)
+                        rescale_shift = reduce(Model.__and__, [models.Shift(0.5 * (subsample - 1))] * ndim)
+                        transform.append([rescale, rescale_shift])
+
+                    trans_output_shape = tuple(length * subsample for length in output_array_shape)
+                    if transform.inverse.is_affine:
+                        mapping = transform.inverse.affine_matrices(shape=trans_output_shape)
                     else:
-                        self._apply_geometric_transform(*args, **kwargs)
-                        self._add_to_output(key)
-
-        # If we're in parallel, we need to place the outputs into the final
-        # arrays as they finish. This should avoid hogging memory. Note that if
-        # we've applied integer shifts, the processes list will be empty so this
-        # will pass through quickly.
-        if parallel:
-            finished = False
-            while not finished:
-                finished = True
-                for p, key in zip(processes, process_keys):
-                    if not p.is_alive():
-                        if key in self.output_arrays:
-                            self._add_to_output(key)
+                        # If we're conserving the flux, we need to compute the
+                        # Jacobian at every input point. This is done by numerical
+                        # derivatives so expand the output pixel grid.
+                        if conserve:
+                            jacobian_shape = tuple(length + 2 for length in trans_output_shape)
+                            transform.append(reduce(Model.__and__, [models.Shift(1)] * ndim))
+
+                            # These are the coordinates in the input frame corresponding to each
+                            # (subsampled) output pixel in a frame with an additional 1-pixel boundary
+                            jacobian_mapping = GeoMap(transform, jacobian_shape)
+                            det_matrices = np.empty((ndim, ndim, np.multiply.reduce(trans_output_shape)))
+                            for num_axis in range(ndim):
+                                coords = jacobian_mapping.coords[num_axis]
+                                for denom_axis in range(ndim):
+                                    diff_coords = coords - np.roll(coords, 2, axis=denom_axis)
+                                    slice_ = [slice(1, -1)] * ndim
+                                    slice_[denom_axis] = slice(2, None)
+                                    # Account for the fact that we are measuring
+                                    # differences in the subsampled plane
+                                    det_matrices[num_axis, denom_axis] = 2. / (
+                                        diff_coords[tuple(slice_)].flatten() * subsample)
+                            jfactor = 1. / abs(np.linalg.det(np.moveaxis(det_matrices, -1, 0))).reshape(trans_output_shape)
+                            # Delete the extra Shift(1) and put a better jfactor in the list
+                            del transform[-1]
+                            self.jfactors[-1] = np.mean(jfactor)
+                        mapping = GeoMap(transform, trans_output_shape)
+
+                for attr in attributes:
+                    if isinstance(input_array, np.ndarray) and attr == "data":
+                        arr = input_array
+                    else:  # let this raise an AttributeError
+                        arr = getattr(input_array, attr)
+
+                    # Create an output array if we haven't seen this attribute yet.
+                    # We only do this now so that we know the dtype.
+                    cval = self.no_data.get(attr, 0)
+                    if attr not in self.output_dict:
+                        self.output_dict[attr] = np.full(self.output_shape, cval, dtype=arr.dtype)
+
+                    # Integer shifts mean the output will be unchanged by the
+                    # transform, so we can put it straight in the output, since
+                    # only this array will map into the region.
+                    #
+                    # The origin and output_shape may have been set in order to
+                    # only transform some of the input image into the final output
+                    # array, so we need to account for that (with slice_2)
+                    if integer_shift:
+                        self.log.debug("Placing {} array in [".format(attr) +
+                                       ",".join(["{}:{}".format(limits[0] + 1, limits[1])
+                                                 for limits in output_corners[::-1]]) + "]")
+                        slice_ = tuple(slice(min_, max_) for min_, max_ in output_corners)
+                        slice_2 = tuple(slice(int(offset), int(offset) + max_ - min_)
+                                        for offset, (min_, max_) in zip(mapping.offset, output_corners))
+                        self.output_dict[attr][slice_] = arr[slice_2]
+                        continue
+
+                    # Set up the functions to call to transform this attribute
+                    jobs = []
+                    if np.issubdtype(arr.dtype, np.unsignedinteger):
+                        bits = tuple(2**j for j in range(0, 16)
+                                     if 2**j == cval or np.sum(arr & 2**j) > 0)
+                        if order <= 1 and bits:
+                            # With linear or nearest-neighbour interpolation,
+                            # all the bits can be interpolated in one job
+                            key = ((attr, bits), output_corners)
+                            jobs.append((self._transform_bitmask, key, arr,
+                                         {'bits': bits, 'cval': cval,
+                                          'threshold': threshold}))
+                        else:
+                            for bit in bits:
+                                key = ((attr,bit), output_corners)
+                                jobs.append((self._apply_geometric_transform,
+                                             key, arr & bit,
+                                             {'cval': bit & cval,
+                                              'threshold': threshold*bit}))
                     else:
-                        finished = False
+                        key = (attr, output_corners)
+                        jobs.append((self._apply_geometric_transform, key, arr,
+                                     {'dtype': self.output_dict[attr].dtype}))
+
+                    # Perform the jobs (in parallel, if we can)
+                    for (function, key, arr, kwargs) in jobs:
+                        args = (arr, mapping, key, output_array_shape)
+                        kwargs.update({'order': order,
+                                       'subsample': subsample,
+                                       'jfactor': jfactor})
+                        if parallel:
+                            # Don't let too many finished arrays pile up
+                            if len(pending) >= 2 * max_workers:
+                                self._place_completed(pending, FIRST_COMPLETED)
+                            future = executor.submit(function, *args, **kwargs)
+                            pending[future] = key
+                        else:
+                            function(*args, **kwargs)
+                            self._add_to_output(key)
+
+            # If we're in parallel, place the outputs of the remaining jobs
+            # into the final arrays. Note that if we've applied integer
+            # shifts, there will be no jobs so this will pass through quickly.
+            if parallel:
+                self._place_completed(pending, ALL_COMPLETED)
 
         del self.output_arrays
         return self.output_dict
@@ -1185,7 +1380,14 @@ class DataGroup:
             # This is ugly! The DQ.no_data bit should only be set if all arrays
             # have the bit set (and-like), but the other bits combine or-like
             cval = self.no_data.get(attr[0], 0)
-            if attr[1] != cval:
+            if isinstance(attr[1], tuple):  # several bits, already in place
+                if cval in attr[1]:
+                    self.output_dict[attr[0]][slice_] = ((output_region & (65535 ^ cval)) |
+                                                    (output_region & arr & cval) |
+                                                    (arr & (65535 ^ cval))).astype(dtype)
+                else:
+                    output_region |= arr.astype(dtype)
+            elif attr[1] != cval:
                 output_region |= (arr * attr[1]).astype(dtype)
             else:
                 self.output_dict[attr[0]][slice_] = ((output_region & (65535 ^ cval)) |
@@ -1194,13 +1396,202 @@ class DataGroup:
             self.output_dict[attr][slice_] += arr
         del self.output_arrays[key]
 
+    def _place_completed(self, pending, return_when):
+        """
+        Waits for jobs submitted to the thread pool to finish and adds their
+        outputs to the final arrays. This is done in the calling thread so
+        that the output arrays are only modified by one thread.
+
+        Parameters
+        ----------
+        pending: dict
+            {future: key} for the jobs that have not been placed yet;
+            entries are removed as their outputs are placed
+        return_when: str
+            FIRST_COMPLETED or ALL_COMPLETED, as for `concurrent.futures.wait`
+        """
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            future.result()  # re-raises any exception from the job
+            self._add_to_output(pending.pop(future))
+
+    @staticmethod
+    def _output_coordinates(mapping, shape, rows):
+        """
+        Returns the coordinates in the input frame of the pixels in some rows
+        of an output array, as a (ndim, npix) array. For affine mappings,
+        these are computed in the same way as by ndimage.affine_transform().
+
+        Parameters
+        ----------
+        mapping: AffineMatrices/GeoMap
+            transformation from output -> input coordinates
+        shape: tuple
+            shape of the output array
+        rows: slice
+            range of the output array along its first axis
+
+        Returns
+        -------
+        ndarray: coordinates of each output pixel (standard python order)
+        """
+        ndim = len(shape)
+        if isinstance(mapping, GeoMap):
+            return np.asarray(mapping.coords)[:, rows].reshape(ndim, -1).astype(
+                np.float64, copy=False)
+
+        grid = [np.arange(length, dtype=np.float64).reshape(
+            [-1 if i == axis else 1 for i in range(ndim)])
+            for axis, length in enumerate(shape)]
+        grid[0] = grid[0][rows]
+        coords = np.empty((ndim, grid[0].size * int(np.prod(shape[1:]))))
+        for axis, (row, offset) in enumerate(zip(mapping.matrix, mapping.offset)):
+            coord = grid[0] * row[0]
+            for j in range(1, ndim):
+                coord = coord + grid[j] * row[j]
+            coords[axis] = (coord + offset).ravel()
+        return coords
+
+    def _transform_bitmask(self, input_array, mapping, output_key,
+                           output_shape, bits, cval=0, threshold=0.01,
+                           subsample=1, order=1, jfactor=1):
+        """
+        None-returning function to transform several bits of a bitmask with
+        nearest-neighbour or linear interpolation, so it can be run in a
+        thread pool. The result is the same as transforming each bit with
+        _apply_geometric_transform() (with a cval of bit&cval and a threshold
+        of threshold*bit), but the input coordinates, neighbouring pixels and
+        interpolation weights of each output pixel are only computed once and
+        shared by all the bits. The arithmetic follows that of
+        ndimage.map_coordinates(), so the results are identical.
+
+        Parameters
+        ----------
+        input_array: ndarray
+            bitmask to be transformed
+        mapping: AffineMatrices/GeoMap
+            transformation from output -> input coordinates
+        output_key;
+            key in output_arrays dict to use when storing this output array
+        output_shape: tuple
+            shape of this output array
+        bits: sequence
+            bits to transform
+        cval: int
+            value for "empty" pixels in output array
+        threshold: float
+            the fraction that needs to be exceeded for a bit to be set
+        subsample: int
+            subsampling in output array for transformation
+        order: int (0-1)
+            order of spline interpolation
+        jfactor: float/array
+            Jacobian of transformation (basically the increase in pixel area)
+        """
+        all_bits = sum(bits)
+        cval &= all_bits
+        ndim = len(output_shape)
+        trans_output_shape = tuple(length * subsample for length in output_shape)
+        row_size = int(np.prod(trans_output_shape[1:]))
+        # Whole rows of output pixels so that subsampling can be undone
+        # chunk by chunk
+        chunk_rows = max(COORDINATE_CHUNK_SIZE // (row_size * subsample), 1) * subsample
+        input_values = input_array.ravel()
+        strides = [int(np.prod(input_array.shape[axis+1:])) for axis in range(ndim)]
+        out_array = np.zeros(output_shape, dtype=input_array.dtype)
+
+        for row in range(0, trans_output_shape[0], chunk_rows):
+            nrows = min(chunk_rows, trans_output_shape[0] - row)
+            coords = self._output_coordinates(mapping, trans_output_shape,
+                                              slice(row, row + nrows))
+
+            # Output pixels mapping outside the input array are cval
+            inside = np.ones(coords.shape[1], dtype=bool)
+            for coord, length in zip(coords, input_array.shape):
+                inside &= (coord >= 0) & (coord <= length - 1)
+            points = np.flatnonzero(inside)
+            outside = np.flatnonzero(~inside) if cval else None
+            coords = coords[:, points]
+
+            # The input pixels contributing to each output pixel, and their
+            # weights, in the order ndimage.map_coordinates() sums them
+            if order == 0:
+                lower = np.floor(coords + 0.5).astype(np.intp)
+                values = [input_values[sum(index * stride for index, stride
+                                           in zip(lower, strides))]]
+                weights = [np.ones(points.size)]
+            else:
+                lower = np.floor(coords).astype(np.intp)
+                # The upper neighbour of a pixel on the edge has no weight
+                neighbours = [(index * stride,
+                               np.minimum(index + 1, length - 1) * stride)
+                              for index, length, stride in
+                              zip(lower, input_array.shape, strides)]
+                axis_weights = [(1 - fraction, fraction)
+                                for fraction in coords - lower]
+                values, weights = [], []
+                for corner in product((0, 1), repeat=ndim):
+                    values.append(input_values[sum(
+                        neighbours[axis][offset] for axis, offset in enumerate(corner))])
+                    weights.append(reduce(np.multiply, [
+                        axis_weights[axis][offset] for axis, offset in enumerate(corner)]))
+
+            # The weights sum to 1 (to within rounding), so a bit that is set
+            # in all the neighbours is set in the interpolated value, and the
+            # bits only need interpolating where they are set in some of them
+            set_bits = reduce(np.bitwise_and, values) & all_bits
+            some_bits = reduce(np.bitwise_or, values) & all_bits & ~set_bits
+            partial = np.flatnonzero(some_bits)
+            some_bits = some_bits[partial]
+            values = [value[partial] for value in values]
+            weights = [weight[partial] for weight in weights]
+            partial = points[partial]
+
+            out_rows = slice(row // subsample, (row + nrows) // subsample)
+            out_chunk = out_array[out_rows]
+            if subsample > 1:
+                chunk_shape = (nrows,) + trans_output_shape[1:]
+                intermediate_shape = tuple(x for length in out_chunk.shape
+                                           for x in (length, subsample))
+                if not np.isscalar(jfactor):
+                    chunk_jfactor = jfactor[row:row + nrows]
+                else:
+                    chunk_jfactor = jfactor
+            elif threshold < 1:
+                out_chunk.reshape(-1)[points] |= set_bits
+                if cval:
+                    out_chunk.reshape(-1)[outside] |= cval
+
+            for bit in bits:
+                indices = np.flatnonzero(some_bits & bit)
+                fraction = 0.
+                for value, weight in zip(values, weights):
+                    fraction = fraction + weight[indices] * ((value[indices] & bit) > 0)
+                # ndimage rounds interpolated values for integer outputs
+                interpolated = np.floor(bit * fraction + 0.5)
+                if subsample > 1:
+                    bit_array = np.zeros(chunk_shape)
+                    bit_array.reshape(-1)[points] = set_bits & bit
+                    bit_array.reshape(-1)[partial[indices]] = interpolated
+                    if cval & bit:
+                        bit_array.reshape(-1)[outside] = bit
+                    bit_array = (chunk_jfactor * bit_array).reshape(
+                        intermediate_shape).mean(tuple(
+                        range(len(output_shape)*2-1, 0, -2)))
+                    out_chunk[abs(bit_array) > threshold * bit] |= bit
+                else:
+                    out_chunk.reshape(-1)[partial[indices[
+                        interpolated > threshold * bit]]] |= bit
+
+        self.output_arrays[output_key] = out_array
+
     def _apply_geometric_transform(self, input_array, mapping, output_key,
                                    output_shape, cval=0., dtype=np.float32,
                                    threshold=None, subsample=1, order=1,
                                    jfactor=1):
         """
-        None-returning function to apply geometric transform, so it can be used
-        by multiprocessing
+        None-returning function to apply geometric transform, so it can be run
+        in a thread pool
 
         Parameters
         ----------
@@ -1209,7 +1600,7 @@ class DataGroup:
         mapping: callable
             provides transformation from output -> input coordinates
         output_key;
-            key in dict/DictProxy to use when storing this output array
+            key in output_arrays dict to use when storing this output array
         output_shape: tuple
             shape of this output array
         cval: number
@@ -1363,7 +1754,7 @@ class AstroDataGroup(DataGroup):
         conserve: bool
             conserve flux rather than interpolate?
         parallel: bool
-            use parallel processing to speed up operation?
+            use a pool of threads to speed up operation?
         process_objcat: bool
             merge input OBJCATs into output AD instance?
 
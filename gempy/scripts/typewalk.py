@@ -220,7 +220,7 @@ class DataSpider:
                     fname = os.path.join(root, tfile)
 
                     try:
-                        fl = astrodata.open(fname)
+                        fl = astrodata.open(fname, headers_only=True)
                         dtypes = list(fl.tags)
                     except AttributeError:
                         print("     Bad headers in file: {}".format(tfile))
@@ -7,12 +7,25 @@
 import os
 from os.path import abspath, basename, dirname, isdir
 
+import datetime
+import hashlib
+import json
+import pickle
+import time
 import warnings
 from importlib import reload
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
 
+from sqlalchemy import or_, text
+from sqlalchemy.orm import Session, configure_mappers
 from sqlalchemy.exc import SAWarning, OperationalError
 
+import astrodata
+import gemini_instruments
+
 from gemini_calmgr import orm
 from gemini_calmgr.orm import file
 from gemini_calmgr.orm import diskfile
@@ -27,7 +40,7 @@ from gemini_calmgr import gemini_metadata_utils as gmu
 from gempy.utils import logutils
 
 # ------------------------------------------------------------------------------
-__all__ = ['LocalManager', 'LocalManagerError']
+__all__ = ['LocalManager', 'LocalManagerError', 'IngestStats']
 # ------------------------------------------------------------------------------
 log = logutils.get_logger(__name__)
 # ------------------------------------------------------------------------------
@@ -67,7 +80,21 @@ ERROR_CANT_CREATE = 1
 ERROR_CANT_READ = 2
 ERROR_DIDNT_FIND = 3
 
+# Calibration searches are cached, keyed on the request's caltype and tags,
+# and the values of the descriptors that the calibration rules looked up
+# when the search was made (so frames that only differ in descriptors like
+# data_label share the result). The exception is ut_datetime, which every
+# rule uses to pick the closest calibration in time: it is reduced to
+# intervals of this length (in seconds), and all the frames in an interval
+# get the calibrations found for the first one searched. The queries always
+# use the exact descriptors.
+CACHE_TIME_RESOLUTION = 3600
+
+# Number of files registered in a single transaction by ingest_directory
+INGEST_BATCH_SIZE = 200
+
 FileData = namedtuple('FileData', 'name path')
+IngestStats = namedtuple('IngestStats', 'ingested skipped failed nbytes seconds')
 
 
 class LocalManagerError(Exception):
@@ -76,6 +103,92 @@ class LocalManagerError(Exception):
         self.error_type = error_type
 
 
+def _scan_file(path, known_md5=None):
+    """Computes the size, modification time and MD5 checksum of a file and,
+    unless the checksum is `known_md5` (ie, the file hasn't changed since
+    it was ingested), reads its headers into the new database entries that
+    `dbtools.ingest_file` would create for it. Meant to be run by the worker
+    processes of `LocalManager.ingest_directory`, so that the files are read
+    in parallel and the main process only has to insert the entries.
+
+    Returns
+    -------
+    tuple
+        (path, size, mtime, md5, entries, error). `entries` is `None` if
+        the file is unchanged, otherwise the pickled (DiskFile, Header,
+        instrument) entries, the last of which is `None` for instruments
+        without their own table. `error` is `None`, unless there was a
+        problem reading the file, in which case it is a string describing
+        the problem.
+    """
+    try:
+        stat = os.stat(path)
+        # The DiskFile computes the checksum. Its file_id is set on insert
+        new_diskfile = diskfile.DiskFile(SimpleNamespace(id=None),
+                                         basename(path), dirname(path))
+        md5 = new_diskfile.file_md5
+        entries = None
+        if md5 != known_md5:
+            ad = astrodata.open(path)
+            header = dbtools.Header(SimpleNamespace(id=None, ad_object=ad))
+            try:
+                instrument = dbtools.instrument_table[header.instrument][1](
+                    header, ad)
+            except KeyError:
+                instrument = None
+            entries = pickle.dumps((new_diskfile, header, instrument))
+    except Exception as err:
+        return (path, None, None, None, None,
+                "{}: {}".format(type(err).__name__, err))
+
+    return path, stat.st_size, stat.st_mtime, md5, entries, None
+
+
+class _RecordingDict(dict):
+    """A dictionary that records the keys that have been looked up"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.used = set()
+
+    def __getitem__(self, key):
+        self.used.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.used.add(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.used.add(key)
+        return super().get(key, default)
+
+
+def _key_value(name, value):
+    if name == 'ut_datetime' and value is not None:
+        epoch = datetime.datetime(2000, 1, 1)
+        return (value - epoch).total_seconds() // CACHE_TIME_RESOLUTION
+    return value
+
+
+def search_key(caltype, descriptors, tags, howmany, names=None):
+    """Key for the calibration search cache. If `names` is provided, only
+    those descriptors are part of the key. Without `names`, this is the key
+    shared by all the requests for a caltype and tags, under which the sets
+    of descriptors used by their searches are stored."""
+    key = [caltype, howmany, sorted(tags)]
+    if names is not None:
+        key.append([(name, _key_value(name, descriptors.get(name)))
+                    for name in sorted(names)])
+    key = json.dumps(key, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _copy_result(result):
+    """Copies the lists of a calibration search result"""
+    return tuple(list(item) if isinstance(item, list) else item
+                 for item in result)
+
+
 class LocalManager:
     def __init__(self, db_path):
         if isdir(db_path):
@@ -83,6 +196,9 @@ class LocalManager:
         else:
             self._db_path = db_path
         self.session = None
+        self._search_cache = {}
+        self._search_names = {}
+        self._cache_generation = None
         self._reset()
 
     @property
@@ -110,6 +226,10 @@ class LocalManager:
         reload(diskfile)
         reload(createtables)
         reload(dbtools)
+        # Configure the new mappers now, while the classes they refer to
+        # are alive. Otherwise, once the classes replaced by the reload are
+        # collected, configuring any mapper would fail.
+        configure_mappers()
 
         self.session = orm.sessionfactory()
 
@@ -143,6 +263,7 @@ class LocalManager:
 
         try:
             createtables.create_tables(self.session)
+            self._create_cache_tables()
             self.session.commit()
         except OperationalError:
             message = "There was an error when trying to create the database. "
@@ -161,6 +282,98 @@ class LocalManager:
             Path to the file. It can be either absolute or relative
         """
         dbtools.remove_file(self.session, path)
+        self._create_ingest_table()
+        self.session.execute(text("DELETE FROM ingested_files "
+                                  "WHERE name = :name"),
+                             {'name': basename(path)})
+        self._bump_generation()
+        self.session.commit()
+
+    def _create_cache_tables(self):
+        """Creates (if needed) the tables for the calibration search cache.
+        `cache_generation` holds a counter that is increased every time that
+        the content of the database changes, invalidating the cache."""
+        self.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS cache_generation "
+            "(generation INTEGER NOT NULL)"))
+        self.session.execute(text(
+            "INSERT INTO cache_generation (generation) SELECT 0 "
+            "WHERE NOT EXISTS (SELECT 1 FROM cache_generation)"))
+        self.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, generation INTEGER, result TEXT)"))
+        self.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_names ("
+            "key TEXT, generation INTEGER, names TEXT, "
+            "PRIMARY KEY (key, names))"))
+
+    def _bump_generation(self):
+        self._create_cache_tables()
+        self.session.execute(text(
+            "UPDATE cache_generation SET generation = generation + 1"))
+        self.session.execute(text("DELETE FROM search_cache"))
+        self.session.execute(text("DELETE FROM search_names"))
+
+    def _generation(self):
+        self._create_cache_tables()
+        return self.session.execute(text(
+            "SELECT generation FROM cache_generation")).scalar()
+
+    def _create_ingest_table(self):
+        """Creates (if needed) the table that records the size and
+        modification time of the ingested files. This is the information
+        used by `ingest_directory` to skip files that haven't changed.
+        """
+        self.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS ingested_files ("
+            "path TEXT PRIMARY KEY, name TEXT, size INTEGER, mtime REAL, "
+            "md5 TEXT)"))
+
+    def _record_ingested(self, records):
+        self.session.execute(text(
+            "INSERT OR REPLACE INTO ingested_files (path, name, size, mtime, md5) "
+            "VALUES (:path, :name, :size, :mtime, :md5)"),
+            [dict(path=path, name=basename(path), size=size, mtime=mtime,
+                  md5=md5) for (path, size, mtime, md5) in records])
+
+    def _ingested_files(self):
+        self._create_ingest_table()
+        query = "SELECT path, size, mtime, md5 FROM ingested_files"
+        return {row[0]: tuple(row[1:])
+                for row in self.session.execute(text(query))}
+
+    def _checksums(self, paths):
+        """Returns the MD5 checksums that `dbtools` computed when ingesting
+        the files, as a dictionary keyed on the (absolute) path"""
+        DiskFile = diskfile.DiskFile
+        query = (self.session.query(DiskFile.path, DiskFile.filename,
+                                    DiskFile.file_md5)
+                 .filter(DiskFile.present == True)
+                 .filter(DiskFile.filename.in_({basename(p) for p in paths})))
+        return {os.path.join(path, filename): md5
+                for (path, filename, md5) in query}
+
+    @contextmanager
+    def _transaction(self):
+        """Within this context, `self.session` is bound to a connection
+        on which a transaction has already begun. The commits issued by
+        `dbtools` don't end that transaction, which is committed when the
+        context exits, or rolled back if an exception is raised."""
+        self.session.commit()
+        connection = self.session.get_bind().connect()
+        transaction = connection.begin()
+        session, self.session = self.session, Session(bind=connection)
+        try:
+            yield
+            self.session.flush()
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+        finally:
+            self.session.close()
+            connection.close()
+            self.session = session
 
     def ingest_file(self, path):
         """Registers a file into the database
@@ -180,9 +393,91 @@ class LocalManager:
             self.remove_file(path)
             raise err
 
-    def ingest_directory(self, path, walk=False, log=None):
+        path = abspath(path)
+        stat = os.stat(path)
+        self._create_ingest_table()
+        self._record_ingested([(path, stat.st_size, stat.st_mtime,
+                                self._checksums([path]).get(path))])
+        self._bump_generation()
+        self.session.commit()
+
+    def _add_entries(self, path, md5, entries):
+        """Adds the entries prepared by `_scan_file` for a file to the
+        database, replacing any earlier version of the file in the same way
+        as `dbtools.ingest_file`."""
+        File, DiskFile = file.File, diskfile.DiskFile
+        filename = basename(path)
+        fileobj = (self.session.query(File)
+                   .filter(File.name == File.trim_name(filename))
+                   .one_or_none())
+        if fileobj is None:
+            fileobj = File(filename)
+            self.session.add(fileobj)
+            self.session.flush()
+        else:
+            old_diskfiles = (self.session.query(DiskFile)
+                             .filter(DiskFile.file_id == fileobj.id)
+                             .filter(or_(DiskFile.present == True,
+                                         DiskFile.canonical == True))
+                             .all())
+            if any(old.present and old.file_md5 == md5
+                   for old in old_diskfiles):
+                return  # this version is in the database already
+            for old in old_diskfiles:
+                old.present = old.canonical = False
+
+        new_diskfile, header, instrument = pickle.loads(entries)
+        new_diskfile.file_id = fileobj.id
+        self.session.add(new_diskfile)
+        self.session.flush()
+        header.diskfile_id = new_diskfile.id
+        self.session.add(header)
+        if instrument is not None:
+            self.session.add(instrument)
+
+    def _ingest_batch(self, batch):
+        """Registers a list of files in a single transaction. If any of
+        them fails, the transaction is rolled back and the files are
+        ingested one by one.
+
+        Parameters
+        ----------
+        batch: list of tuples
+            (path, size, mtime, md5, entries) for each file, as returned
+            by `_scan_file`
+
+        Returns
+        -------
+        list of tuples
+            (path, error message) for the files that couldn't be ingested
+        """
+        try:
+            with self._transaction():
+                for path, _, _, md5, entries in batch:
+                    self._add_entries(path, md5, entries)
+                self._create_ingest_table()
+                self._record_ingested([(path, size, mtime, md5)
+                                       for path, size, mtime, md5, _ in batch])
+                self._bump_generation()
+            return []
+        except Exception as err:
+            if len(batch) == 1:
+                return [(batch[0][0], "{}: {}".format(type(err).__name__,
+                                                      err))]
+
+        return [error for item in batch for error in self._ingest_batch([item])]
+
+    def ingest_directory(self, path, walk=False, log=None, processes=None,
+                         batch_size=INGEST_BATCH_SIZE):
         """Registers into the database all FITS files under a directory
 
+        Files that were already ingested, and whose size and modification
+        time haven't changed since, are skipped. The rest are read by a pool
+        of processes, which compute their checksums and read their headers
+        (skipping those whose contents haven't changed). The main process
+        then inserts the resulting entries in batches, each in a single
+        transaction, while the pool carries on reading.
+
         Parameters
         ----------
         path: <str>, optional
@@ -199,17 +494,93 @@ class LocalManager:
             a message string. This function can then process the message
             and log it into the proper place.
 
+        processes: <int>, optional
+            Number of worker processes. Defaults to the number of CPUs.
+
+        batch_size: <int>, optional
+            Number of files registered per transaction.
+
+        Returns
+        -------
+        IngestStats
+            Number of files ingested, skipped (unchanged) and failed, the
+            total size of the ingested files, and the elapsed time.
+
         """
+        start = time.time()
+        known = self._ingested_files()
+        to_scan, skipped = [], 0
         for root, dirs, files in os.walk(path):
-            for fname in [l for l in files if l.endswith('.fits')]:
-                self.ingest_file(os.path.join(root, fname))
-                if log:
-                    log("Ingested {}/{}".format(root, fname))
+            for fname in sorted(l for l in files if l.endswith('.fits')):
+                fullpath = abspath(os.path.join(root, fname))
+                stat = os.stat(fullpath)
+                record = known.get(fullpath)
+                if record is None or record[2] is None:
+                    to_scan.append((fullpath, None))
+                elif record[:2] == (stat.st_size, stat.st_mtime):
+                    skipped += 1
+                else:
+                    to_scan.append((fullpath, record[2]))
+            if not walk:
+                break
+
+        failed = []
+        ingested = nbytes = 0
+
+        def ingest(batch):
+            nonlocal ingested, nbytes
+            errors = self._ingest_batch(batch)
+            failed.extend(errors)
+            bad = {p for (p, _) in errors}
+            for (fpath, size, _, _, _) in batch:
+                if fpath not in bad:
+                    ingested += 1
+                    nbytes += size
+                    if log:
+                        log("Ingested {}".format(fpath))
+
+        if to_scan:
+            batch = []
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for (fpath, size, mtime, md5, entries, error) in executor.map(
+                        _scan_file, *zip(*to_scan), chunksize=8):
+                    if error is not None:
+                        failed.append((fpath, error))
+                    elif entries is None:
+                        # Touched but not modified: just update the record
+                        self._record_ingested([(fpath, size, mtime, md5)])
+                        skipped += 1
+                    else:
+                        batch.append((fpath, size, mtime, md5, entries))
+                        if len(batch) == batch_size:
+                            ingest(batch)
+                            batch = []
+                if batch:
+                    ingest(batch)
+            self.session.commit()
+
+        stats = IngestStats(ingested, skipped, len(failed), nbytes,
+                            time.time() - start)
+        if log:
+            for fpath, error in failed:
+                log("Could not ingest {}: {}".format(fpath, error))
+            rate = stats.ingested / stats.seconds if stats.seconds else 0.
+            log("Ingested {} files ({:.1f} MB) in {:.1f}s ({:.1f} files/s); "
+                "{} unchanged, {} failed".format(
+                    stats.ingested, stats.nbytes / 2**20, stats.seconds,
+                    rate, stats.skipped, stats.failed))
+        return stats
 
     def calibration_search(self, rq, howmany=1, fullResult=False):
         """
         Performs a search in the database using the requested criteria.
 
+        The results are cached, both in memory and in the database, keyed
+        on the caltype and tags of the request, and the descriptors that the
+        calibration rules use (see `CACHE_TIME_RESOLUTION`). The cache is invalidated whenever files are added to or
+        removed from the database. Each call returns new lists, which the
+        caller is free to modify.
+
         Parameters
         ----------
         rq: <instance>, CalibrationRequest
@@ -240,15 +611,89 @@ class LocalManager:
         types = rq.tags
         log.stdinfo("LOCAL CALIBRATION SEARCH:")
 
-        if "ut_datetime" in descripts:
-            utc = descripts["ut_datetime"]
-            descripts.update({"ut_datetime":utc})
+        try:
+            generation = self._generation()
+        except OperationalError:
+            # Can't use the cache (eg. read-only database)
+            self.session.rollback()
+            return self._calibration_query(caltype, dict(descripts), types,
+                                           howmany)
+
+        if generation != self._cache_generation:
+            self._search_cache.clear()
+            self._search_names.clear()
+            self._cache_generation = generation
+
+        names_key = search_key(caltype, descripts, types, howmany)
+        for names in self._cached_names(names_key, generation):
+            result = self._cached_result(
+                search_key(caltype, descripts, types, howmany, names),
+                generation)
+            if result is not None:
+                return _copy_result(result)
+
+        recorder = _RecordingDict(descripts)
+        result = self._calibration_query(caltype, recorder, types, howmany)
+        # The extra descriptors are set from the tags, which are in the key
+        names = sorted(recorder.used - set(extra_descript.values()))
+        key = search_key(caltype, descripts, types, howmany, names)
+        known_names = self._search_names.setdefault(names_key, [])
+        if names not in known_names:
+            known_names.append(names)
+        self._search_cache[key] = result
+        try:
+            self.session.execute(
+                text("INSERT OR REPLACE INTO search_names "
+                     "(key, generation, names) "
+                     "VALUES (:key, :generation, :names)"),
+                {'key': names_key, 'generation': generation,
+                 'names': json.dumps(names)})
+            self.session.execute(
+                text("INSERT OR REPLACE INTO search_cache "
+                     "(key, generation, result) "
+                     "VALUES (:key, :generation, :result)"),
+                {'key': key, 'generation': generation,
+                 'result': json.dumps(result)})
+            self.session.commit()
+        except OperationalError:
+            self.session.rollback()
 
+        return _copy_result(result)
+
+    def _cached_names(self, names_key, generation):
+        """Returns the lists of descriptors used by the cached searches for
+        a caltype and tags, loading them from the database the first time"""
+        if names_key not in self._search_names:
+            rows = self.session.execute(
+                text("SELECT names FROM search_names "
+                     "WHERE key = :key AND generation = :generation"),
+                {'key': names_key, 'generation': generation})
+            self._search_names[names_key] = [json.loads(row[0])
+                                             for row in rows]
+        return list(self._search_names[names_key])
+
+    def _cached_result(self, key, generation):
+        """Returns a cached search result, or None if there isn't one"""
+        try:
+            return self._search_cache[key]
+        except KeyError:
+            pass
+
+        row = self.session.execute(
+            text("SELECT result FROM search_cache "
+                 "WHERE key = :key AND generation = :generation"),
+            {'key': key, 'generation': generation}).fetchone()
+        if row is not None:
+            self._search_cache[key] = result = tuple(json.loads(row[0]))
+            return result
+
+    def _calibration_query(self, caltype, descripts, types, howmany):
+        """Queries the database for calibrations (see `calibration_search`).
+        The extra descriptors derived from the tags are added to `descripts`,
+        which must be a copy of the request's descriptors."""
         for (type_, desc) in list(extra_descript.items()):
             descripts[desc] = type_ in types
 
-        nones = [desc for (desc, value) in list(descripts.items()) if value is None]
-
         # Obtain a calibration manager object instantiated according to the
         # instrument.
         cal_obj = get_cal_object(self.session, filename=None, header=None,
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+import datetime
+import hashlib
+import os
+import pickle
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import astrodata
+import gemini_instruments
+
+pytest.importorskip('gemini_calmgr')
+
+from recipe_system.cal_service.localmanager import (LocalManager, _scan_file,
+                                                    search_key)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    mgr = LocalManager(str(tmp_path / 'cal_manager.db'))
+    mgr.init_database(wipe=True)
+    return mgr
+
+
+@pytest.fixture
+def queries(manager, monkeypatch):
+    calls = []
+
+    def fake_query(caltype, descripts, types, howmany):
+        # Like the calibration rules, only look at some descriptors
+        descripts['exposure_time'], descripts['ut_datetime']
+        calls.append(dict(descripts))
+        return ['file://{}.fits'.format(len(calls))], ['md5']
+
+    monkeypatch.setattr(manager, '_calibration_query', fake_query)
+    return calls
+
+
+def make_request(**descriptors):
+    descripts = {'ut_datetime': datetime.datetime(2020, 1, 1, 3, 0, 0),
+                 'exposure_time': 10.25, 'data_label': 'GS-2020A-Q-1-1-001'}
+    descripts.update(descriptors)
+    return SimpleNamespace(caltype='processed_bias', descriptors=descripts,
+                           tags={'GMOS', 'IMAGE'})
+
+
+def test_search_key():
+    names = ['exposure_time', 'ut_datetime']
+    rq1 = make_request()
+    rq2 = make_request(ut_datetime=datetime.datetime(2020, 1, 1, 3, 50, 0),
+                       data_label='GS-2020A-Q-1-1-002')
+    rq3 = make_request(exposure_time=10.2501)
+    rq4 = make_request(ut_datetime=datetime.datetime(2020, 1, 1, 4, 0, 0))
+    keys = [search_key(rq.caltype, rq.descriptors, rq.tags, 1, names)
+            for rq in (rq1, rq2, rq3, rq4)]
+    assert keys[0] == keys[1]
+    assert len(set(keys)) == 3
+    assert len({search_key(rq.caltype, rq.descriptors, rq.tags, 1)
+                for rq in (rq1, rq2, rq3, rq4)}) == 1
+
+
+def test_calibration_search_queries_exact_descriptors(manager, queries):
+    rq = make_request()
+    manager.calibration_search(rq)
+    assert len(queries) == 1
+    for desc, value in rq.descriptors.items():
+        assert queries[0][desc] == value
+
+
+def test_calibration_search_is_cached(manager, queries):
+    first = manager.calibration_search(make_request())
+    # Another frame, taken a little later
+    second = manager.calibration_search(make_request(
+        ut_datetime=datetime.datetime(2020, 1, 1, 3, 20, 0),
+        data_label='GS-2020A-Q-1-1-002'))
+    assert len(queries) == 1
+    assert first == second
+
+    manager.calibration_search(make_request(exposure_time=20.))
+    assert len(queries) == 2
+    manager.calibration_search(
+        make_request(ut_datetime=datetime.datetime(2020, 1, 1, 4, 0, 0)))
+    assert len(queries) == 3
+
+    # The cache is kept in the database too
+    other = LocalManager(manager.path)
+    other._calibration_query = None  # must not be called
+    assert other.calibration_search(make_request()) == first
+
+
+def test_calibration_search_returns_copies(manager, queries):
+    result = manager.calibration_search(make_request())
+    result[0].append('file://other.fits')
+    assert manager.calibration_search(make_request()) == (
+        ['file://1.fits'], ['md5'])
+
+
+def make_file(path, number, value=0):
+    phu = fits.PrimaryHDU()
+    phu.header.update(OBSERVAT='Gemini-North', INSTRUME='NIRI',
+                      ORIGNAME='N20010101S{:04d}.fits'.format(number),
+                      DATALAB='GN-2001A-Q-1-1-{:03d}'.format(number),
+                      OBSTYPE='DARK', RA=0., DEC=0., EXPTIME=10.,
+                      COADDS=1)
+    ad = astrodata.create(phu)
+    ad.append(np.full((2, 2), value, dtype=np.float32))
+    ad.write(str(path / 'N20010101S{:04d}.fits'.format(number)),
+             overwrite=True)
+
+
+def test_scan_file(tmp_path):
+    make_file(tmp_path, 1)
+    fname = str(tmp_path / 'N20010101S0001.fits')
+    path, size, mtime, md5, entries, error = _scan_file(fname)
+    with open(fname, 'rb') as fileobj:
+        assert md5 == hashlib.md5(fileobj.read()).hexdigest()
+    assert (path, size, mtime, error) == (fname, os.path.getsize(fname),
+                                          os.path.getmtime(fname), None)
+    diskfile, header, instrument = pickle.loads(entries)
+    assert diskfile.file_md5 == md5
+    assert header.instrument == 'NIRI'
+    assert header.observation_type == 'DARK'
+    assert instrument.header is header
+
+    # Unchanged files aren't read
+    assert _scan_file(fname, md5)[4] is None
+    assert _scan_file(str(tmp_path / 'missing.fits'))[-1] is not None
+
+
+def test_ingest_directory(manager, tmp_path):
+    data = tmp_path / 'data'
+    data.mkdir()
+    for i in range(1, 6):
+        make_file(data, i)
+
+    stats = manager.ingest_directory(str(data), processes=2, batch_size=2)
+    assert (stats.ingested, stats.skipped, stats.failed) == (5, 0, 0)
+    assert len(list(manager.list_files())) == 5
+
+    # Checksums of the ingested files are recorded
+    known = manager._ingested_files()
+    assert all(record[2] is not None for record in known.values())
+
+    # Unchanged and touched (but unmodified) files are skipped
+    os.utime(str(data / 'N20010101S0001.fits'), (0, 1e9))
+    stats = manager.ingest_directory(str(data), processes=2, batch_size=2)
+    assert (stats.ingested, stats.skipped, stats.failed) == (0, 5, 0)
+
+    # Modified files are ingested again
+    make_file(data, 2, value=1)
+    os.utime(str(data / 'N20010101S0002.fits'), (0, 2e9))
+    stats = manager.ingest_directory(str(data), processes=2, batch_size=2)
+    assert (stats.ingested, stats.skipped, stats.failed) == (1, 4, 0)
+    assert len({f.name for f in manager.list_files()}) == 5
+
+
+def test_ingest_directory_bad_file(manager, tmp_path):
+    for i in range(1, 4):
+        make_file(tmp_path, i)
+    (tmp_path / 'N20010101S0009.fits').write_bytes(b'not a FITS file')
+
+    stats = manager.ingest_directory(str(tmp_path), processes=2,
+                                     batch_size=10)
+    assert (stats.ingested, stats.failed) == (3, 1)
+    assert sorted(f.name for f in manager.list_files()) == [
+        'N20010101S{:04d}.fits'.format(i) for i in range(1, 4)]
+
+
+def test_frames_share_cache_entry(manager, tmp_path):
+    phu = fits.PrimaryHDU()
+    phu.header.update(OBSERVAT='Gemini-North', INSTRUME='NIRI',
+                      ORIGNAME='N20010101S0001.fits',
+                      DATALAB='GN-2001A-Q-1-1-001', GEMPRGID='GN-2001A-Q-1',
+                      OBSTYPE='DARK', RA=0., DEC=0., EXPTIME=10., COADDS=1,
+                      LNRS=1, NDAVGS=1, A_VDDUC=0.4, A_VDET=1.0,
+                      **{'DATE-OBS': '2001-01-01', 'TIME-OBS': '03:00:00'})
+    ad = astrodata.create(phu)
+    ad.append(np.zeros((256, 256), dtype=np.int16))
+    ad.write(str(tmp_path / 'N20010101S0001.fits'))
+    manager.ingest_file(str(tmp_path / 'N20010101S0001.fits'))
+
+    calls = []
+    query = manager._calibration_query
+
+    def counting_query(*args):
+        calls.append(args)
+        return query(*args)
+
+    manager._calibration_query = counting_query
+
+    def science_request(number, minute):
+        descriptors = {
+            'instrument': 'NIRI', 'observation_type': 'OBJECT',
+            'observation_class': 'science', 'spectroscopy': False,
+            'data_section': 'Section(x1=0, x2=256, y1=0, y2=256)',
+            'read_mode': 'High Background', 'well_depth_setting': 'Shallow',
+            'filter_name': 'J_G0202', 'coadds': 1, 'exposure_time': 10.,
+            'ut_datetime': datetime.datetime(2001, 1, 1, 3, minute),
+            'data_label': 'GN-2001A-Q-1-1-{:03d}'.format(number)}
+        return SimpleNamespace(caltype='dark', descriptors=descriptors,
+                               tags={'NIRI', 'IMAGE'})
+
+    results = [manager.calibration_search(science_request(number, minute))
+               for number, minute in ((2, 10), (3, 20))]
+    assert len(calls) == 1
+    assert results[0] == results[1]
+    assert results[0][0] == ['file://{}'.format(tmp_path /
+                                                'N20010101S0001.fits')]
@@ -302,3 +302,78 @@ def environment_variable_name(section, option):
 
 
 globalConf = ConfigObject()
+
+# ------------------------------------------------------------------------------
+# BEGIN Setting up the reduce section for config files
+REDUCE_SECTION = 'reduce'
+
+globalConf.update_translation({
+    (REDUCE_SECTION, 'workers'): int
+})
+
+globalConf.update_exports({
+    REDUCE_SECTION: ('workers', 'mask_cache')
+})
+# END Setting up the reduce section for config files
+# ------------------------------------------------------------------------------
+
+
+def get_workers():
+    """
+    Returns the maximum number of worker threads that a reduction can use
+    for operations that are run in parallel. This is taken from the
+    `workers` option of the `[reduce]` section of the config file, e.g.::
+
+        [reduce]
+        workers = 4
+
+    which can be overridden by the `_GEM_REDUCE_WORKERS` environment
+    variable. If neither is set, the number of CPUs is used.
+
+    Returns
+    -------
+    <int>
+
+    """
+    workers = os.environ.get(environment_variable_name(REDUCE_SECTION,
+                                                       'workers'))
+    if workers is None:
+        try:
+            workers = globalConf[REDUCE_SECTION].workers
+        except (KeyError, AttributeError):
+            pass
+    try:
+        workers = int(workers)
+    except (TypeError, ValueError):
+        workers = 0
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def get_mask_cache():
+    """
+    Returns the directory in which the pixel planes of the static masks
+    (BPMs and illumination masks) are saved, so they can be memory-mapped
+    and shared by all the processes that reduce data. This is taken from
+    the `mask_cache` option of the `[reduce]` section of the config file,
+    e.g.::
+
+        [reduce]
+        mask_cache = ~/.geminidr/masks
+
+    which can be overridden by the `_GEM_REDUCE_MASK_CACHE` environment
+    variable. If neither is set, None is returned, and each process keeps
+    its own copy of the masks in memory.
+
+    Returns
+    -------
+    <str> or None
+
+    """
+    directory = os.environ.get(environment_variable_name(REDUCE_SECTION,
+                                                         'mask_cache'))
+    if directory is None:
+        try:
+            directory = globalConf[REDUCE_SECTION].mask_cache
+        except (KeyError, AttributeError):
+            pass
+    return os.path.expanduser(directory) if directory else None